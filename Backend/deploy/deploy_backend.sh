@@ -26,7 +26,7 @@ echo "[6/8] Running Django system checks"
 "$VENV_PYTHON" manage.py check --deploy
 
 echo "[7/8] Restarting services"
-sudo systemctl restart gunicorn
+sudo systemctl restart gunicorn gunicorn-asgi
 sudo systemctl reload nginx
 
 echo "[8/8] Health checks"
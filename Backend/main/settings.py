@@ -125,6 +125,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',  # Full-text search fields used by video search
     'api',
     'rest_framework',
     'corsheaders',  # For handling CORS
@@ -297,6 +298,58 @@ if AZURE_STORAGE_CONNECTION_STRING or (AZURE_ACCOUNT_NAME and AZURE_ACCOUNT_KEY)
         },
     }
 
+# Certificates are rendered once and then served from default storage.
+# Redirecting hands the download to the storage URL instead of streaming it through a worker.
+CERTIFICATE_REDIRECT_TO_STORAGE = os.getenv('CERTIFICATE_REDIRECT_TO_STORAGE', 'false').strip().lower() == 'true'
+CERTIFICATE_CACHE_MAX_AGE = int(os.getenv('CERTIFICATE_CACHE_MAX_AGE', '86400'))
+
+# Pooled upstream client for the lesson stream proxy (see video/upstream.py)
+VIDEO_UPSTREAM_POOL_MAXSIZE = int(os.getenv('VIDEO_UPSTREAM_POOL_MAXSIZE', '8'))  # keep-alive connections per host
+VIDEO_UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('VIDEO_UPSTREAM_CONNECT_TIMEOUT', '5'))
+VIDEO_UPSTREAM_READ_TIMEOUT = float(os.getenv('VIDEO_UPSTREAM_READ_TIMEOUT', '120'))
+VIDEO_UPSTREAM_HEAD_TIMEOUT = float(os.getenv('VIDEO_UPSTREAM_HEAD_TIMEOUT', '30'))
+
+# Async stream proxy (video/async_stream.py): set on the uvicorn workers only,
+# see deploy/gunicorn-asgi.service. Each open stream holds one upstream connection.
+VIDEO_STREAM_ASYNC = os.getenv('VIDEO_STREAM_ASYNC', 'False').lower() in ('true', '1', 'yes')
+VIDEO_UPSTREAM_ASYNC_MAX_CONNECTIONS = int(os.getenv('VIDEO_UPSTREAM_ASYNC_MAX_CONNECTIONS', '500'))
+
+# Stream admission control (video/stream_limits.py). The per-process cap keeps two sync
+# threads free for API calls, so it follows GUNICORN_THREADS (the --threads value in
+# deploy/gunicorn.service and the Procfile); the ASGI stream service raises it.
+# Global cap needs Redis.
+GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', '4'))
+VIDEO_STREAM_MAX_PER_PROCESS = int(os.getenv('VIDEO_STREAM_MAX_PER_PROCESS', str(max(GUNICORN_THREADS - 2, 1))))
+VIDEO_STREAM_MAX_PER_USER = int(os.getenv('VIDEO_STREAM_MAX_PER_USER', '3'))
+VIDEO_STREAM_MAX_GLOBAL = int(os.getenv('VIDEO_STREAM_MAX_GLOBAL', '0'))
+VIDEO_STREAM_RETRY_AFTER = int(os.getenv('VIDEO_STREAM_RETRY_AFTER', '5'))  # seconds
+VIDEO_STREAM_SLOT_TTL = int(os.getenv('VIDEO_STREAM_SLOT_TTL', '3600'))  # leaked-slot expiry
+
+# Stream telemetry (video/stream_metrics.py): rows are buffered per process and
+# bulk inserted. Report with `python manage.py stream_report`.
+VIDEO_STREAM_METRICS = os.getenv('VIDEO_STREAM_METRICS', 'True').lower() in ('true', '1', 'yes')
+VIDEO_STREAM_METRICS_BATCH = int(os.getenv('VIDEO_STREAM_METRICS_BATCH', '100'))
+VIDEO_STREAM_METRICS_FLUSH_SECONDS = int(os.getenv('VIDEO_STREAM_METRICS_FLUSH_SECONDS', '30'))
+
+# Write-behind buffer for watch positions (video/position_buffer.py): shared through
+# Redis when REDIS_URL is set, per process otherwise.
+VIDEO_POSITION_BUFFER = os.getenv('VIDEO_POSITION_BUFFER', 'True').lower() in ('true', '1', 'yes')
+VIDEO_POSITION_FLUSH_SECONDS = int(os.getenv('VIDEO_POSITION_FLUSH_SECONDS', '30'))
+
+# On-disk cache of aligned video chunks for the sync stream proxy (video/chunk_cache.py).
+# Empty dir disables it; the directory can be shared by all workers on a host.
+VIDEO_CHUNK_CACHE_DIR = os.getenv('VIDEO_CHUNK_CACHE_DIR', '').strip()
+VIDEO_CHUNK_CACHE_MAX_BYTES = int(os.getenv('VIDEO_CHUNK_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))
+VIDEO_CHUNK_SIZE = int(os.getenv('VIDEO_CHUNK_SIZE', str(2 * 1024 ** 2)))
+
+# Lesson stream delivery: 'proxy' streams bytes through the API, 'redirect' answers
+# with a 302 to a read-only SAS URL (see video/blob.py). Lessons can override it.
+VIDEO_STREAM_MODE = os.getenv('VIDEO_STREAM_MODE', 'proxy').strip().lower()
+VIDEO_SAS_TTL_SECONDS = int(os.getenv('VIDEO_SAS_TTL_SECONDS', '7200'))
+VIDEO_SAS_REFRESH_MARGIN_SECONDS = int(os.getenv('VIDEO_SAS_REFRESH_MARGIN_SECONDS', '3600'))
+# Cached size/ETag of lesson blobs; refreshed by upstream GETs, dropped when video_url changes
+VIDEO_BLOB_META_TTL = int(os.getenv('VIDEO_BLOB_META_TTL', '3600'))
+
 REDIS_URL = os.getenv('REDIS_URL', '').strip()
 if REDIS_URL:
     CACHES = {
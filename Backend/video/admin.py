@@ -1,5 +1,9 @@
 from django.contrib import admin
-from .models import Video, Course, Lesson, Discussion, Resource, UserProgress, UserNotes, Rating, Enrollment, UserXP, DailyXP
+from .models import (
+    Video, Course, Lesson, Discussion, Resource, UserProgress, UserCourseProgress,
+    UserNotes, Rating, Enrollment, UserXP, DailyXP, XPEvent, StreamMetric
+)
+from .progress import refresh_course_progress
 
 
 # ========== INLINE ADMINS ==========
@@ -7,7 +11,8 @@ class LessonInline(admin.TabularInline):
     """Inline admin for lessons within a course"""
     model = Lesson
     extra = 1
-    fields = ['title', 'duration', 'time_xp', 'video_url', 'order']
+    fields = ['title', 'duration', 'duration_seconds', 'time_xp', 'xp_value', 'video_url', 'order']
+    readonly_fields = ['duration_seconds', 'xp_value']
     ordering = ['order']
 
 
@@ -59,17 +64,19 @@ class CourseAdmin(admin.ModelAdmin):
 
 @admin.register(Lesson)
 class LessonAdmin(admin.ModelAdmin):
-    list_display = ['title', 'course', 'order', 'duration', 'created_at']
+    list_display = ['title', 'course', 'order', 'duration', 'duration_seconds', 'xp_value', 'created_at']
     list_filter = ['course', 'created_at']
     search_fields = ['title', 'course__title']
     ordering = ['course', 'order']
+    # Parsed from duration / time_xp on save
+    readonly_fields = ['duration_seconds', 'xp_value']
     
     fieldsets = (
         ('Basic Information', {
             'fields': ('course', 'title', 'order')
         }),
         ('Video Details', {
-            'fields': ('video_url', 'thumbnail_url', 'duration', 'time_xp')
+            'fields': ('video_url', 'thumbnail_url', 'duration', 'duration_seconds', 'time_xp', 'xp_value')
         }),
     )
 
@@ -100,6 +107,50 @@ class UserProgressAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('user', 'course', 'lesson')
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        refresh_course_progress(obj.user_id, obj.course_id)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        refresh_course_progress(obj.user_id, obj.course_id)
+
+
+@admin.register(UserCourseProgress)
+class UserCourseProgressAdmin(admin.ModelAdmin):
+    """Read-only: rows are maintained by video/progress.py (rebuild_course_progress to recompute)"""
+    list_display = ['user', 'course', 'completed_lessons', 'total_lessons', 'last_lesson', 'updated_at']
+    list_filter = ['course', 'updated_at']
+    search_fields = ['user__username', 'course__title']
+    readonly_fields = ['user', 'course', 'completed_lessons', 'total_lessons', 'last_lesson', 'updated_at']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user', 'course', 'last_lesson')
+
+
+@admin.register(XPEvent)
+class XPEventAdmin(admin.ModelAdmin):
+    """Read-only ledger: awards come from mark_complete (rebuild_xp_totals to recompute totals)"""
+    list_display = ['user', 'lesson', 'amount', 'awarded_at']
+    list_filter = ['awarded_at']
+    search_fields = ['user__username', 'lesson__title']
+    readonly_fields = ['user', 'lesson', 'amount', 'awarded_at']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user', 'lesson')
+
+
+@admin.register(StreamMetric)
+class StreamMetricAdmin(admin.ModelAdmin):
+    """Read-only: rows are written by video/stream_metrics.py (stream_report to summarize)"""
+    list_display = ['lesson', 'status_code', 'range_start', 'connect_ms', 'ttfb_ms', 'duration_ms', 'bytes_sent', 'aborted', 'created_at']
+    list_filter = ['aborted', 'status_code', 'created_at']
+    search_fields = ['lesson__title']
+    readonly_fields = ['lesson', 'range_start', 'status_code', 'connect_ms', 'ttfb_ms', 'duration_ms', 'bytes_sent', 'aborted', 'created_at']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('lesson')
+
 
 @admin.register(UserNotes)
 class UserNotesAdmin(admin.ModelAdmin):
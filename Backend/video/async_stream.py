@@ -0,0 +1,262 @@
+"""
+Async lesson stream proxy for ASGI workers.
+
+The sync ``LessonViewSet.stream`` holds a gunicorn thread for the whole playback.
+This view does the same job on the event loop: the lesson lookup and checks are
+short, and the bytes are relayed by an async generator over a shared
+``httpx.AsyncClient``. One uvicorn worker can then keep hundreds of streams open.
+
+Backpressure: the generator reads the next upstream chunk only after the ASGI server
+has accepted the previous one, and uvicorn waits while the client's socket buffer is
+full. Nothing is buffered beyond a chunk per stream.
+
+Cancellation: when the viewer closes the tab or seeks, Django cancels the response
+task (or closes the response iterator it was consuming). UpstreamStreamingResponse
+closes the upstream response in both cases, which frees the connection at once
+instead of whenever the abandoned generator is garbage-collected.
+
+Enabled with ``VIDEO_STREAM_ASYNC`` (see video/urls.py and deploy/gunicorn-asgi.service).
+Timeouts and pool size reuse the VIDEO_UPSTREAM_* settings of video/upstream.py.
+"""
+import asyncio
+import time
+import weakref
+
+import httpx
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.http import require_http_methods
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .blob import (
+    STREAM_MODE_REDIRECT,
+    blob_head_response,
+    blob_metadata_from_response,
+    get_blob_metadata,
+    get_signed_blob_url,
+    remember_blob_metadata,
+    resolve_stream_mode,
+)
+from .models import Lesson
+from .stream_limits import acquire_stream_slot, retry_after_seconds
+from .stream_metrics import StreamMeasurement
+from .upstream import upstream_timeout
+
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+PASSTHROUGH_HEADERS = (
+    'Content-Length',
+    'Content-Range',
+    'Accept-Ranges',
+    'Cache-Control',
+    'ETag',
+    'Last-Modified',
+    'Content-Disposition',
+)
+
+# httpx clients are bound to the event loop that created them: one per loop.
+_clients = weakref.WeakKeyDictionary()
+
+
+def _timeout(method):
+    connect, read = upstream_timeout(method)
+    return httpx.Timeout(connect=connect, read=read, write=connect, pool=connect)
+
+
+def _build_client():
+    limits = httpx.Limits(
+        # Every open stream holds one upstream connection for its whole duration.
+        max_connections=int(getattr(settings, 'VIDEO_UPSTREAM_ASYNC_MAX_CONNECTIONS', 500)),
+        max_keepalive_connections=int(getattr(settings, 'VIDEO_UPSTREAM_POOL_MAXSIZE', 8)),
+    )
+    transport = httpx.AsyncHTTPTransport(
+        limits=limits,
+        # httpx retries connection failures only, which is safe for every method.
+        retries=int(getattr(settings, 'VIDEO_UPSTREAM_HEAD_RETRIES', 2)),
+    )
+    return httpx.AsyncClient(
+        transport=transport,
+        timeout=_timeout('GET'),
+    )
+
+
+def get_async_upstream_client():
+    """Return the pooled AsyncClient for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = _build_client()
+    return client
+
+
+def _connect_tracer():
+    """httpx trace hook timing TCP+TLS setup; the timing stays 0 on a reused connection."""
+    timing = {'started': None, 'seconds': 0.0}
+
+    async def trace(event_name, info):
+        if event_name == 'connection.connect_tcp.started':
+            timing['started'] = time.monotonic()
+        elif event_name in ('connection.connect_tcp.complete', 'connection.start_tls.complete'):
+            if timing['started'] is not None:
+                timing['seconds'] = time.monotonic() - timing['started']
+
+    return trace, timing
+
+
+def _range_headers(request):
+    range_value = (request.headers.get('Range') or '').strip()
+    return {'Range': range_value, 'x-ms-range': range_value} if range_value else {}
+
+
+def _copy_headers(upstream, response):
+    for header in PASSTHROUGH_HEADERS:
+        value = upstream.headers.get(header)
+        if value:
+            response[header] = value
+    # Always advertise byte-range support so browsers enable the seek bar
+    response['Accept-Ranges'] = upstream.headers.get('Accept-Ranges', 'bytes')
+
+
+class UpstreamStreamingResponse(StreamingHttpResponse):
+    """
+    Relays an httpx streaming response; closes it, frees the stream slot and records
+    the measurement when iteration stops for any reason, or when the response is
+    closed without ever being iterated.
+    """
+
+    def __init__(self, upstream, slot, measurement, **kwargs):
+        self.upstream = upstream
+        self.slot = slot
+        self.measurement = measurement
+        super().__init__(streaming_content=upstream.aiter_bytes(STREAM_CHUNK_SIZE), **kwargs)
+
+    async def __aiter__(self):
+        # The ASGI handler closes this iterator (or cancels the task awaiting it) on
+        # disconnect; StreamingHttpResponse would not pass that on to the upstream.
+        completed = False
+        try:
+            async for part in super().__aiter__():
+                self.measurement.sent(len(part))
+                yield part
+            completed = True
+        finally:
+            await self.upstream.aclose()
+            await sync_to_async(self.slot.release)()
+            await sync_to_async(self.measurement.finish)(aborted=not completed)
+
+    def close(self):
+        # The ASGI handler calls this from a worker thread once the request is over,
+        # including a client that disconnected before the body started, when the
+        # generator above never ran. Release and finish are idempotent.
+        self.slot.release()
+        if not self.upstream.is_closed:
+            async_to_sync(self.upstream.aclose)()
+        self.measurement.finish(aborted=True)
+        super().close()
+
+
+async def _remember_metadata(video_url, upstream):
+    metadata = blob_metadata_from_response(upstream.status_code, upstream.headers)
+    if metadata is not None:
+        await sync_to_async(remember_blob_metadata)(video_url, metadata)
+
+
+def _authenticate(request):
+    # request.auser() only knows the session; resolve JWT users the way the sync DRF
+    # view does, so stream caps count them per user rather than per client IP.
+    authenticators = [authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    return Request(request, authenticators=authenticators).user
+
+
+@require_http_methods(['GET', 'HEAD'])
+async def stream_lesson(request, pk):
+    """Async counterpart of LessonViewSet.stream, with the same modes and responses."""
+    try:
+        lesson = await Lesson.objects.only('id', 'video_url', 'stream_mode').aget(pk=pk)
+    except Lesson.DoesNotExist:
+        return JsonResponse({'detail': 'No Lesson matches the given query.'}, status=404)
+
+    video_url = (lesson.video_url or '').strip()
+    if not video_url:
+        return JsonResponse({'error': 'Lesson has no video URL'}, status=404)
+    if not (httpx.URL(video_url).host or '').lower().endswith('.blob.core.windows.net'):
+        return JsonResponse({'error': 'Stream endpoint supports Azure Blob URLs only'}, status=400)
+
+    try:
+        user = await sync_to_async(_authenticate)(request)
+    except AuthenticationFailed as exc:
+        return JsonResponse({'detail': str(exc.detail)}, status=exc.status_code)
+
+    if resolve_stream_mode(lesson, request) == STREAM_MODE_REDIRECT:
+        if not user.is_authenticated:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+        signed_url = await sync_to_async(get_signed_blob_url)(video_url)
+        if signed_url:
+            response = HttpResponseRedirect(signed_url)
+            response['Cache-Control'] = 'private, max-age=60'
+            return response
+
+    metadata = await sync_to_async(get_blob_metadata)(video_url)
+    if metadata is not None:
+        not_modified = get_conditional_response(request, etag=metadata['etag'])
+        if not_modified is not None:
+            return not_modified
+        if request.method == 'HEAD':
+            return blob_head_response(metadata)
+
+    client = get_async_upstream_client()
+
+    if request.method == 'HEAD':
+        try:
+            upstream = await client.head(
+                video_url, headers=_range_headers(request), timeout=_timeout('HEAD'), follow_redirects=True
+            )
+        except httpx.HTTPError:
+            return HttpResponse(status=502)
+        await _remember_metadata(video_url, upstream)
+        response = HttpResponse(
+            status=upstream.status_code,
+            content_type=upstream.headers.get('Content-Type', 'video/mp4'),
+        )
+        _copy_headers(upstream, response)
+        return response
+
+    slot = await sync_to_async(acquire_stream_slot)(request, user)
+    if slot is None:
+        response = JsonResponse({'error': 'Too many active video streams, please retry shortly'}, status=503)
+        response['Retry-After'] = str(retry_after_seconds())
+        return response
+
+    measurement = StreamMeasurement(lesson.id, request.headers.get('Range'))
+    trace, connect_timing = _connect_tracer()
+    try:
+        upstream = await client.send(
+            client.build_request('GET', video_url, headers=_range_headers(request), extensions={'trace': trace}),
+            stream=True,
+        )
+    except BaseException as exc:
+        await sync_to_async(slot.release)()
+        if not isinstance(exc, httpx.HTTPError):
+            raise
+        measurement.upstream_response(502, connect_timing['seconds'])
+        await sync_to_async(measurement.finish)(aborted=False)
+        return JsonResponse({'error': f'Unable to reach video source: {exc}'}, status=502)
+    measurement.upstream_response(upstream.status_code, connect_timing['seconds'])
+    await _remember_metadata(video_url, upstream)
+
+    response = UpstreamStreamingResponse(
+        upstream,
+        slot,
+        measurement,
+        status=upstream.status_code,
+        content_type=upstream.headers.get('Content-Type', 'video/mp4'),
+    )
+    _copy_headers(upstream, response)
+    # Ask nginx not to buffer stream responses; buffering makes seeks feel delayed.
+    response['X-Accel-Buffering'] = 'no'
+    return response
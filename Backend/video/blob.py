@@ -0,0 +1,174 @@
+"""
+Azure Blob helpers for lesson videos: short-lived read-only SAS URLs, and a
+metadata cache that answers HEAD and If-None-Match without asking Azure.
+
+In ``redirect`` stream mode the stream endpoint answers with a 302 to one of these
+URLs, so video bytes flow from Azure to the browser without holding a gunicorn
+thread. Signatures are built from the account settings in ``main/settings.py`` and
+cached until shortly before they expire, which also keeps the URL stable for the
+browser's HTTP cache. Blobs in another account (or a deployment without an account
+key) cannot be signed, and the caller falls back to the proxy.
+
+Blob metadata (size, ETag, Last-Modified, Content-Type) is cached per video URL in
+Django's cache. Any upstream GET that shows a different ETag refreshes it, and
+video/signals.py drops it when a lesson's video_url changes.
+"""
+import hashlib
+import re
+from datetime import datetime, timedelta, timezone as dt_timezone
+from urllib.parse import quote, unquote, urlparse
+
+from azure.storage.blob import BlobSasPermissions, generate_blob_sas
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+
+STREAM_MODE_PROXY = 'proxy'
+STREAM_MODE_REDIRECT = 'redirect'
+STREAM_MODES = (STREAM_MODE_PROXY, STREAM_MODE_REDIRECT)
+
+BLOB_SAS_CACHE_KEY = 'video:blob-sas:{digest}'
+BLOB_META_CACHE_KEY = 'video:blob-meta:{digest}'
+
+CONTENT_RANGE_TOTAL_RE = re.compile(r'/(\d+)$')
+
+
+def _url_digest(value):
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+def _account_credentials():
+    """(account_name, account_key) from the settings, falling back to the connection string."""
+    account_name = getattr(settings, 'AZURE_ACCOUNT_NAME', '')
+    account_key = getattr(settings, 'AZURE_ACCOUNT_KEY', '')
+    connection_string = getattr(settings, 'AZURE_STORAGE_CONNECTION_STRING', '')
+    if connection_string and not (account_name and account_key):
+        parts = dict(
+            part.split('=', 1) for part in connection_string.split(';') if '=' in part
+        )
+        account_name = account_name or parts.get('AccountName', '')
+        account_key = account_key or parts.get('AccountKey', '')
+    return account_name, account_key
+
+
+def parse_blob_url(video_url):
+    """Split an Azure blob URL into (account, container, blob name), or None."""
+    parsed = urlparse((video_url or '').strip())
+    hostname = (parsed.hostname or '').lower()
+    if not hostname.endswith('.blob.core.windows.net'):
+        return None
+    container, _, blob_name = unquote(parsed.path).lstrip('/').partition('/')
+    if not container or not blob_name:
+        return None
+    return hostname.split('.', 1)[0], container, blob_name
+
+
+def _sign(account_name, account_key, container, blob_name, ttl):
+    now = datetime.now(dt_timezone.utc)
+    token = generate_blob_sas(
+        account_name=account_name,
+        container_name=container,
+        blob_name=blob_name,
+        account_key=account_key,
+        permission=BlobSasPermissions(read=True),
+        # Small backdated start tolerates clock skew between us and Azure.
+        start=now - timedelta(minutes=5),
+        expiry=now + timedelta(seconds=ttl),
+        protocol='https',
+    )
+    return (
+        f'https://{account_name}.blob.core.windows.net/'
+        f'{quote(container)}/{quote(blob_name)}?{token}'
+    )
+
+
+def get_signed_blob_url(video_url):
+    """
+    Return a cached read-only SAS URL for a lesson's blob, or None when the blob
+    cannot be signed with this deployment's credentials.
+    """
+    location = parse_blob_url(video_url)
+    if location is None:
+        return None
+    blob_account, container, blob_name = location
+    account_name, account_key = _account_credentials()
+    if not account_key or blob_account != account_name.lower():
+        return None
+
+    ttl = int(getattr(settings, 'VIDEO_SAS_TTL_SECONDS', 2 * 60 * 60))
+    margin = int(getattr(settings, 'VIDEO_SAS_REFRESH_MARGIN_SECONDS', 60 * 60))
+    key = BLOB_SAS_CACHE_KEY.format(digest=_url_digest(f'{blob_account}/{container}/{blob_name}'))
+    signed_url = cache.get(key)
+    if signed_url is None:
+        signed_url = _sign(account_name, account_key, container, blob_name, ttl)
+        # Stop handing out a signature `margin` seconds before it expires: players keep
+        # issuing range requests against the same URL for the whole playback.
+        cache.set(key, signed_url, max(ttl - margin, 1))
+    return signed_url
+
+
+def resolve_stream_mode(lesson, request):
+    """Stream mode for a request: ?mode= override, then the lesson's, then the deployment's."""
+    params = getattr(request, 'query_params', request.GET)
+    requested = (params.get('mode') or '').strip().lower()
+    if requested in STREAM_MODES:
+        return requested
+    if lesson.stream_mode in STREAM_MODES:
+        return lesson.stream_mode
+    mode = getattr(settings, 'VIDEO_STREAM_MODE', STREAM_MODE_PROXY)
+    return mode if mode in STREAM_MODES else STREAM_MODE_PROXY
+
+
+# ========== BLOB METADATA ==========
+
+def blob_metadata_from_response(status_code, headers):
+    """Metadata from an upstream HEAD/GET (200 or 206), or None if it lacks size or ETag."""
+    etag = headers.get('ETag')
+    if status_code == 206:
+        total = CONTENT_RANGE_TOTAL_RE.search(headers.get('Content-Range', ''))
+        size = total.group(1) if total else None
+    elif status_code == 200:
+        size = headers.get('Content-Length')
+    else:
+        size = None
+    if not etag or not size or not str(size).isdigit():
+        return None
+    return {
+        'size': int(size),
+        'etag': etag,
+        'content_type': headers.get('Content-Type', 'video/mp4'),
+        'last_modified': headers.get('Last-Modified', ''),
+    }
+
+
+def get_blob_metadata(video_url):
+    return cache.get(BLOB_META_CACHE_KEY.format(digest=_url_digest(video_url)))
+
+
+def remember_blob_metadata(video_url, metadata):
+    """Cache metadata seen upstream; only writes when it is new or the ETag changed."""
+    if metadata is None:
+        return
+    cached = get_blob_metadata(video_url)
+    if cached is None or cached['etag'] != metadata['etag']:
+        cache.set(
+            BLOB_META_CACHE_KEY.format(digest=_url_digest(video_url)),
+            metadata,
+            int(getattr(settings, 'VIDEO_BLOB_META_TTL', 60 * 60)),
+        )
+
+
+def invalidate_blob_metadata(video_url):
+    cache.delete(BLOB_META_CACHE_KEY.format(digest=_url_digest(video_url)))
+
+
+def blob_head_response(metadata):
+    """Answer a stream HEAD from cached metadata (Azure ignores Range on HEAD too)."""
+    response = HttpResponse(status=200, content_type=metadata['content_type'])
+    response['Content-Length'] = str(metadata['size'])
+    response['ETag'] = metadata['etag']
+    if metadata['last_modified']:
+        response['Last-Modified'] = metadata['last_modified']
+    response['Accept-Ranges'] = 'bytes'
+    return response
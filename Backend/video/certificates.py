@@ -0,0 +1,171 @@
+"""
+Course completion certificates.
+
+The static layer (title, rules, footer) is built once per process as a ReportLab
+Drawing and stamped onto every certificate; only the learner-specific lines are
+drawn per PDF. Rendering is invariant (no creation timestamp or random document
+id), so the HTTP download and the bulk command produce byte-identical files.
+
+Finished PDFs live in ``default_storage`` under a deterministic key built from
+user, course and completion date, so each certificate is rendered once and every
+later download is served from storage.
+"""
+import hashlib
+import hmac
+from dataclasses import dataclass
+from datetime import date
+from functools import lru_cache
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from reportlab.graphics import renderPDF
+from reportlab.graphics.shapes import Drawing, Line, String
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+
+CERTIFICATE_KEY = 'certificates/{user_id}/{course_id}/{completed_on}-{digest}.pdf'
+
+
+@dataclass(frozen=True)
+class CertificateData:
+    """Everything printed on one certificate (plain values, so it pickles for worker processes)."""
+    user_id: int
+    course_id: int
+    display_name: str
+    course_title: str
+    completed_lessons: int
+    total_lessons: int
+    completed_on: date
+
+    @property
+    def certificate_id(self):
+        return f"CERT-{self.user_id}-{self.course_id}-{self.completed_on.strftime('%Y%m%d')}"
+
+    @property
+    def digest(self):
+        # Covers the printed text, so a renamed learner or course gets a new file,
+        # and keys cannot be guessed from ids alone.
+        message = '|'.join([
+            str(self.user_id), str(self.course_id), self.completed_on.isoformat(),
+            self.display_name, self.course_title, f'{self.completed_lessons}/{self.total_lessons}',
+        ])
+        signature = hmac.new(settings.SECRET_KEY.encode('utf-8'), message.encode('utf-8'), hashlib.sha256)
+        return signature.hexdigest()[:16]
+
+    @property
+    def storage_key(self):
+        return CERTIFICATE_KEY.format(
+            user_id=self.user_id,
+            course_id=self.course_id,
+            completed_on=self.completed_on.isoformat(),
+            digest=self.digest,
+        )
+
+    @property
+    def filename(self):
+        return f"{self.course_title.strip().replace(' ', '_')}_certificate.pdf"
+
+
+def certificate_display_name(user):
+    return user.get_full_name().strip() or user.username
+
+
+def build_certificate_data(user, course, completed_lessons, total_lessons, completed_at):
+    """
+    Build the printed values from model instances. Both the download view and the
+    bulk command go through here, so they agree on name, date and key.
+    """
+    return CertificateData(
+        user_id=user.id,
+        course_id=course.id,
+        display_name=certificate_display_name(user),
+        course_title=course.title,
+        completed_lessons=completed_lessons,
+        total_lessons=total_lessons,
+        completed_on=timezone.localdate(completed_at) if completed_at else timezone.localdate(),
+    )
+
+
+@lru_cache(maxsize=1)
+def get_certificate_template():
+    """Static certificate layer, built once per process."""
+    page_width, page_height = A4
+    template = Drawing(page_width, page_height)
+    template.add(String(
+        page_width / 2, page_height - 110, 'Certificate of Completion',
+        fontName='Helvetica-Bold', fontSize=28, fillColor=colors.HexColor('#1F2937'), textAnchor='middle'
+    ))
+    template.add(Line(
+        90, page_height - 130, page_width - 90, page_height - 130,
+        strokeColor=colors.HexColor('#3B82F6'), strokeWidth=2
+    ))
+    template.add(String(
+        page_width / 2, page_height - 185, 'This certifies that',
+        fontName='Helvetica', fontSize=14, fillColor=colors.HexColor('#374151'), textAnchor='middle'
+    ))
+    template.add(String(
+        page_width / 2, page_height - 285, 'has successfully completed all modules of',
+        fontName='Helvetica', fontSize=14, fillColor=colors.HexColor('#111827'), textAnchor='middle'
+    ))
+    template.add(Line(90, 140, page_width - 90, 140, strokeColor=colors.HexColor('#9CA3AF'), strokeWidth=1))
+    template.add(String(
+        page_width / 2, 120, 'Scopio Learning Platform',
+        fontName='Helvetica', fontSize=10, fillColor=colors.HexColor('#6B7280'), textAnchor='middle'
+    ))
+    return template
+
+
+def render_certificate_pdf(data):
+    """
+    Render one certificate to PDF bytes. Takes only plain values and touches neither
+    the database nor storage, so issue_certificates can run it in worker processes.
+    """
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4, invariant=1)
+    page_width, page_height = A4
+
+    renderPDF.draw(get_certificate_template(), pdf, 0, 0)
+
+    pdf.setFillColor(colors.HexColor('#0EA5E9'))
+    pdf.setFont('Helvetica-Bold', 30)
+    pdf.drawCentredString(page_width / 2, page_height - 240, data.display_name)
+
+    pdf.setFillColor(colors.HexColor('#111827'))
+    pdf.setFont('Helvetica-Bold', 18)
+    pdf.drawCentredString(page_width / 2, page_height - 320, f'"{data.course_title}"')
+
+    pdf.setFont('Helvetica', 12)
+    pdf.setFillColor(colors.HexColor('#4B5563'))
+    pdf.drawCentredString(
+        page_width / 2, page_height - 370, f'Completed Modules: {data.completed_lessons}/{data.total_lessons}'
+    )
+    pdf.drawCentredString(page_width / 2, page_height - 392, f'Issued On: {data.completed_on.isoformat()}')
+    pdf.drawCentredString(page_width / 2, page_height - 414, f'Certificate ID: {data.certificate_id}')
+
+    pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def store_certificate(data, pdf_bytes):
+    """Save rendered bytes under the certificate's key and return the key."""
+    key = data.storage_key
+    name = default_storage.save(key, ContentFile(pdf_bytes))
+    if name != key:
+        # A concurrent request stored the same certificate first and storage picked
+        # a free name for ours; the bytes are identical, so drop the duplicate.
+        default_storage.delete(name)
+    return key
+
+
+def get_or_create_certificate(data):
+    """Return the storage key for a certificate, rendering and storing it only if missing."""
+    key = data.storage_key
+    if not default_storage.exists(key):
+        key = store_certificate(data, render_certificate_pdf(data))
+    return key
@@ -0,0 +1,322 @@
+"""
+Bounded on-disk cache of lesson video byte ranges.
+
+Blobs are cached as fixed-size aligned chunks (VIDEO_CHUNK_SIZE) under
+``<VIDEO_CHUNK_CACHE_DIR>/<url digest>/<etag digest>-<index>.chunk``, so a
+re-uploaded video (new ETag) never serves old bytes. A Range request is answered
+from the chunks it covers and only missing chunks are fetched from Azure. A range
+inside one chunk goes out through ``wsgi.file_wrapper``, which gunicorn sends with
+sendfile(); a wider range is streamed chunk by chunk.
+
+Concurrent misses for the same chunk in one process share a single upstream fetch.
+Files are written to a temp name and renamed, so processes sharing the directory
+never read a partial chunk. Total size stays under VIDEO_CHUNK_CACHE_MAX_BYTES by
+deleting the least recently used chunks (mtime, bumped on every hit). Each process
+counts its own writes between directory scans, so the bound is approximate.
+
+Size, ETag and content type come from the shared blob metadata cache
+(video/blob.py); every chunk fetch refreshes it. The chunk cache is off unless
+VIDEO_CHUNK_CACHE_DIR is set.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from contextlib import suppress
+
+import requests
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+
+from .blob import blob_metadata_from_response, get_blob_metadata, remember_blob_metadata
+from .upstream import get_upstream_session, upstream_timeout
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+READ_BLOCK_SIZE = 64 * 1024
+# Evict down to this fraction of the limit, so a full cache does not rescan on every write.
+EVICT_TO = 0.9
+
+
+class ChunkFetchError(Exception):
+    """Azure could not provide a chunk (no range support, error, or the blob changed)."""
+
+
+class _FileSlice:
+    """
+    At most `length` bytes of an open file from its current position. Keeps fileno()
+    so gunicorn's wsgi.file_wrapper can sendfile() the slice without copying it.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+class ChunkCache:
+    def __init__(self, root, max_bytes, chunk_size):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._approx_bytes = None
+
+    # ========== PATHS ==========
+
+    def _blob_dir(self, video_url):
+        return os.path.join(self.root, hashlib.sha1(video_url.encode('utf-8')).hexdigest())
+
+    def chunk_path(self, video_url, etag, index):
+        etag_digest = hashlib.sha1(etag.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self._blob_dir(video_url), f'{etag_digest}-{index}.chunk')
+
+    def _write_atomic(self, path, data):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            with suppress(OSError):
+                os.unlink(tmp_path)
+            raise
+
+    # ========== CHUNKS ==========
+
+    def _fetch(self, video_url, index):
+        """GET one aligned chunk from Azure; returns (bytes, blob metadata)."""
+        first = index * self.chunk_size
+        byte_range = f'bytes={first}-{first + self.chunk_size - 1}'
+        try:
+            upstream = get_upstream_session().get(
+                video_url, headers={'Range': byte_range, 'x-ms-range': byte_range},
+                timeout=upstream_timeout('GET'),
+            )
+        except requests.RequestException as exc:
+            raise ChunkFetchError(f'Unable to reach video source: {exc}') from exc
+
+        meta = blob_metadata_from_response(upstream.status_code, upstream.headers)
+        if upstream.status_code != 206 or meta is None:
+            raise ChunkFetchError(f'Upstream answered {upstream.status_code} without a usable range')
+        data = upstream.content
+        if len(data) != min(self.chunk_size, meta['size'] - first):
+            raise ChunkFetchError('Upstream returned a short chunk')
+        return data, meta
+
+    def _load(self, video_url, index, etag=None):
+        """
+        Fetch and store a chunk, coalescing concurrent misses in this process.
+        Returns the blob metadata seen upstream; raises if it no longer matches `etag`.
+        """
+        key = (video_url, index)
+        with self._lock:
+            pending = self._inflight.get(key)
+            if pending is None:
+                pending = self._inflight[key] = {'done': threading.Event(), 'meta': None}
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            pending['done'].wait(upstream_timeout('GET')[1])
+            if pending['meta'] is None:
+                raise ChunkFetchError('Concurrent fetch of this chunk failed')
+            meta = pending['meta']
+        else:
+            try:
+                data, meta = self._fetch(video_url, index)
+                self._write_atomic(self.chunk_path(video_url, meta['etag'], index), data)
+                remember_blob_metadata(video_url, meta)
+                pending['meta'] = meta
+                self._account(len(data))
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                pending['done'].set()
+
+        if etag is not None and meta['etag'] != etag:
+            raise ChunkFetchError('Blob changed upstream')
+        return meta
+
+    def load_meta(self, video_url, index=0):
+        """Blob metadata, fetching (and caching) chunk `index` if it is not known yet."""
+        return get_blob_metadata(video_url) or self._load(video_url, index)
+
+    def open_chunk(self, video_url, etag, index):
+        """Open a cached chunk for reading, fetching it on a miss."""
+        path = self.chunk_path(video_url, etag, index)
+        # A second attempt covers a chunk evicted between the fetch and the open.
+        for _ in range(2):
+            try:
+                chunk_file = open(path, 'rb')
+            except FileNotFoundError:
+                self._load(video_url, index, etag)
+                continue
+            # Bump mtime: eviction removes the least recently used chunks first.
+            with suppress(OSError):
+                os.utime(path)
+            return chunk_file
+        raise ChunkFetchError('Chunk was evicted while being fetched')
+
+    def iter_range(self, video_url, etag, start, end, first_file):
+        """Yield bytes start..end (inclusive), opening each covered chunk in turn."""
+        chunk_file = first_file
+        position = start
+        try:
+            while position <= end:
+                index = position // self.chunk_size
+                if chunk_file is None:
+                    chunk_file = self.open_chunk(video_url, etag, index)
+                chunk_file.seek(position - index * self.chunk_size)
+                remaining = min(end, (index + 1) * self.chunk_size - 1) - position + 1
+                while remaining > 0:
+                    data = chunk_file.read(min(READ_BLOCK_SIZE, remaining))
+                    if not data:
+                        raise ChunkFetchError('Cached chunk is truncated')
+                    remaining -= len(data)
+                    position += len(data)
+                    yield data
+                chunk_file.close()
+                chunk_file = None
+        finally:
+            if chunk_file is not None:
+                chunk_file.close()
+
+    # ========== EVICTION ==========
+
+    def _scan(self):
+        total, entries = 0, []
+        for directory, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.endswith('.chunk'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                total += stat.st_size
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return total, entries
+
+    def _account(self, written):
+        with self._lock:
+            if self._approx_bytes is None:
+                self._approx_bytes, _ = self._scan()
+            else:
+                self._approx_bytes += written
+            over_limit = self._approx_bytes > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used chunks until the cache is under its target size."""
+        total, entries = self._scan()
+        target = int(self.max_bytes * EVICT_TO) if total > self.max_bytes else total
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            with suppress(FileNotFoundError):
+                os.unlink(path)
+            total -= size
+        with self._lock:
+            self._approx_bytes = total
+        return total
+
+
+_chunk_cache = None
+
+
+def get_chunk_cache():
+    """This process's ChunkCache, or None when VIDEO_CHUNK_CACHE_DIR is not set."""
+    global _chunk_cache
+    root = getattr(settings, 'VIDEO_CHUNK_CACHE_DIR', '')
+    if not root:
+        return None
+    config = (
+        root,
+        int(getattr(settings, 'VIDEO_CHUNK_CACHE_MAX_BYTES', 2 * 1024 ** 3)),
+        int(getattr(settings, 'VIDEO_CHUNK_SIZE', 2 * 1024 ** 2)),
+    )
+    cache = _chunk_cache
+    if cache is None or (cache.root, cache.max_bytes, cache.chunk_size) != config:
+        cache = _chunk_cache = ChunkCache(*config)
+    return cache
+
+
+def serve_cached_range(video_url, range_value):
+    """
+    Answer a stream GET from the chunk cache. Returns None when the proxy should
+    handle it instead: cache disabled, multi-range request, or Azure unable to
+    serve aligned ranges.
+    """
+    cache = get_chunk_cache()
+    if cache is None:
+        return None
+
+    range_match = RANGE_RE.match(range_value) if range_value else None
+    if range_value and not range_match:
+        return None
+    first, last = range_match.groups() if range_match else ('0', '')
+    if not first and not last:
+        return None
+
+    try:
+        meta = cache.load_meta(video_url, int(first) // cache.chunk_size if first else 0)
+        size = meta['size']
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            start, end = max(size - int(last), 0), size - 1
+        if start >= size or start > end:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        first_index = start // cache.chunk_size
+        # Open the first chunk before answering, so an upstream failure still falls
+        # back to the proxy instead of cutting off a 206.
+        first_file = cache.open_chunk(video_url, meta['etag'], first_index)
+    except ChunkFetchError:
+        return None
+
+    status = 206 if range_value else 200
+    length = end - start + 1
+    if end // cache.chunk_size == first_index:
+        first_file.seek(start - first_index * cache.chunk_size)
+        response = FileResponse(_FileSlice(first_file, length), status=status, content_type=meta['content_type'])
+    else:
+        response = StreamingHttpResponse(
+            cache.iter_range(video_url, meta['etag'], start, end, first_file),
+            status=status,
+            content_type=meta['content_type'],
+        )
+
+    response['Content-Length'] = str(length)
+    if status == 206:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = meta['etag']
+    if meta['last_modified']:
+        response['Last-Modified'] = meta['last_modified']
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,220 @@
+"""
+Versioned shared cache for course detail payloads.
+
+The user-independent part of CourseDetailSerializer output (lessons, discussions,
+resources, instructor and rating stats) is rendered once per course version and
+shared by every user. Per-user fields are merged on top from a few small queries.
+
+Versions are bumped by the signals in ``video/signals.py`` whenever a course or
+one of its children changes, so stale payloads are simply never read again and
+expire on their own. With the per-process LocMem cache another worker's bump is
+never seen, so keys also carry the content stamp from CourseValidator: database
+timestamps and rating aggregates that every write to the payload moves (child
+deletes touch Course.updated_at, likes touch Discussion.updated_at).
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db.models import Max, OuterRef, Subquery, prefetch_related_objects
+from django.utils.cache import get_conditional_response, patch_vary_headers, quote_etag
+
+from .models import Course, Discussion, Lesson, Resource, UserProgress
+from .position_buffer import buffered_progress_stamp
+from .serializers import CourseDetailSerializer, get_user_course_rating, get_user_progress_map
+
+
+COURSE_VERSION_KEY = 'video:course:{course_id}:version'
+COURSE_DETAIL_KEY = 'video:course:{course_id}:detail:v{version}:{stamp}:{origin}'
+COURSE_DETAIL_TTL = 60 * 60
+
+
+def get_course_version(course_id):
+    """Return the current cache version for a course, creating one if missing."""
+    key = COURSE_VERSION_KEY.format(course_id=course_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_course_version(course_id):
+    """Invalidate every cached payload for a course by moving it to a new version."""
+    cache.set(COURSE_VERSION_KEY.format(course_id=course_id), time.time_ns(), None)
+
+
+def prefetch_course_detail(course):
+    """Prefetch the relations CourseDetailSerializer renders for the shared payload."""
+    # Discussions are not prefetched: the serializer loads only the newest page itself.
+    prefetch_related_objects([course], 'lessons', 'resources')
+
+
+def _origin_key(request):
+    # Payloads embed absolute URLs (stream_url, avatars), so keep them per scheme/host.
+    return hashlib.sha1(request.build_absolute_uri('/').encode('utf-8')).hexdigest()[:12]
+
+
+def get_shared_course_detail(course, request, content_stamp):
+    """
+    Return the cached user-independent detail payload, rendering it on a miss.
+
+    ``content_stamp`` (see CourseValidator) ties the key to the database state, so a
+    LocMem cache in one worker cannot keep serving content changed through another.
+    """
+    key = COURSE_DETAIL_KEY.format(
+        course_id=course.id,
+        version=get_course_version(course.id),
+        stamp=content_stamp,
+        origin=_origin_key(request),
+    )
+    payload = cache.get(key)
+    if payload is None:
+        prefetch_course_detail(course)
+        serializer = CourseDetailSerializer(course, context={'request': request, 'shared_only': True})
+        payload = serializer.data
+        cache.set(key, payload, COURSE_DETAIL_TTL)
+    return payload
+
+
+def apply_user_overlay(payload, course, request, context=None):
+    """Merge the request user's progress, rating, certificate and like state into a payload."""
+    if not request.user.is_authenticated:
+        return payload
+
+    user = request.user
+    context = context if context is not None else {'request': request}
+    progress_map = get_user_progress_map(context, course.id)
+
+    completed = 0
+    for lesson in payload['lessons']:
+        progress = progress_map.get(lesson['id'])
+        lesson['completed'] = progress.completed if progress else False
+        lesson['last_position'] = progress.last_position if progress else 0
+        completed += 1 if lesson['completed'] else 0
+
+    total = len(payload['lessons'])
+    payload['progress_info'] = {
+        'completed': completed,
+        'total': total,
+        'text': f"{completed}/{total} completed"
+    }
+    payload['certificate_unlocked'] = total > 0 and completed >= total
+
+    user_rating = get_user_course_rating(context, course.id)
+    payload['user_rating'] = user_rating.rating if user_rating else None
+
+    discussion_ids = [discussion['id'] for discussion in payload['discussions']]
+    liked_ids = set()
+    if discussion_ids:
+        liked_ids = set(
+            Discussion.liked_by.through.objects.filter(
+                user_id=user.id,
+                discussion_id__in=discussion_ids
+            ).values_list('discussion_id', flat=True)
+        )
+    for discussion in payload['discussions']:
+        discussion['is_liked'] = discussion['id'] in liked_ids
+
+    return payload
+
+
+def get_course_detail_payload(course, request, content_stamp=None, context=None):
+    """
+    Shared course detail payload with the request user's fields merged on top.
+    Pass the validator's ``content_stamp`` when it is already known (one query otherwise),
+    and ``context`` to share the loaded progress map and rating with other sections.
+    """
+    if content_stamp is None:
+        content_stamp = CourseValidator.for_course(request, course.id).content_stamp
+    payload = get_shared_course_detail(course, request, content_stamp)
+    return apply_user_overlay(payload, course, request, context)
+
+
+# ========== CONDITIONAL GET VALIDATORS ==========
+RATING_AGGREGATE_FIELDS = (
+    'rating_sum', 'rating_count',
+    'rating_1_count', 'rating_2_count', 'rating_3_count', 'rating_4_count', 'rating_5_count',
+)
+
+
+def _latest_child_update(model, **filters):
+    return Subquery(
+        model.objects.filter(course=OuterRef('pk'), **filters)
+        .order_by().values('course').annotate(latest=Max('updated_at')).values('latest')
+    )
+
+
+class CourseValidator:
+    """
+    Cheap ETag for everything rendered from one course. No Last-Modified is sent:
+    rating F() updates move no timestamp and writes within one second share one,
+    so If-Modified-Since alone could answer 304 for changed content.
+    """
+
+    def __init__(self, etag, content_stamp):
+        self.etag = etag
+        self.content_stamp = content_stamp
+
+    @classmethod
+    def for_course(cls, request, course_id, include_user=False, queryset=None):
+        """
+        Build the validator from one query: max updated_at across the course and its
+        children, the course's rating aggregates (F() updates leave updated_at alone),
+        plus the user's latest progress timestamp (stored or buffered) when
+        include_user is set.
+        The cache version is mixed in so deletes and counter updates also change it.
+        Returns None when the course does not exist (or is outside ``queryset``).
+        """
+        annotations = {
+            'lessons_at': _latest_child_update(Lesson),
+            'discussions_at': _latest_child_update(Discussion),
+            'resources_at': _latest_child_update(Resource),
+        }
+        user = request.user if include_user and request.user.is_authenticated else None
+        if user is not None:
+            annotations['progress_at'] = _latest_child_update(UserProgress, user=user)
+
+        queryset = queryset if queryset is not None else Course.objects.all()
+        row = queryset.filter(pk=course_id).annotate(**annotations).values(
+            'updated_at', *RATING_AGGREGATE_FIELDS, *annotations.keys()
+        ).first()
+        if row is None:
+            return None
+        rating_aggregates = [str(row.pop(field)) for field in RATING_AGGREGATE_FIELDS]
+
+        version = get_course_version(course_id)
+        progress_at = row.pop('progress_at', None)
+        # Buffered heartbeats (video/position_buffer.py) have not touched updated_at yet.
+        buffered_at = buffered_progress_stamp(user.id, course_id) if user is not None else ''
+        content_stamp = hashlib.sha1('|'.join([
+            *(value.isoformat() if value else '-' for value in row.values()),
+            *rating_aggregates,
+        ]).encode('utf-8')).hexdigest()[:16]
+
+        fingerprint = '|'.join([
+            str(version),
+            content_stamp,
+            progress_at.isoformat() if progress_at else '-',
+            buffered_at or '-',
+            str(user.id if user else 0),
+            request.get_full_path(),
+            request.headers.get('Accept', ''),
+        ])
+        etag = quote_etag(hashlib.sha1(fingerprint.encode('utf-8')).hexdigest())
+        return cls(etag, content_stamp)
+
+    def not_modified_response(self, request):
+        """Return a 304 response when the client's ETag still matches, else None."""
+        response = get_conditional_response(request, etag=self.etag)
+        if response is not None:
+            self.apply(response)
+        return response
+
+    def apply(self, response):
+        """Attach the validator so the next request can be answered without serializing."""
+        response['ETag'] = self.etag
+        # Revalidate every time: answers are per user and cheap to confirm.
+        response['Cache-Control'] = 'private, no-cache'
+        patch_vary_headers(response, ('Authorization', 'Cookie'))
+        return response
@@ -0,0 +1,49 @@
+"""
+Typed values behind Lesson's free-form display strings.
+
+``time_xp`` ('451.02') and ``duration`` ('1:45 min', '12 min', '1h 5m') remain the
+fields editors fill in and the player shows. Lesson.save() derives ``xp_value`` and
+``duration_seconds`` from them with the parsers below, so XP awards and duration
+rollups are plain integer columns. ``manage.py backfill_lesson_metadata``
+re-derives rows written without save() (queryset updates, raw SQL).
+"""
+import re
+
+
+NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+CLOCK_RE = re.compile(r'(\d+):(\d{1,2})(?::(\d{1,2}))?')
+UNIT_RE = re.compile(r'(\d+(?:\.\d+)?)\s*(hours?|hrs?|h|minutes?|mins?|m|seconds?|secs?|s)\b')
+HOURS_RE = re.compile(r'\b(hours?|hrs?|h)\b')
+
+
+def parse_xp_value(text):
+    """First number in time_xp, truncated like mark_complete always did: '451.02' -> 451."""
+    match = NUMBER_RE.search(str(text or ''))
+    return max(int(float(match.group(0))), 0) if match else 0
+
+
+def parse_duration_seconds(text):
+    """
+    Seconds from a display duration: '1:45 min' -> 105, '1:02:03' -> 3723,
+    '1:30 h' -> 5400, '1h 5m' -> 3900, '12 min' -> 720. A bare number is minutes.
+    Returns 0 when nothing parses.
+    """
+    text = str(text or '').strip().lower()
+    clock = CLOCK_RE.search(text)
+    if clock:
+        seconds = 0
+        for part in clock.groups():
+            if part is not None:
+                seconds = seconds * 60 + int(part)
+        # "1:30 h" is hours and minutes; "1:45 min" and "1:45" are minutes and seconds.
+        if clock.group(3) is None and HOURS_RE.search(text):
+            seconds *= 60
+        return seconds
+
+    units = UNIT_RE.findall(text)
+    if units:
+        scale = {'h': 3600, 'm': 60, 's': 1}
+        return int(round(sum(float(value) * scale[unit[0]] for value, unit in units)))
+
+    match = NUMBER_RE.search(text)
+    return max(int(round(float(match.group(0)) * 60)), 0) if match else 0
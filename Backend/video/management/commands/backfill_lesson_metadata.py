@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from video.course_cache import bump_course_version
+from video.lesson_metadata import parse_duration_seconds, parse_xp_value
+from video.models import Lesson
+
+
+class Command(BaseCommand):
+    help = "Re-derive Lesson.xp_value and duration_seconds from the time_xp and duration strings."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows per UPDATE')
+        parser.add_argument('--dry-run', action='store_true', help='Only report lessons whose numbers are out of date')
+
+    def handle(self, *args, **options):
+        changed = []
+        for lesson in Lesson.objects.only('id', 'course_id', 'title', 'time_xp', 'duration', 'xp_value', 'duration_seconds').iterator():
+            xp_value = parse_xp_value(lesson.time_xp)
+            duration_seconds = parse_duration_seconds(lesson.duration)
+            if lesson.time_xp.strip() and not xp_value:
+                self.stdout.write(self.style.WARNING(f'Lesson {lesson.id} ({lesson.title}): no XP in time_xp {lesson.time_xp!r}'))
+            if lesson.duration.strip() and not duration_seconds:
+                self.stdout.write(self.style.WARNING(f'Lesson {lesson.id} ({lesson.title}): no duration in {lesson.duration!r}'))
+            if (lesson.xp_value, lesson.duration_seconds) != (xp_value, duration_seconds):
+                lesson.xp_value, lesson.duration_seconds = xp_value, duration_seconds
+                changed.append(lesson)
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'{len(changed)} lesson(s) out of date'))
+            return
+        Lesson.objects.bulk_update(changed, ['xp_value', 'duration_seconds'], batch_size=options['batch_size'])
+        # bulk_update skips the signals, so drop the cached course payloads here.
+        for course_id in {lesson.course_id for lesson in changed}:
+            bump_course_version(course_id)
+        self.stdout.write(self.style.SUCCESS(f'Updated {len(changed)} lesson(s)'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from video.position_buffer import flush_buffered_progress
+
+
+class Command(BaseCommand):
+    help = (
+        "Write buffered watch positions to UserProgress. Run it periodically when REDIS_URL "
+        "is set; an in-process buffer can only be flushed by its own worker."
+    )
+
+    def handle(self, *args, **options):
+        count = flush_buffered_progress()
+        self.stdout.write(self.style.SUCCESS(f'Flushed {count} buffered watch position(s)'))
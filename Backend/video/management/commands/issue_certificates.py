@@ -0,0 +1,101 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+import os
+
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, IntegerField, Max, OuterRef, Subquery
+
+from video.certificates import build_certificate_data, render_certificate_pdf, store_certificate
+from video.models import Course, Lesson, UserProgress
+
+
+class Command(BaseCommand):
+    help = (
+        "Issue certificates for every user who completed all lessons of a course. "
+        "PDFs are rendered in a process pool and uploaded with bounded concurrency; "
+        "certificates already in storage are skipped, so an interrupted run can simply be restarted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', type=int, action='append', dest='course_ids',
+                            help='Course id (repeatable). Defaults to every published course.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Render processes (default: CPU count)')
+        parser.add_argument('--upload-concurrency', type=int, default=8,
+                            help='Concurrent storage existence checks and uploads (default: 8)')
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Certificates rendered per batch; bounds memory held between render and upload')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be issued')
+
+    def _completions(self, course_ids):
+        """One grouped query: users whose completed lesson count reaches the course's lesson count."""
+        lesson_totals = Lesson.objects.filter(
+            course=OuterRef('course_id')
+        ).order_by().values('course').annotate(total=Count('id')).values('total')
+
+        queryset = UserProgress.objects.filter(completed=True)
+        if course_ids:
+            queryset = queryset.filter(course_id__in=course_ids)
+        else:
+            queryset = queryset.filter(course__is_published=True)
+
+        return list(
+            queryset.order_by().values('user_id', 'course_id').annotate(
+                completed_lessons=Count('id'),
+                completed_at=Max('completed_at'),
+                total_lessons=Subquery(lesson_totals, output_field=IntegerField()),
+            ).filter(
+                total_lessons__gt=0,
+                completed_lessons__gte=F('total_lessons'),
+            ).order_by('course_id', 'user_id')
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['upload_concurrency'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers, --upload-concurrency and --batch-size must be positive')
+
+        rows = self._completions(options['course_ids'])
+        users = User.objects.only('id', 'username', 'first_name', 'last_name').in_bulk(
+            {row['user_id'] for row in rows}
+        )
+        courses = Course.objects.only('id', 'title').in_bulk({row['course_id'] for row in rows})
+        certificates = [
+            build_certificate_data(
+                users[row['user_id']],
+                courses[row['course_id']],
+                row['completed_lessons'],
+                row['total_lessons'],
+                row['completed_at'],
+            )
+            for row in rows
+        ]
+
+        with ThreadPoolExecutor(max_workers=options['upload_concurrency']) as uploads:
+            exists = uploads.map(lambda data: default_storage.exists(data.storage_key), certificates)
+            pending = [data for data, found in zip(certificates, exists) if not found]
+            skipped = len(certificates) - len(pending)
+
+            self.stdout.write(
+                f'{len(certificates)} completed enrollments, {skipped} already issued, {len(pending)} to issue'
+            )
+            if options['dry_run'] or not pending:
+                self.stdout.write(self.style.SUCCESS('Nothing issued' if not pending else 'Dry run: nothing issued'))
+                return
+
+            issued = 0
+            # Spawned workers only import the renderer, so they never inherit the
+            # parent's database connections or threads.
+            spawn = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=options['workers'], mp_context=spawn) as renderers:
+                for start in range(0, len(pending), options['batch_size']):
+                    batch = pending[start:start + options['batch_size']]
+                    rendered = renderers.map(render_certificate_pdf, batch, chunksize=8)
+                    # Each batch is fully stored before the next is rendered, so an
+                    # interruption loses at most one batch of work.
+                    for _ in uploads.map(store_certificate, batch, rendered):
+                        issued += 1
+                    self.stdout.write(f'  issued {issued}/{len(pending)}')
+
+        self.stdout.write(self.style.SUCCESS(f'Issued {issued} certificates ({skipped} already in storage)'))
@@ -0,0 +1,199 @@
+import json
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+from urllib.parse import quote
+
+from django.core.management.base import CommandError
+
+from azure.storage.blob import ContentSettings
+
+from video.blob import parse_blob_url
+from video.models import Lesson
+
+from .optimize_lesson_video import Command as OptimizeLessonVideoCommand
+
+
+# (name, height, video bitrate, max rate, buffer size, audio bitrate)
+DEFAULT_LADDER = (
+    ('1080p', 1080, '5000k', '5350k', '7500k', '192k'),
+    ('720p', 720, '2800k', '2996k', '4200k', '128k'),
+    ('480p', 480, '1400k', '1498k', '2100k', '128k'),
+    ('360p', 360, '800k', '856k', '1200k', '96k'),
+)
+
+CONTENT_TYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+}
+
+
+class Command(OptimizeLessonVideoCommand):
+    help = (
+        "Package a lesson video as HLS (bitrate ladder, fixed-length segments) with ffmpeg, "
+        "upload it next to the source blob and set Lesson.hls_manifest_url."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("lesson_id", type=int, help="Lesson ID to package")
+        parser.add_argument(
+            "--renditions",
+            default="720p,480p,360p",
+            help=f"Comma-separated renditions from: {', '.join(r[0] for r in DEFAULT_LADDER)} (default: 720p,480p,360p)",
+        )
+        parser.add_argument("--segment-seconds", type=int, default=6, help="Target segment length (default: 6)")
+        parser.add_argument("--upload-concurrency", type=int, default=8, help="Parallel blob uploads (default: 8)")
+        parser.add_argument("--dry-run", action="store_true", help="Package locally but do not upload or save")
+
+    def handle(self, *args, **options):
+        lesson = Lesson.objects.filter(pk=options["lesson_id"]).first()
+        if not lesson:
+            raise CommandError(f"Lesson {options['lesson_id']} not found")
+
+        video_url = (lesson.video_url or "").strip()
+        location = parse_blob_url(video_url)
+        if location is None:
+            raise CommandError("Lesson video_url is not an Azure Blob URL")
+        account_name, container_name, blob_name = location
+
+        ffmpeg_path = shutil.which("ffmpeg")
+        if not ffmpeg_path:
+            raise CommandError("ffmpeg is required but not found on PATH")
+
+        requested = [name.strip() for name in options["renditions"].split(",") if name.strip()]
+        ladder = [rung for rung in DEFAULT_LADDER if rung[0] in requested]
+        if not ladder or len(ladder) != len(requested):
+            raise CommandError(f"Unknown rendition in --renditions {options['renditions']!r}")
+        if options["segment_seconds"] < 1 or options["upload_concurrency"] < 1:
+            raise CommandError("--segment-seconds and --upload-concurrency must be positive")
+
+        # Playlists live next to the source: videos/intro.mp4 -> videos/intro_hls/master.m3u8
+        source = PurePosixPath(blob_name)
+        prefix = str(source.with_name(f"{source.stem}_hls"))
+
+        self.stdout.write(self.style.NOTICE(f"Packaging lesson {lesson.id}: {lesson.title}"))
+        self.stdout.write(self.style.NOTICE(f"Blob: {container_name}/{blob_name} -> {container_name}/{prefix}/"))
+
+        with tempfile.TemporaryDirectory(prefix="video-hls-") as temp_dir:
+            temp_dir_path = Path(temp_dir)
+            source_path = temp_dir_path / "source.mp4"
+            output_dir = temp_dir_path / "hls"
+            output_dir.mkdir()
+
+            self.stdout.write("Downloading source video from Azure URL...")
+            self._download_video_with_retries(video_url, source_path)
+
+            source_height, has_audio = self._probe(source_path)
+            if source_height:
+                # Never upscale; keep at least the smallest requested rendition.
+                ladder = [rung for rung in ladder if rung[1] <= source_height] or ladder[-1:]
+            self.stdout.write(
+                f"Renditions: {', '.join(rung[0] for rung in ladder)}"
+                f"{'' if has_audio else ' (no audio track)'}"
+            )
+
+            cmd = self._ffmpeg_command(
+                ffmpeg_path, source_path, output_dir, ladder, options["segment_seconds"], has_audio
+            )
+            self.stdout.write("Running ffmpeg HLS packaging...")
+            result = subprocess.run(cmd, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise CommandError(f"ffmpeg failed: {result.stderr.strip() or result.stdout.strip()}")
+
+            files = sorted(path for path in output_dir.rglob("*") if path.is_file())
+            total_bytes = sum(path.stat().st_size for path in files)
+            self.stdout.write(self.style.NOTICE(f"{len(files)} files ({total_bytes // (1024 * 1024)} MB) packaged"))
+
+            manifest_url = (
+                f"https://{account_name}.blob.core.windows.net/"
+                f"{quote(container_name)}/{quote(prefix)}/master.m3u8"
+            )
+            if options["dry_run"]:
+                self.stdout.write(self.style.SUCCESS(f"Dry run: would upload and set {manifest_url}"))
+                return
+
+            container_client = self._build_blob_service_client().get_container_client(container_name)
+
+            def upload(path):
+                with open(path, "rb") as data:
+                    container_client.upload_blob(
+                        f"{prefix}/{path.relative_to(output_dir).as_posix()}",
+                        data,
+                        overwrite=True,
+                        content_settings=ContentSettings(
+                            content_type=CONTENT_TYPES.get(path.suffix, "application/octet-stream"),
+                            # Segments never change under a name; playlists are rewritten on re-packaging.
+                            cache_control="public, max-age=31536000, immutable" if path.suffix == ".ts"
+                            else "public, max-age=60",
+                        ),
+                    )
+
+            # Segments first, then variant playlists, master last: a player that finds
+            # the master playlist can always fetch everything it references.
+            segments = [path for path in files if path.suffix != ".m3u8"]
+            playlists = [path for path in files if path.suffix == ".m3u8" and path.name != "master.m3u8"]
+            with ThreadPoolExecutor(max_workers=options["upload_concurrency"]) as uploads:
+                for group in (segments, playlists):
+                    list(uploads.map(upload, group))
+            upload(output_dir / "master.m3u8")
+
+        lesson.hls_manifest_url = manifest_url
+        lesson.save(update_fields=["hls_manifest_url", "updated_at"])
+        self.stdout.write(self.style.SUCCESS(f"HLS packaging complete: {manifest_url}"))
+
+    def _probe(self, source_path):
+        """(video height or None, has audio) via ffprobe; unknown without ffprobe."""
+        ffprobe_path = shutil.which("ffprobe")
+        if not ffprobe_path:
+            return None, True
+        result = subprocess.run(
+            [ffprobe_path, "-v", "error", "-show_entries", "stream=codec_type,height", "-of", "json", str(source_path)],
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            return None, True
+        streams = json.loads(result.stdout or "{}").get("streams", [])
+        heights = [stream.get("height") for stream in streams if stream.get("codec_type") == "video"]
+        has_audio = any(stream.get("codec_type") == "audio" for stream in streams)
+        return (heights[0] if heights and heights[0] else None), has_audio
+
+    def _ffmpeg_command(self, ffmpeg_path, source_path, output_dir, ladder, segment_seconds, has_audio):
+        """One ffmpeg run: split and scale the video once per rendition, keyframes on segment boundaries."""
+        splits = "".join(f"[v{index}]" for index in range(len(ladder)))
+        filters = [f"[0:v]split={len(ladder)}{splits}"]
+        filters += [f"[v{index}]scale=-2:{rung[1]}[v{index}out]" for index, rung in enumerate(ladder)]
+
+        cmd = [ffmpeg_path, "-y", "-i", str(source_path), "-filter_complex", ";".join(filters)]
+        stream_map = []
+        for index, (name, _, bitrate, maxrate, bufsize, audio_bitrate) in enumerate(ladder):
+            cmd += [
+                "-map", f"[v{index}out]",
+                f"-c:v:{index}", "libx264",
+                f"-b:v:{index}", bitrate,
+                f"-maxrate:v:{index}", maxrate,
+                f"-bufsize:v:{index}", bufsize,
+            ]
+            if has_audio:
+                cmd += ["-map", "a:0", f"-c:a:{index}", "aac", f"-b:a:{index}", audio_bitrate, "-ac", "2"]
+                stream_map.append(f"v:{index},a:{index},name:{name}")
+            else:
+                stream_map.append(f"v:{index},name:{name}")
+
+        cmd += [
+            "-preset", "veryfast",
+            "-pix_fmt", "yuv420p",
+            "-sc_threshold", "0",
+            "-force_key_frames", f"expr:gte(t,n_forced*{segment_seconds})",
+            "-f", "hls",
+            "-hls_time", str(segment_seconds),
+            "-hls_playlist_type", "vod",
+            "-hls_flags", "independent_segments",
+            "-hls_segment_filename", str(output_dir / "%v" / "segment_%05d.ts"),
+            "-master_pl_name", "master.m3u8",
+            "-var_stream_map", " ".join(stream_map),
+            str(output_dir / "%v" / "index.m3u8"),
+        ]
+        return cmd
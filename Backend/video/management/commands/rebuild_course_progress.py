@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from video.progress import rebuild_course_progress
+
+
+class Command(BaseCommand):
+    help = "Recompute the materialized UserCourseProgress table from lesson progress, enrollments and lessons."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per INSERT')
+
+    def handle(self, *args, **options):
+        count = rebuild_course_progress(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt course progress for {count} user/course pairs'))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from video.models import Course, Rating
+
+
+STAR_FIELDS = [f'rating_{star}_count' for star in range(1, 6)]
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalized rating sum, count and per-star histogram on every course from video_rating."
+
+    def handle(self, *args, **options):
+        aggregates = {
+            row['course_id']: row
+            for row in Rating.objects.order_by().values('course_id').annotate(
+                total=Sum('rating'),
+                count=Count('id'),
+                **{
+                    field: Count('id', filter=Q(rating=star))
+                    for star, field in enumerate(STAR_FIELDS, start=1)
+                },
+            )
+        }
+
+        courses = list(Course.objects.only('id', 'rating_sum', 'rating_count', *STAR_FIELDS))
+        for course in courses:
+            row = aggregates.get(course.id, {})
+            course.rating_sum = row.get('total') or 0
+            course.rating_count = row.get('count') or 0
+            for field in STAR_FIELDS:
+                setattr(course, field, row.get(field) or 0)
+
+        with transaction.atomic():
+            Course.objects.bulk_update(
+                courses,
+                ['rating_sum', 'rating_count', *STAR_FIELDS],
+                batch_size=500,
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Rebuilt rating stats for {len(courses)} courses ({len(aggregates)} with ratings)'
+            )
+        )
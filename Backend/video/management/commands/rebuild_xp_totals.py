@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from video.views import invalidate_leaderboard_cache
+from video.xp import rebuild_xp_totals
+
+
+class Command(BaseCommand):
+    help = "Recompute UserXP totals and DailyXP rows from the XPEvent ledger."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per INSERT/UPDATE')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many rows differ from the ledger')
+        parser.add_argument('--force', action='store_true', help='Also lower totals and daily rows the ledger does not cover')
+
+    def handle(self, *args, **options):
+        users, days, lowered = rebuild_xp_totals(
+            batch_size=options['batch_size'], dry_run=options['dry_run'], force=options['force']
+        )
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(
+                f'{users} user total(s) and {days} daily row(s) differ from the ledger, {lowered} would be lowered'
+            ))
+            return
+        if lowered and not options['force']:
+            self.stdout.write(self.style.ERROR(
+                f'{lowered} total(s)/daily row(s) would be lowered; nothing written. Re-run with --force to apply.'
+            ))
+            return
+        invalidate_leaderboard_cache()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt XP totals: {users} user total(s), {days} daily row(s) changed'))
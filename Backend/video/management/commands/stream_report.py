@@ -0,0 +1,87 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from video.models import Lesson, StreamMetric
+from video.stream_metrics import flush_stream_metrics
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers; None when empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def _ms(value):
+    return '-' if value is None else f'{value} ms'
+
+
+def _mbps(value):
+    return '-' if value is None else f'{value:.1f} Mbit/s'
+
+
+class Command(BaseCommand):
+    help = (
+        "Per-lesson stream telemetry: p50/p95 connect and time to first byte, throughput, "
+        "abort rate and bytes served. Flags the slowest lessons for re-encoding."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='Look back this many days (default: 7)')
+        parser.add_argument('--lesson', type=int, help='Only report this lesson ID')
+        parser.add_argument('--limit', type=int, default=20, help='Lessons to list, slowest first (default: 20)')
+
+    def handle(self, *args, **options):
+        flush_stream_metrics()
+        metrics = StreamMetric.objects.filter(created_at__gte=timezone.now() - timedelta(days=options['days']))
+        if options['lesson']:
+            metrics = metrics.filter(lesson_id=options['lesson'])
+
+        by_lesson = defaultdict(list)
+        for row in metrics.values_list('lesson_id', 'connect_ms', 'ttfb_ms', 'duration_ms', 'bytes_sent', 'aborted'):
+            by_lesson[row[0]].append(row[1:])
+        if not by_lesson:
+            self.stdout.write(self.style.WARNING('No stream metrics recorded in this period'))
+            return
+
+        report = []
+        for lesson_id, rows in by_lesson.items():
+            ttfb = [row[1] for row in rows if row[1] is not None]
+            duration_ms = sum(row[2] for row in rows)
+            total_bytes = sum(row[3] for row in rows)
+            report.append({
+                'lesson_id': lesson_id,
+                'streams': len(rows),
+                'connect_p50': percentile([row[0] for row in rows if row[0] is not None], 0.5),
+                'ttfb_p50': percentile(ttfb, 0.5),
+                'ttfb_p95': percentile(ttfb, 0.95),
+                'mbps': total_bytes * 8 / 1000 / duration_ms if duration_ms else None,
+                'abort_rate': sum(1 for row in rows if row[4]) / len(rows),
+                'bytes': total_bytes,
+            })
+        report.sort(key=lambda item: item['ttfb_p95'] or 0, reverse=True)
+        report = report[:options['limit']]
+        titles = dict(Lesson.objects.filter(id__in=[item['lesson_id'] for item in report]).values_list('id', 'title'))
+
+        for item in report:
+            self.stdout.write(
+                f"Lesson {item['lesson_id']} ({titles.get(item['lesson_id'], '?')}): "
+                f"{item['streams']} streams, connect p50 {_ms(item['connect_p50'])}, "
+                f"TTFB p50 {_ms(item['ttfb_p50'])} / p95 {_ms(item['ttfb_p95'])}, "
+                f"{_mbps(item['mbps'])}, "
+                f"{item['abort_rate']:.0%} aborted, {item['bytes'] // (1024 * 1024)} MB"
+            )
+
+        # Slow first bytes with frequent aborts usually mean a badly encoded file
+        # (moov atom at the end, sparse keyframes) rather than a slow network.
+        slow = [item for item in report if (item['ttfb_p95'] or 0) >= 1000 and item['abort_rate'] >= 0.2]
+        for item in slow:
+            self.stdout.write(self.style.WARNING(
+                f"Lesson {item['lesson_id']} is slow to start and often abandoned; try "
+                f"`python manage.py optimize_lesson_video {item['lesson_id']} --reencode`"
+            ))
+        self.stdout.write(self.style.SUCCESS(f"Reported {len(report)} lesson(s) over {options['days']} day(s)"))
@@ -0,0 +1,72 @@
+# Generated by Django 6.0.2 on 2026-10-18 14:08
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Course = apps.get_model('video', 'Course')
+    Rating = apps.get_model('video', 'Rating')
+
+    star_fields = {f'rating_{star}_count': Count('id', filter=Q(rating=star)) for star in range(1, 6)}
+    rows = Rating.objects.order_by().values('course_id').annotate(
+        total=Sum('rating'),
+        count=Count('id'),
+        **star_fields,
+    )
+    for row in rows:
+        Course.objects.filter(pk=row['course_id']).update(
+            rating_sum=row['total'] or 0,
+            rating_count=row['count'],
+            **{field: row[field] for field in star_fields},
+        )
+
+
+def noop_reverse(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0016_merge_20260306_0543'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, help_text='Number of user ratings'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, help_text='Sum of all user ratings'),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, noop_reverse),
+    ]
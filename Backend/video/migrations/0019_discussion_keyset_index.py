@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-18 14:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0018_resource_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='discussion',
+            options={'ordering': ['-created_at', '-id']},
+        ),
+        migrations.AddIndex(
+            model_name='discussion',
+            index=models.Index(fields=['course', '-created_at', '-id'], name='discussion_course_recent_idx'),
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 6.0.2 on 2026-10-18 15:02
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# Weights: title A, instructor B, learning points C, description D.
+COURSE_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION video_course_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(NEW.instructor_name, '')), 'B') ||
+        setweight(jsonb_to_tsvector('english', coalesce(NEW.what_you_learn, '[]'::jsonb), '["string"]'), 'C') ||
+        setweight(to_tsvector('english', coalesce(NEW.description, '')), 'D');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS video_course_search_vector_trigger ON video_course;
+CREATE TRIGGER video_course_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, instructor_name, what_you_learn, description ON video_course
+    FOR EACH ROW EXECUTE FUNCTION video_course_search_vector_update();
+"""
+
+LESSON_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION video_lesson_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS video_lesson_search_vector_trigger ON video_lesson;
+CREATE TRIGGER video_lesson_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title ON video_lesson
+    FOR EACH ROW EXECUTE FUNCTION video_lesson_search_vector_update();
+"""
+
+DROP_SQL = """
+DROP TRIGGER IF EXISTS video_course_search_vector_trigger ON video_course;
+DROP TRIGGER IF EXISTS video_lesson_search_vector_trigger ON video_lesson;
+DROP FUNCTION IF EXISTS video_course_search_vector_update();
+DROP FUNCTION IF EXISTS video_lesson_search_vector_update();
+DROP INDEX IF EXISTS course_search_vector_idx;
+DROP INDEX IF EXISTS lesson_search_vector_idx;
+"""
+
+
+def create_search_triggers(apps, schema_editor):
+    # Other backends (SQLite in local tests) use the icontains fallback in video/search.py.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(COURSE_TRIGGER_SQL)
+    schema_editor.execute(LESSON_TRIGGER_SQL)
+    # Touch an indexed column so the triggers fill in existing rows.
+    schema_editor.execute('UPDATE video_course SET title = title')
+    schema_editor.execute('UPDATE video_lesson SET title = title')
+    schema_editor.execute('CREATE INDEX course_search_vector_idx ON video_course USING gin (search_vector)')
+    schema_editor.execute('CREATE INDEX lesson_search_vector_idx ON video_lesson USING gin (search_vector)')
+
+
+def drop_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(DROP_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0019_discussion_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        # Triggers and GIN indexes are Postgres-only, so they live outside the model state.
+        migrations.RunPython(create_search_triggers, drop_search_triggers),
+    ]
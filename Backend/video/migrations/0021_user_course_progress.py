@@ -0,0 +1,73 @@
+# Generated by Django 6.0.2 on 2026-10-18 14:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F
+
+
+def backfill_course_progress(apps, schema_editor):
+    Enrollment = apps.get_model('video', 'Enrollment')
+    Lesson = apps.get_model('video', 'Lesson')
+    UserCourseProgress = apps.get_model('video', 'UserCourseProgress')
+    UserProgress = apps.get_model('video', 'UserProgress')
+
+    lesson_totals = dict(
+        Lesson.objects.order_by().values('course_id').annotate(total=Count('id')).values_list('course_id', 'total')
+    )
+    completed = {
+        (user_id, course_id): total
+        for user_id, course_id, total in UserProgress.objects.filter(completed=True).order_by().values(
+            'user_id', 'course_id'
+        ).annotate(total=Count('id')).values_list('user_id', 'course_id', 'total')
+    }
+    last_lessons = {}
+    for user_id, course_id, lesson_id in UserProgress.objects.filter(completed=True).order_by(
+        F('completed_at').asc(nulls_first=True), 'id'
+    ).values_list('user_id', 'course_id', 'lesson_id').iterator():
+        last_lessons[(user_id, course_id)] = lesson_id
+
+    pairs = set(UserProgress.objects.order_by().values_list('user_id', 'course_id').distinct())
+    pairs.update(Enrollment.objects.order_by().values_list('user_id', 'course_id').distinct())
+    UserCourseProgress.objects.bulk_create([
+        UserCourseProgress(
+            user_id=user_id,
+            course_id=course_id,
+            completed_lessons=completed.get((user_id, course_id), 0),
+            total_lessons=lesson_totals.get(course_id, 0),
+            last_lesson_id=last_lessons.get((user_id, course_id)),
+        )
+        for user_id, course_id in pairs
+    ], batch_size=1000)
+
+
+def noop_reverse(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0020_search_vectors'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserCourseProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('completed_lessons', models.PositiveIntegerField(default=0)),
+                ('total_lessons', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='course_progress', to='video.course')),
+                ('last_lesson', models.ForeignKey(blank=True, help_text='Most recently completed lesson', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='video.lesson')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='course_progress', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'User Course Progress',
+                'unique_together': {('user', 'course')},
+            },
+        ),
+        migrations.RunPython(backfill_course_progress, noop_reverse),
+    ]
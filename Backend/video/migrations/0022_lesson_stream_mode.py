@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 14:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0021_user_course_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lesson',
+            name='stream_mode',
+            field=models.CharField(blank=True, choices=[('proxy', 'Proxy through API'), ('redirect', 'Redirect to signed blob URL')], help_text="Override how /stream/ delivers this lesson's video", max_length=10),
+        ),
+    ]
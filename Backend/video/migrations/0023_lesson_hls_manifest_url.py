@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 14:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0022_lesson_stream_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lesson',
+            name='hls_manifest_url',
+            field=models.URLField(blank=True, help_text='HLS master playlist, set by the package_lesson_hls command', max_length=500),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.0.2 on 2026-10-18 14:45
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0023_lesson_hls_manifest_url'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StreamMetric',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('range_start', models.BigIntegerField(blank=True, help_text='First requested byte; empty for suffix ranges', null=True)),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('connect_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('ttfb_ms', models.PositiveIntegerField(blank=True, help_text='Until the first upstream body byte', null=True)),
+                ('duration_ms', models.PositiveIntegerField(default=0)),
+                ('bytes_sent', models.BigIntegerField(default=0)),
+                ('aborted', models.BooleanField(default=False, help_text='Client went away before the last byte')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('lesson', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stream_metrics', to='video.lesson')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['lesson', 'created_at'], name='streammetric_lesson_time_idx'), models.Index(fields=['created_at'], name='streammetric_time_idx')],
+            },
+        ),
+    ]
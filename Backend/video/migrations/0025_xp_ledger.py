@@ -0,0 +1,55 @@
+# Generated by Django 6.0.2 on 2026-10-18 15:00
+
+import re
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_xp_events(apps, schema_editor):
+    """One event per progress row that already paid out, valued as mark_complete parses time_xp."""
+    UserProgress = apps.get_model('video', 'UserProgress')
+    XPEvent = apps.get_model('video', 'XPEvent')
+
+    events = []
+    for user_id, lesson_id, time_xp, completed_at, updated_at in UserProgress.objects.filter(
+        xp_chunks_awarded__gt=0
+    ).values_list('user_id', 'lesson_id', 'lesson__time_xp', 'completed_at', 'updated_at').iterator():
+        match = re.search(r'-?\d+(?:\.\d+)?', str(time_xp or ''))
+        amount = int(float(match.group(0))) if match else 0
+        if amount > 0:
+            events.append(XPEvent(user_id=user_id, lesson_id=lesson_id, amount=amount, awarded_at=completed_at or updated_at))
+    XPEvent.objects.bulk_create(events, batch_size=1000, ignore_conflicts=True)
+
+
+def noop_reverse(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0024_stream_metrics'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='XPEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveIntegerField(help_text='XP awarded')),
+                ('awarded_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Also decides the DailyXP day')),
+                ('lesson', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='xp_events', to='video.lesson')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='xp_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'XP event',
+                'indexes': [models.Index(fields=['user', 'awarded_at'], name='xpevent_user_time_idx')],
+                'unique_together': {('user', 'lesson')},
+            },
+        ),
+        migrations.RunPython(backfill_xp_events, noop_reverse),
+    ]
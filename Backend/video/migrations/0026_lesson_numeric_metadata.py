@@ -0,0 +1,40 @@
+# Generated by Django 6.0.2 on 2026-10-18 15:03
+
+from django.db import migrations, models
+
+from video.lesson_metadata import parse_duration_seconds, parse_xp_value
+
+
+def backfill_lesson_metadata(apps, schema_editor):
+    """Historical models skip Lesson.save(), so parse the strings here."""
+    Lesson = apps.get_model('video', 'Lesson')
+    lessons = list(Lesson.objects.only('id', 'time_xp', 'duration'))
+    for lesson in lessons:
+        lesson.xp_value = parse_xp_value(lesson.time_xp)
+        lesson.duration_seconds = parse_duration_seconds(lesson.duration)
+    Lesson.objects.bulk_update(lessons, ['xp_value', 'duration_seconds'], batch_size=500)
+
+
+def noop_reverse(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0025_xp_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lesson',
+            name='duration_seconds',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Parsed from duration'),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='xp_value',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='XP for completing the lesson, parsed from time_xp'),
+        ),
+        migrations.RunPython(backfill_lesson_metadata, noop_reverse),
+    ]
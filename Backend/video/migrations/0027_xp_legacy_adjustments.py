@@ -0,0 +1,29 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:10
+
+from django.db import migrations
+
+from video.xp import seed_legacy_adjustments
+
+
+def seed_adjustments(apps, schema_editor):
+    """Make the ledger reproduce today's UserXP and DailyXP before anything is rebuilt from it."""
+    seed_legacy_adjustments(
+        event_model=apps.get_model('video', 'XPEvent'),
+        profile_model=apps.get_model('video', 'UserXP'),
+        daily_model=apps.get_model('video', 'DailyXP'),
+    )
+
+
+def remove_adjustments(apps, schema_editor):
+    apps.get_model('video', 'XPEvent').objects.filter(lesson__isnull=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0026_lesson_numeric_metadata'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_adjustments, remove_adjustments),
+    ]
@@ -1,7 +1,11 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+from django.contrib.postgres.search import SearchVectorField
 from embed_video.fields import EmbedVideoField
 
+from .lesson_metadata import parse_duration_seconds, parse_xp_value
+
 
 class Course(models.Model):
     """Main course model - matches CourseVideoPage structure"""
@@ -31,8 +35,20 @@ class Course(models.Model):
     rating = models.DecimalField(max_digits=3, decimal_places=1, default=0.0, help_text="e.g., 4.3")
     total_duration = models.CharField(max_length=100, blank=True, help_text="e.g., '3 Components', '10 hours'")
     
+    # Rating aggregates - maintained by RatingViewSet, rebuilt by `manage.py rebuild_rating_stats`
+    rating_sum = models.PositiveIntegerField(default=0, help_text="Sum of all user ratings")
+    rating_count = models.PositiveIntegerField(default=0, help_text="Number of user ratings")
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
+    
     # Publishing
     is_published = models.BooleanField(default=False)
+
+    # Full-text search: trigger-maintained and GIN-indexed on Postgres (migration 0020)
+    search_vector = SearchVectorField(null=True, editable=False)
     
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
@@ -49,10 +65,47 @@ class Course(models.Model):
         """Count total lessons in this course"""
         return self.lessons.count()
     
+    @property
+    def total_duration_seconds(self):
+        """Sum of lesson durations in seconds"""
+        return self.lessons.aggregate(total=models.Sum('duration_seconds'))['total'] or 0
+    
     @property
     def completed_count(self):
         """Count of completed lessons (placeholder for now)"""
         return 0  # Will be user-specific
+    
+    @property
+    def average_rating(self):
+        """Average user rating from the denormalized aggregates"""
+        if not self.rating_count:
+            return 0.0
+        return round(self.rating_sum / self.rating_count, 1)
+    
+    @property
+    def rating_breakdown(self):
+        """Number of ratings per star: {'1': 0, ..., '5': 12}"""
+        return {str(star): getattr(self, f'rating_{star}_count') for star in range(1, 6)}
+    
+    @classmethod
+    def apply_rating_change(cls, course_id, added=None, removed=None):
+        """
+        Adjust rating aggregates for one added and/or removed rating value.
+        Uses F() expressions so concurrent rating writes cannot lose updates.
+        """
+        deltas = {}
+        if removed:
+            deltas['rating_sum'] = deltas.get('rating_sum', 0) - int(removed)
+            deltas['rating_count'] = deltas.get('rating_count', 0) - 1
+            deltas[f'rating_{int(removed)}_count'] = deltas.get(f'rating_{int(removed)}_count', 0) - 1
+        if added:
+            deltas['rating_sum'] = deltas.get('rating_sum', 0) + int(added)
+            deltas['rating_count'] = deltas.get('rating_count', 0) + 1
+            deltas[f'rating_{int(added)}_count'] = deltas.get(f'rating_{int(added)}_count', 0) + 1
+        
+        updates = {field: models.F(field) + delta for field, delta in deltas.items() if delta}
+        if updates:
+            cls.objects.filter(pk=course_id).update(**updates)
 
 
 class Lesson(models.Model):
@@ -64,12 +117,32 @@ class Lesson(models.Model):
     duration = models.CharField(max_length=50, blank=True, help_text="e.g., '1:45 min'")
     time_xp = models.CharField(max_length=50, blank=True, help_text="XP/time display: e.g., '451.02'")
     
+    # Typed copies of duration / time_xp, derived on save (video/lesson_metadata.py)
+    duration_seconds = models.PositiveIntegerField(default=0, editable=False, help_text="Parsed from duration")
+    xp_value = models.PositiveIntegerField(default=0, editable=False, help_text="XP for completing the lesson, parsed from time_xp")
+    
     # Video Details
     video_url = models.URLField(help_text="YouTube, Vimeo, or other video URL")
     thumbnail_url = models.URLField(blank=True)
+    hls_manifest_url = models.URLField(
+        max_length=500,
+        blank=True,
+        help_text="HLS master playlist, set by the package_lesson_hls command"
+    )
     
     # Ordering
     order = models.PositiveIntegerField(default=0, help_text="Lesson number/order")
+
+    # Delivery: blank follows settings.VIDEO_STREAM_MODE
+    stream_mode = models.CharField(
+        max_length=10,
+        blank=True,
+        choices=[('proxy', 'Proxy through API'), ('redirect', 'Redirect to signed blob URL')],
+        help_text="Override how /stream/ delivers this lesson's video"
+    )
+
+    # Full-text search: trigger-maintained and GIN-indexed on Postgres (migration 0020)
+    search_vector = SearchVectorField(null=True, editable=False)
     
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
@@ -81,6 +154,15 @@ class Lesson(models.Model):
     
     def __str__(self):
         return f"{self.course.title} - Lesson {self.order}: {self.title}"
+    
+    def save(self, *args, **kwargs):
+        """Keep xp_value and duration_seconds in step with the display strings"""
+        self.xp_value = parse_xp_value(self.time_xp)
+        self.duration_seconds = parse_duration_seconds(self.duration)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'time_xp', 'duration'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'xp_value', 'duration_seconds'}
+        super().save(*args, **kwargs)
 
 
 class Discussion(models.Model):
@@ -100,7 +182,11 @@ class Discussion(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        # Backs keyset pagination of a course's discussions, newest first
+        indexes = [
+            models.Index(fields=['course', '-created_at', '-id'], name='discussion_course_recent_idx'),
+        ]
     
     def __str__(self):
         return f"{self.author_name} on {self.course.title}"
@@ -115,6 +201,7 @@ class Resource(models.Model):
     order = models.PositiveIntegerField(default=0)
     
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['order', 'created_at']
@@ -173,6 +260,38 @@ class UserProgress(models.Model):
         return self.watch_percentage >= 90
 
 
+class UserCourseProgress(models.Model):
+    """Materialized per-user course completion, maintained by video/progress.py"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='course_progress')
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='course_progress')
+    
+    completed_lessons = models.PositiveIntegerField(default=0)
+    total_lessons = models.PositiveIntegerField(default=0)
+    last_lesson = models.ForeignKey(
+        Lesson,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        help_text="Most recently completed lesson"
+    )
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['user', 'course']
+        verbose_name_plural = "User Course Progress"
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.course.title} ({self.completed_lessons}/{self.total_lessons})"
+    
+    @property
+    def progress_percentage(self):
+        if self.total_lessons == 0:
+            return 0
+        return int((min(self.completed_lessons, self.total_lessons) / self.total_lessons) * 100)
+
+
 class UserNotes(models.Model):
     """User's course notes - matches Notes tab"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='course_notes')
@@ -297,6 +416,50 @@ class DailyXP(models.Model):
         return self.xp_earned >= 150
 
 
+class XPEvent(models.Model):
+    """Append-only XP ledger: one award per user and lesson. UserXP and DailyXP are totals of it (video/xp.py)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='xp_events')
+    # Kept when a lesson is deleted, so totals rebuilt from the ledger do not shrink
+    lesson = models.ForeignKey(Lesson, on_delete=models.SET_NULL, null=True, blank=True, related_name='xp_events')
+    amount = models.PositiveIntegerField(help_text="XP awarded")
+    awarded_at = models.DateTimeField(default=timezone.now, help_text="Also decides the DailyXP day")
+    
+    class Meta:
+        unique_together = ['user', 'lesson']
+        verbose_name = "XP event"
+        indexes = [
+            models.Index(fields=['user', 'awarded_at'], name='xpevent_user_time_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id} +{self.amount} XP (lesson {self.lesson_id})"
+
+
+class StreamMetric(models.Model):
+    """One proxied lesson stream, written in batches by video/stream_metrics.py"""
+    lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE, related_name='stream_metrics')
+    range_start = models.BigIntegerField(null=True, blank=True, help_text="First requested byte; empty for suffix ranges")
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    
+    # Timings in milliseconds; connect is 0 when a pooled connection was reused
+    connect_ms = models.PositiveIntegerField(null=True, blank=True)
+    ttfb_ms = models.PositiveIntegerField(null=True, blank=True, help_text="Until the first upstream body byte")
+    duration_ms = models.PositiveIntegerField(default=0)
+    bytes_sent = models.BigIntegerField(default=0)
+    aborted = models.BooleanField(default=False, help_text="Client went away before the last byte")
+    
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['lesson', 'created_at'], name='streammetric_lesson_time_idx'),
+            models.Index(fields=['created_at'], name='streammetric_time_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Lesson {self.lesson_id} @ {self.range_start}: {self.bytes_sent} bytes in {self.duration_ms} ms"
+
+
 # Keep old Video model for backward compatibility (can be removed later)
 class Video(models.Model):
     """DEPRECATED: Use Lesson model instead. Kept for backward compatibility."""
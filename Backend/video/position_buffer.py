@@ -0,0 +1,276 @@
+"""
+Write-behind buffer for lesson watch positions.
+
+Player heartbeats move UserProgress.last_position every few seconds. Rather than an
+UPDATE per heartbeat, the position and watch percentage are buffered and written out
+later with one upsert per flush:
+
+    REDIS_URL set   one Redis hash shared by every worker (video:positions)
+    otherwise       a dict in this worker process
+
+The views still write immediately when it matters: the first heartbeat of a lesson
+creates the row, and a watch percentage reaching 90% is persisted at once so
+mark_complete sees it. Anything written directly drops the buffered entry.
+
+Reads merge buffered values on top of the rows (overlay_buffered_progress), which
+get_user_progress_map() and UserProgressViewSet do, and buffered_progress_stamp()
+goes into the course ETag so conditional GETs notice buffered moves.
+
+The buffer is flushed once its oldest entry is VIDEO_POSITION_FLUSH_SECONDS old
+(checked on every buffered write), at process exit, and by
+``manage.py flush_watch_positions`` (deploy/flush-watch-positions.timer, Redis only).
+Redis errors fall back to writing through. An in-process buffer is lost if the
+worker is killed, and other workers only see it once flushed.
+"""
+import atexit
+import json
+import threading
+import time
+
+import redis
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DatabaseError
+
+from .models import Lesson
+from .progress import upsert_progress_entries
+
+
+POSITION_HASH_KEY = 'video:positions'
+POSITION_SINCE_KEY = 'video:positions:since'
+POSITION_STAMP_KEY = 'video:positions:stamp:{user_id}:{course_id}'
+POSITION_STAMP_TTL = 24 * 60 * 60
+
+
+def _field(user_id, lesson_id):
+    return f'{user_id}:{lesson_id}'
+
+
+class RedisPositionStore:
+    def __init__(self, url):
+        self.url = url
+        self.client = redis.Redis.from_url(url, socket_connect_timeout=5, socket_timeout=5)
+
+    def put(self, user_id, lesson_id, value):
+        """Buffer `value`; returns the time the oldest buffered entry was added."""
+        pipe = self.client.pipeline()
+        pipe.hset(POSITION_HASH_KEY, _field(user_id, lesson_id), json.dumps(value))
+        pipe.set(POSITION_STAMP_KEY.format(user_id=user_id, course_id=value['course_id']), value['at'], ex=POSITION_STAMP_TTL)
+        pipe.set(POSITION_SINCE_KEY, value['at'], nx=True)
+        pipe.get(POSITION_SINCE_KEY)
+        return float(pipe.execute()[-1] or value['at'])
+
+    def get(self, user_id, lesson_ids):
+        lesson_ids = list(lesson_ids)
+        if not lesson_ids:
+            return {}
+        values = self.client.hmget(POSITION_HASH_KEY, [_field(user_id, lesson_id) for lesson_id in lesson_ids])
+        return {lesson_id: json.loads(value) for lesson_id, value in zip(lesson_ids, values) if value}
+
+    def discard(self, user_id, lesson_ids):
+        fields = [_field(user_id, lesson_id) for lesson_id in lesson_ids]
+        if fields:
+            self.client.hdel(POSITION_HASH_KEY, *fields)
+
+    def stamp(self, user_id, course_id):
+        value = self.client.get(POSITION_STAMP_KEY.format(user_id=user_id, course_id=course_id))
+        return value.decode() if value else ''
+
+    def drain(self):
+        """Take every buffered entry atomically: {(user_id, lesson_id): value}."""
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hgetall(POSITION_HASH_KEY)
+        pipe.delete(POSITION_HASH_KEY, POSITION_SINCE_KEY)
+        entries, _ = pipe.execute()
+        return {
+            tuple(int(part) for part in field.decode().split(':')): json.loads(value)
+            for field, value in entries.items()
+        }
+
+    def restore(self, entries):
+        """Put back entries a failed flush took, unless a newer heartbeat replaced them."""
+        pipe = self.client.pipeline()
+        for (user_id, lesson_id), value in entries.items():
+            pipe.hsetnx(POSITION_HASH_KEY, _field(user_id, lesson_id), json.dumps(value))
+        pipe.set(POSITION_SINCE_KEY, time.time(), nx=True)
+        pipe.execute()
+
+
+class MemoryPositionStore:
+    url = ''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._stamps = {}
+        self._since = None
+
+    def put(self, user_id, lesson_id, value):
+        with self._lock:
+            self._entries[(user_id, lesson_id)] = value
+            self._stamps[_field(user_id, value['course_id'])] = value['at']
+            if self._since is None:
+                self._since = value['at']
+            return self._since
+
+    def get(self, user_id, lesson_ids):
+        with self._lock:
+            return {
+                lesson_id: self._entries[(user_id, lesson_id)]
+                for lesson_id in lesson_ids if (user_id, lesson_id) in self._entries
+            }
+
+    def discard(self, user_id, lesson_ids):
+        with self._lock:
+            for lesson_id in lesson_ids:
+                self._entries.pop((user_id, lesson_id), None)
+
+    def stamp(self, user_id, course_id):
+        with self._lock:
+            return str(self._stamps.get(_field(user_id, course_id), ''))
+
+    def drain(self):
+        with self._lock:
+            entries, self._entries, self._since = self._entries, {}, None
+            # Flushed rows carry a newer updated_at, which the ETag already covers.
+            self._stamps = {}
+            return entries
+
+    def restore(self, entries):
+        with self._lock:
+            for key, value in entries.items():
+                self._entries.setdefault(key, value)
+            if self._since is None:
+                self._since = time.time()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _get_store():
+    """This process's position store, or None when buffering is disabled."""
+    global _store
+    if not getattr(settings, 'VIDEO_POSITION_BUFFER', True):
+        return None
+    url = getattr(settings, 'REDIS_URL', '')
+    with _store_lock:
+        if _store is None or _store.url != url:
+            _store = RedisPositionStore(url) if url else MemoryPositionStore()
+        return _store
+
+
+def buffer_progress(user_id, course_id, lesson_id, last_position, watch_percentage=0):
+    """
+    Buffer a heartbeat for an existing progress row. Returns False when the caller
+    must write it through instead (buffering is off or Redis is unavailable).
+    """
+    store = _get_store()
+    if store is None:
+        return False
+    now = time.time()
+    try:
+        since = store.put(user_id, lesson_id, {
+            'course_id': course_id,
+            'last_position': last_position,
+            'watch_percentage': watch_percentage,
+            'at': now,
+        })
+    except redis.RedisError:
+        return False
+    if now - since >= float(getattr(settings, 'VIDEO_POSITION_FLUSH_SECONDS', 30)):
+        flush_buffered_progress()
+    return True
+
+
+def discard_buffered_progress(user_id, lesson_ids):
+    """Drop buffered heartbeats after the rows were written directly."""
+    store = _get_store()
+    if store is None:
+        return
+    try:
+        store.discard(user_id, list(lesson_ids))
+    except redis.RedisError:
+        pass
+
+
+def overlay_buffered_progress(user_id, rows):
+    """Merge buffered positions and percentages into UserProgress instances in place."""
+    store = _get_store()
+    rows = list(rows)
+    if store is None or not rows:
+        return rows
+    try:
+        buffered = store.get(user_id, [row.lesson_id for row in rows])
+    except redis.RedisError:
+        return rows
+    for row in rows:
+        value = buffered.get(row.lesson_id)
+        if value and value['course_id'] == row.course_id:
+            row.last_position = value['last_position']
+            row.watch_percentage = max(row.watch_percentage, value['watch_percentage'])
+    return rows
+
+
+def buffered_progress_stamp(user_id, course_id):
+    """Time of the user's latest buffered heartbeat in a course ('' if none), for ETags."""
+    store = _get_store()
+    if store is None:
+        return ''
+    try:
+        return store.stamp(user_id, course_id)
+    except redis.RedisError:
+        return ''
+
+
+def flush_buffered_progress():
+    """Write every buffered heartbeat with one upsert; returns how many rows were written."""
+    store = _get_store()
+    if store is None:
+        return 0
+    try:
+        buffered = store.drain()
+    except redis.RedisError:
+        return 0
+    if not buffered:
+        return 0
+
+    # Users and lessons deleted (or lessons moved to another course) since the
+    # heartbeat are skipped, so one stale entry cannot fail everyone's upsert.
+    lesson_courses = dict(
+        Lesson.objects.filter(id__in={lesson_id for _, lesson_id in buffered}).values_list('id', 'course_id')
+    )
+    user_ids = set(
+        User.objects.filter(id__in={user_id for user_id, _ in buffered}).values_list('id', flat=True)
+    )
+    entries = {
+        key: {
+            'course_id': value['course_id'],
+            'watch_percentage': value['watch_percentage'],
+            'last_position': value['last_position'],
+            'video_duration': 0,
+        }
+        for key, value in buffered.items()
+        if key[0] in user_ids and lesson_courses.get(key[1]) == value['course_id']
+    }
+    try:
+        upsert_progress_entries(entries)
+    except DatabaseError:
+        # Including IntegrityError from a row deleted after the check above: put the
+        # entries back and let the next flush filter again.
+        try:
+            store.restore({key: buffered[key] for key in entries})
+        except redis.RedisError:
+            pass
+        return 0
+    return len(entries)
+
+
+def _flush_at_exit():
+    try:
+        flush_buffered_progress()
+    except Exception:
+        pass
+
+
+atexit.register(_flush_at_exit)
@@ -0,0 +1,298 @@
+"""
+Materialized per-user course progress (UserCourseProgress).
+
+Rows change in the same transaction as the write that moves them: a first-time
+lesson completion increments ``completed_lessons``, lessons added to or removed
+from a course recount that course's rows, and direct UserProgress edits recount
+one row. ``manage.py rebuild_course_progress`` recomputes everything from
+UserProgress if the table ever drifts.
+
+Lesson progress itself is written with ``upsert_progress``: one
+INSERT ... ON CONFLICT DO UPDATE per write (per batch for ``apply_progress_events``),
+so concurrent heartbeats neither race on get_or_create nor lower watch_percentage.
+"""
+from django.db import connection, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Enrollment, Lesson, UserCourseProgress, UserProgress
+
+
+def _count_lessons(course_id):
+    return Lesson.objects.filter(course_id=course_id).count()
+
+
+def _count_completed(user_id, course_id):
+    return UserProgress.objects.filter(user_id=user_id, course_id=course_id, completed=True).count()
+
+
+def ensure_course_progress(user_id, course_id):
+    """Return the user's row for a course, creating it from UserProgress if missing."""
+    row, _ = UserCourseProgress.objects.get_or_create(
+        user_id=user_id,
+        course_id=course_id,
+        defaults={
+            'completed_lessons': _count_completed(user_id, course_id),
+            'total_lessons': _count_lessons(course_id),
+        }
+    )
+    return row
+
+
+def record_lesson_completion(progress):
+    """
+    Count a first-time lesson completion. Call inside the transaction that flipped
+    ``progress.completed`` so the row and the lesson never disagree.
+    """
+    row, created = UserCourseProgress.objects.get_or_create(
+        user_id=progress.user_id,
+        course_id=progress.course_id,
+        defaults={
+            # Counted after the flip, so the new completion is already included.
+            'completed_lessons': _count_completed(progress.user_id, progress.course_id),
+            'total_lessons': _count_lessons(progress.course_id),
+            'last_lesson_id': progress.lesson_id,
+        }
+    )
+    if not created:
+        UserCourseProgress.objects.filter(pk=row.pk).update(
+            completed_lessons=F('completed_lessons') + 1,
+            last_lesson_id=progress.lesson_id,
+            updated_at=timezone.now()
+        )
+
+
+def refresh_course_progress(user_id, course_id):
+    """Recount one user's row after UserProgress was edited directly."""
+    UserCourseProgress.objects.update_or_create(
+        user_id=user_id,
+        course_id=course_id,
+        defaults={
+            'completed_lessons': _count_completed(user_id, course_id),
+            'total_lessons': _count_lessons(course_id),
+        }
+    )
+
+
+def refresh_course_totals(course_id):
+    """Recount every row of a course in one UPDATE after lessons are added or removed."""
+    completed = UserProgress.objects.filter(
+        user=OuterRef('user'),
+        course=OuterRef('course'),
+        completed=True
+    ).order_by().values('user').annotate(total=Count('id')).values('total')
+    UserCourseProgress.objects.filter(course_id=course_id).update(
+        total_lessons=_count_lessons(course_id),
+        completed_lessons=Coalesce(Subquery(completed, output_field=IntegerField()), 0),
+        updated_at=timezone.now()
+    )
+
+
+def rebuild_course_progress(batch_size=1000):
+    """
+    Recompute every UserCourseProgress row from UserProgress, Enrollment and Lesson.
+    Rows are replaced in one transaction, so readers see either the old or new table.
+    Returns the number of rows written.
+    """
+    lesson_totals = dict(
+        Lesson.objects.order_by().values('course_id').annotate(total=Count('id')).values_list('course_id', 'total')
+    )
+    completed = {
+        (user_id, course_id): total
+        for user_id, course_id, total in UserProgress.objects.filter(completed=True).order_by().values(
+            'user_id', 'course_id'
+        ).annotate(total=Count('id')).values_list('user_id', 'course_id', 'total')
+    }
+    last_lessons = {}
+    for user_id, course_id, lesson_id in UserProgress.objects.filter(completed=True).order_by(
+        F('completed_at').asc(nulls_first=True), 'id'
+    ).values_list('user_id', 'course_id', 'lesson_id').iterator():
+        last_lessons[(user_id, course_id)] = lesson_id
+
+    pairs = set(UserProgress.objects.order_by().values_list('user_id', 'course_id').distinct())
+    pairs.update(Enrollment.objects.order_by().values_list('user_id', 'course_id').distinct())
+
+    rows = [
+        UserCourseProgress(
+            user_id=user_id,
+            course_id=course_id,
+            completed_lessons=completed.get((user_id, course_id), 0),
+            total_lessons=lesson_totals.get(course_id, 0),
+            last_lesson_id=last_lessons.get((user_id, course_id)),
+        )
+        for user_id, course_id in pairs
+    ]
+    with transaction.atomic():
+        UserCourseProgress.objects.all().delete()
+        UserCourseProgress.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+# ========== LESSON PROGRESS UPSERTS ==========
+
+# Columns an upsert may set; everything else keeps its stored (or default) value.
+UPSERT_FIELDS = ('watch_percentage', 'last_position', 'video_duration_seconds')
+
+
+def _row_converters():
+    """Backend converters for every UserProgress column, as the ORM applies them."""
+    table = UserProgress._meta.db_table
+    converters = []
+    for field in UserProgress._meta.concrete_fields:
+        column = field.get_col(table)
+        converters.append((column, connection.ops.get_db_converters(column) + column.get_db_converters(connection)))
+    return converters
+
+
+def _upsert_rows_sql(rows, fields):
+    qn = connection.ops.quote_name
+    table = UserProgress._meta.db_table
+    now = UserProgress._meta.get_field('updated_at').get_db_prep_value(timezone.now(), connection)
+    insert_columns = [
+        'user_id', 'course_id', 'lesson_id', 'completed', 'last_position', 'watch_percentage',
+        'video_duration_seconds', 'xp_chunks_awarded', 'created_at', 'updated_at',
+    ]
+    params = []
+    for user_id, course_id, lesson_id, values in rows:
+        params += [
+            user_id, course_id, lesson_id, False, values.get('last_position', 0), values.get('watch_percentage', 0),
+            values.get('video_duration_seconds', 0), 0, now, now,
+        ]
+
+    greatest = 'MAX' if connection.vendor == 'sqlite' else 'GREATEST'
+    assignments = []
+    for field in fields:
+        stored, new = f'{qn(table)}.{qn(field)}', f'EXCLUDED.{qn(field)}'
+        if field == 'watch_percentage':
+            assignments.append(f'{qn(field)} = {greatest}({stored}, {new})')
+        elif field == 'video_duration_seconds':
+            assignments.append(f'{qn(field)} = CASE WHEN {new} > 0 THEN {new} ELSE {stored} END')
+        else:
+            assignments.append(f'{qn(field)} = {new}')
+    # Without fields this still touches the row, so RETURNING yields it.
+    assignments.append(f'{qn("updated_at")} = EXCLUDED.{qn("updated_at")}' if fields else f'{qn("updated_at")} = {qn(table)}.{qn("updated_at")}')
+
+    placeholders = '(' + ', '.join(['%s'] * len(insert_columns)) + ')'
+    sql = (
+        f'INSERT INTO {qn(table)} ({", ".join(qn(column) for column in insert_columns)}) '
+        f'VALUES {", ".join([placeholders] * len(rows))} '
+        f'ON CONFLICT ({qn("user_id")}, {qn("course_id")}, {qn("lesson_id")}) DO UPDATE SET {", ".join(assignments)} '
+        f'RETURNING {", ".join(qn(field.column) for field in UserProgress._meta.concrete_fields)}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        results = cursor.fetchall()
+
+    converters = _row_converters()
+    attnames = [field.attname for field in UserProgress._meta.concrete_fields]
+    instances = []
+    for result in results:
+        values = []
+        for value, (column, column_converters) in zip(result, converters):
+            for converter in column_converters:
+                value = converter(value, column, connection)
+            values.append(value)
+        instances.append(UserProgress.from_db(connection.alias, attnames, values))
+    return instances
+
+
+def _upsert_rows_orm(rows, fields):
+    """Fallback for databases without INSERT ... ON CONFLICT ... RETURNING."""
+    instances = []
+    with transaction.atomic():
+        for user_id, course_id, lesson_id, values in rows:
+            progress, created = UserProgress.objects.get_or_create(
+                user_id=user_id, course_id=course_id, lesson_id=lesson_id, defaults=values
+            )
+            if not created and fields:
+                updates = {field: values[field] for field in fields}
+                if 'watch_percentage' in updates:
+                    updates['watch_percentage'] = Greatest(F('watch_percentage'), Value(updates['watch_percentage']))
+                if not updates.get('video_duration_seconds', 1):
+                    del updates['video_duration_seconds']
+                UserProgress.objects.filter(pk=progress.pk).update(updated_at=timezone.now(), **updates)
+                progress.refresh_from_db()
+            instances.append(progress)
+    return instances
+
+
+def upsert_progress_rows(rows, fields):
+    """
+    Insert or update many UserProgress rows with one statement:
+    INSERT ... ON CONFLICT (user_id, course_id, lesson_id) DO UPDATE ... RETURNING.
+    ``rows`` are (user_id, course_id, lesson_id, {field: value}) with a value for every
+    name in ``fields`` (a subset of UPSERT_FIELDS); other columns keep what is stored.
+    watch_percentage only ever goes up and a video_duration_seconds of 0 keeps the
+    stored duration. Returns the resulting rows.
+    """
+    if not rows:
+        return []
+    if connection.features.supports_update_conflicts_with_target and connection.features.can_return_rows_from_bulk_insert:
+        return _upsert_rows_sql(rows, fields)
+    return _upsert_rows_orm(rows, fields)
+
+
+def upsert_progress(user_id, course_id, lesson_id, **values):
+    """
+    Create or update one user's progress for a lesson and return the row, e.g.
+    ``upsert_progress(user.id, lesson.course_id, lesson.id, last_position=120)``.
+    Race-free replacement for get_or_create() followed by save().
+    """
+    fields = [field for field in UPSERT_FIELDS if field in values]
+    return upsert_progress_rows([(user_id, course_id, lesson_id, values)], fields)[0]
+
+
+# ========== HEARTBEAT BATCHES ==========
+
+def collapse_progress_events(events):
+    """
+    Fold validated heartbeat events into one entry per lesson: the highest watch
+    percentage, and position/duration from the newest event (client_ts, then list order).
+    """
+    merged = {}
+    for event in sorted(events, key=lambda event: event.get('client_ts') or 0):
+        entry = merged.setdefault(event['lesson'], {'watch_percentage': 0, 'last_position': None, 'video_duration': 0})
+        entry['watch_percentage'] = max(entry['watch_percentage'], event.get('watch_percentage') or 0)
+        if event.get('last_position') is not None:
+            entry['last_position'] = event['last_position']
+        if event.get('video_duration'):
+            entry['video_duration'] = event['video_duration']
+    return merged
+
+
+def upsert_progress_entries(entries):
+    """
+    Write merged progress for many (user_id, lesson_id) pairs. Each entry holds
+    course_id, watch_percentage, last_position (None keeps the stored one) and
+    video_duration (0 keeps it). Entries setting the same columns share one upsert,
+    so a batch or flush is usually a single statement. Returns the rows keyed like ``entries``.
+    """
+    groups = {}
+    for (user_id, lesson_id), entry in entries.items():
+        values = {'watch_percentage': entry['watch_percentage'], 'video_duration_seconds': entry['video_duration']}
+        if entry['last_position'] is not None:
+            values['last_position'] = entry['last_position']
+        groups.setdefault(tuple(values), []).append((user_id, entry['course_id'], lesson_id, values))
+
+    rows = {}
+    with transaction.atomic():
+        for fields, group in groups.items():
+            for progress in upsert_progress_rows(group, fields):
+                rows[(progress.user_id, progress.lesson_id)] = progress
+    return rows
+
+
+def apply_progress_events(user_id, events):
+    """
+    Apply a batch of heartbeats for one user with a single upsert.
+    Returns (rows keyed by lesson id, ids of unknown lessons).
+    """
+    merged = collapse_progress_events(events)
+    lesson_courses = dict(Lesson.objects.filter(id__in=merged).values_list('id', 'course_id'))
+    unknown = sorted(set(merged) - set(lesson_courses))
+    rows = upsert_progress_entries({
+        (user_id, lesson_id): {**merged[lesson_id], 'course_id': course_id}
+        for lesson_id, course_id in lesson_courses.items()
+    })
+    return {lesson_id: progress for (_, lesson_id), progress in rows.items()}, unknown
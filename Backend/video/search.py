@@ -0,0 +1,201 @@
+"""
+Full-text search over courses, lessons and resources.
+
+On Postgres, courses and lessons carry a stored ``search_vector`` that triggers keep
+current and a GIN index covers (migration 0020), so a query is an index lookup plus
+ranking of the matches. Headlines (ts_headline) are only built for the rows on the
+requested page. Other databases (SQLite in local tests) use an ``icontains``
+fallback with a title-first rank and Python-side highlighting.
+"""
+import html
+import re
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import Case, F, FloatField, Q, Value, When
+
+from .models import Course, Lesson, Resource
+
+
+SEARCH_CONFIG = 'english'
+SEARCH_SECTIONS = ('courses', 'lessons', 'resources')
+SEARCH_PAGE_SIZE = 10
+SEARCH_MAX_PAGE_SIZE = 50
+
+# Sentinels survive ts_headline untouched and are swapped for <mark> after escaping.
+_START_SEL = '\x02'
+_STOP_SEL = '\x03'
+
+# (model, fields to highlight) per section
+SECTION_MODELS = {
+    'courses': (Course, ('title', 'description')),
+    'lessons': (Lesson, ('title',)),
+    'resources': (Resource, ('label',)),
+}
+
+
+def _render_highlight(text):
+    """Escape source text and turn the headline sentinels into <mark> tags."""
+    escaped = html.escape(text or '')
+    return escaped.replace(_START_SEL, '<mark>').replace(_STOP_SEL, '</mark>')
+
+
+class PostgresSearchBackend:
+    """Ranked tsvector matching backed by the GIN indexes."""
+
+    def _query(self, text):
+        return SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+
+    def filter(self, section, queryset, text):
+        query = self._query(text)
+        if section == 'resources':
+            # Labels are short and few per course, so they are vectorised on the fly.
+            vector = SearchVector('label', config=SEARCH_CONFIG)
+            queryset = queryset.annotate(label_vector=vector).filter(label_vector=query)
+            return queryset.annotate(rank=SearchRank(vector, query))
+        return queryset.filter(search_vector=query).annotate(rank=SearchRank(F('search_vector'), query))
+
+    def highlight(self, section, rows, text):
+        model, fields = SECTION_MODELS[section]
+        query = self._query(text)
+        headlines = {
+            f'{field}_headline': SearchHeadline(
+                field,
+                query,
+                config=SEARCH_CONFIG,
+                start_sel=_START_SEL,
+                stop_sel=_STOP_SEL,
+                # Descriptions are cut to fragments; short fields come back whole.
+                max_fragments=2 if field == 'description' else None,
+                highlight_all=None if field == 'description' else True,
+            )
+            for field in fields
+        }
+        values = model.objects.filter(pk__in=[row.pk for row in rows]).annotate(**headlines).values(
+            'pk', *headlines.keys()
+        )
+        by_pk = {value.pop('pk'): value for value in values}
+        return {
+            pk: {name.removesuffix('_headline'): _render_highlight(headline) for name, headline in value.items()}
+            for pk, value in by_pk.items()
+        }
+
+
+class SimpleSearchBackend:
+    """icontains fallback for databases without full-text search."""
+
+    SEARCH_FIELDS = {
+        'courses': ('title', 'instructor_name', 'what_you_learn', 'description'),
+        'lessons': ('title',),
+        'resources': ('label',),
+    }
+
+    def _terms(self, text):
+        return [term for term in re.findall(r'\w+', text.lower()) if term]
+
+    def filter(self, section, queryset, text):
+        fields = self.SEARCH_FIELDS[section]
+        for term in self._terms(text):
+            term_filter = Q()
+            for field in fields:
+                term_filter |= Q(**{f'{field}__icontains': term})
+            queryset = queryset.filter(term_filter)
+        title_field = fields[0]
+        return queryset.annotate(rank=Case(
+            When(**{f'{title_field}__icontains': text.strip()}, then=Value(1.0)),
+            default=Value(0.5),
+            output_field=FloatField(),
+        ))
+
+    def highlight(self, section, rows, text):
+        _, fields = SECTION_MODELS[section]
+        pattern = '|'.join(re.escape(term) for term in self._terms(text))
+        highlights = {}
+        for row in rows:
+            highlights[row.pk] = {}
+            for field in fields:
+                value = getattr(row, field) or ''
+                if pattern:
+                    value = re.sub(f'({pattern})', f'{_START_SEL}\\1{_STOP_SEL}', value, flags=re.IGNORECASE)
+                highlights[row.pk][field] = _render_highlight(value)
+        return highlights
+
+
+def get_search_backend():
+    """Pick the backend for the default database."""
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return SimpleSearchBackend()
+
+
+def _course_result(course, highlights):
+    return {
+        'id': course.id,
+        'title': course.title,
+        'thumbnail_url': course.thumbnail_url,
+        'instructor_name': course.instructor_name,
+        'rank': course.rank,
+        'highlights': highlights,
+    }
+
+
+def _lesson_result(lesson, highlights):
+    return {
+        'id': lesson.id,
+        'course': lesson.course_id,
+        'course_title': lesson.course.title,
+        'title': lesson.title,
+        'order': lesson.order,
+        'rank': lesson.rank,
+        'highlights': highlights,
+    }
+
+
+def _resource_result(resource, highlights):
+    return {
+        'id': resource.id,
+        'course': resource.course_id,
+        'course_title': resource.course.title,
+        'label': resource.label,
+        'url': resource.url,
+        'rank': resource.rank,
+        'highlights': highlights,
+    }
+
+
+RESULT_BUILDERS = {
+    'courses': _course_result,
+    'lessons': _lesson_result,
+    'resources': _resource_result,
+}
+
+
+def _section_queryset(section, include_unpublished):
+    if section == 'courses':
+        queryset = Course.objects.only('id', 'title', 'description', 'thumbnail_url', 'instructor_name')
+        return queryset if include_unpublished else queryset.filter(is_published=True)
+
+    if section == 'lessons':
+        queryset = Lesson.objects.only('id', 'course', 'title', 'order', 'course__title')
+    else:
+        queryset = Resource.objects.only('id', 'course', 'label', 'url', 'course__title')
+    queryset = queryset.select_related('course')
+    return queryset if include_unpublished else queryset.filter(course__is_published=True)
+
+
+def search_section(section, text, page=1, page_size=SEARCH_PAGE_SIZE, include_unpublished=False, backend=None):
+    """Return one ranked, highlighted page of results for a section."""
+    backend = backend or get_search_backend()
+    queryset = backend.filter(section, _section_queryset(section, include_unpublished), text)
+    count = queryset.count()
+
+    offset = (page - 1) * page_size
+    rows = list(queryset.order_by('-rank', 'pk')[offset:offset + page_size])
+    highlights = backend.highlight(section, rows, text) if rows else {}
+
+    build = RESULT_BUILDERS[section]
+    return {
+        'count': count,
+        'next_page': page + 1 if offset + page_size < count else None,
+        'results': [build(row, highlights.get(row.pk, {})) for row in rows],
+    }
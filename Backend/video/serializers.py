@@ -1,7 +1,17 @@
 from rest_framework import serializers
 from urllib.parse import urlparse
-from .models import Video, Course, Lesson, Discussion, Resource, UserProgress, UserNotes, Rating, Enrollment, UserXP, DailyXP
-from api.avatar_utils import get_user_profile_image_url, get_default_profile_image_url
+from .models import (
+    Video, Course, Lesson, Discussion, Resource, UserProgress, UserCourseProgress,
+    UserNotes, Rating, Enrollment, UserXP, DailyXP
+)
+from api.avatar_utils import get_profile_image_url, get_default_profile_image_url
+from .pagination import encode_discussion_cursor
+from .position_buffer import overlay_buffered_progress
+
+
+# Course detail embeds only the newest discussions; the rest come from
+# DiscussionViewSet's cursor pagination starting at discussions_next_cursor.
+COURSE_DETAIL_DISCUSSION_LIMIT = 10
 
 
 # ========== DEPRECATED (Backward Compatibility) ==========
@@ -12,19 +22,149 @@ class VideoSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'url', 'added']
 
 
+def parse_field_tree(request):
+    """
+    Parse ``?fields=`` and ``?expand=`` into a field tree, or None when not given.
+
+    ``?fields=id,title,lessons.id,lessons.completed&expand=resources`` becomes
+    ``{'id': None, 'title': None, 'lessons': {'id': None, 'completed': None}, 'resources': None}``
+    where None means "the whole field". Without ``fields`` every field is returned,
+    so ``expand`` only adds full nested relations to an explicit field list.
+    """
+    raw_fields = request.query_params.get('fields', '')
+    if not raw_fields.strip():
+        return None
+
+    tree = {}
+
+    def add_path(node, parts):
+        head, rest = parts[0], parts[1:]
+        if not rest:
+            node[head] = None
+        elif node.get(head, {}) is not None:
+            add_path(node.setdefault(head, {}), rest)
+
+    for path in raw_fields.split(','):
+        parts = [part for part in path.strip().split('.') if part]
+        if parts:
+            add_path(tree, parts)
+
+    for name in request.query_params.get('expand', '').split(','):
+        if name.strip():
+            tree[name.strip()] = None
+
+    return tree
+
+
+def _prune_fields(serializer, tree):
+    for name in list(serializer.fields):
+        if name not in tree:
+            serializer.fields.pop(name)
+            continue
+        subtree = tree[name]
+        nested = getattr(serializer.fields[name], 'child', serializer.fields[name])
+        if subtree is not None and isinstance(nested, serializers.Serializer):
+            _prune_fields(nested, subtree)
+
+
+class DynamicFieldsMixin:
+    """
+    Restrict a serializer to a field tree (see parse_field_tree) via ``fields=``.
+
+    Fields outside the tree are removed before serialization, so their
+    SerializerMethodFields are never called. Declared nested serializers are pruned
+    recursively; method-built nested data can use get_nested_field_tree().
+    """
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.field_tree = fields
+        if fields is not None:
+            _prune_fields(self, fields)
+
+    def get_nested_field_tree(self, name):
+        if self.field_tree is None:
+            return None
+        return self.field_tree.get(name)
+
+
+def get_context_user(context):
+    """
+    Return the authenticated request user, or None.
+
+    Serializers rendered for the shared course cache pass ``shared_only`` so that
+    no per-user data ends up in a payload served to other users.
+    """
+    request = context.get('request')
+    if context.get('shared_only') or not request or not request.user.is_authenticated:
+        return None
+    return request.user
+
+
+def get_user_progress_map(context, course_id):
+    """
+    Load the request user's UserProgress rows for a course once, keyed by lesson_id.
+
+    The map is stored on the serializer context, which nested serializers share,
+    so every lesson and course-level field reads from a single query.
+    """
+    user = get_context_user(context)
+    if user is None:
+        return {}
+
+    progress_maps = context.setdefault('user_progress_by_course', {})
+    if course_id not in progress_maps:
+        # Positions still in the write-behind buffer are merged on top.
+        progress_maps[course_id] = {
+            progress.lesson_id: progress
+            for progress in overlay_buffered_progress(
+                user.id, UserProgress.objects.filter(user=user, course_id=course_id).select_related('lesson')
+            )
+        }
+    return progress_maps[course_id]
+
+
+def get_course_progress_map(context):
+    """
+    Load the request user's materialized UserCourseProgress rows once, keyed by course_id.
+    Serializers rendering many courses (enrollments) read one row per course from it.
+    """
+    user = get_context_user(context)
+    if user is None:
+        return {}
+
+    if 'course_progress_by_course' not in context:
+        context['course_progress_by_course'] = {
+            row.course_id: row for row in UserCourseProgress.objects.filter(user=user)
+        }
+    return context['course_progress_by_course']
+
+
+def get_user_course_rating(context, course_id):
+    """Load the request user's Rating for a course once per serializer context."""
+    user = get_context_user(context)
+    if user is None:
+        return None
+
+    ratings = context.setdefault('user_rating_by_course', {})
+    if course_id not in ratings:
+        ratings[course_id] = Rating.objects.filter(user=user, course_id=course_id).first()
+    return ratings[course_id]
+
+
 # ========== LESSON SERIALIZERS ==========
-class LessonSerializer(serializers.ModelSerializer):
+class LessonSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Full lesson details"""
     stream_url = serializers.SerializerMethodField()
+    playback_url = serializers.SerializerMethodField()
 
     class Meta:
         model = Lesson
         fields = [
-            'id', 'course', 'title', 'duration', 'time_xp',
-            'video_url', 'stream_url', 'thumbnail_url', 'order',
+            'id', 'course', 'title', 'duration', 'time_xp', 'duration_seconds', 'xp_value',
+            'video_url', 'stream_url', 'hls_manifest_url', 'playback_url', 'thumbnail_url', 'order',
             'created_at', 'updated_at'
         ]
-        read_only_fields = ['created_at', 'updated_at']
+        read_only_fields = ['duration_seconds', 'xp_value', 'hls_manifest_url', 'created_at', 'updated_at']
 
     def get_stream_url(self, obj):
         request = self.context.get('request')
@@ -37,28 +177,28 @@ class LessonSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(f'/api/video/lessons/{obj.id}/stream/')
         return None
 
+    def get_playback_url(self, obj):
+        """HLS manifest when the lesson has been packaged, else the stream proxy."""
+        return obj.hls_manifest_url or self.get_stream_url(obj)
+
 
-class LessonMinimalSerializer(serializers.ModelSerializer):
+class LessonMinimalSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Minimal lesson info for course detail view"""
     completed = serializers.SerializerMethodField()
     stream_url = serializers.SerializerMethodField()
+    playback_url = serializers.SerializerMethodField()
     last_position = serializers.SerializerMethodField()
     
     class Meta:
         model = Lesson
-        fields = ['id', 'title', 'duration', 'time_xp', 'video_url', 'stream_url', 'thumbnail_url', 'order', 'completed', 'last_position']
+        fields = [
+            'id', 'title', 'duration', 'time_xp', 'duration_seconds', 'xp_value', 'video_url', 'stream_url', 'hls_manifest_url', 'playback_url',
+            'thumbnail_url', 'order', 'completed', 'last_position'
+        ]
     
     def _get_progress(self, obj):
-        """Fetch user progress once per lesson, cached on the serializer instance."""
-        request = self.context.get('request')
-        if not request or not request.user.is_authenticated:
-            return None
-        # Use a per-object cache to avoid two identical queries for completed + last_position
-        cache_attr = f'_cached_progress_{obj.pk}'
-        if not hasattr(self, cache_attr):
-            setattr(self, cache_attr,
-                    UserProgress.objects.filter(user=request.user, lesson=obj).first())
-        return getattr(self, cache_attr)
+        """Look up user progress in the per-request map shared with the parent serializer."""
+        return get_user_progress_map(self.context, obj.course_id).get(obj.id)
 
     def get_completed(self, obj):
         """Check if current user completed this lesson"""
@@ -81,9 +221,13 @@ class LessonMinimalSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(f'/api/video/lessons/{obj.id}/stream/')
         return None
 
+    def get_playback_url(self, obj):
+        """HLS manifest when the lesson has been packaged, else the stream proxy."""
+        return obj.hls_manifest_url or self.get_stream_url(obj)
+
 
 # ========== DISCUSSION SERIALIZERS ==========
-class DiscussionSerializer(serializers.ModelSerializer):
+class DiscussionSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Discussion/comments for courses"""
     author_name = serializers.CharField(required=False, allow_blank=True)
     author_role = serializers.CharField(required=False, allow_blank=True)
@@ -99,17 +243,18 @@ class DiscussionSerializer(serializers.ModelSerializer):
         read_only_fields = ['user', 'created_at', 'updated_at', 'likes_count']
 
     def get_author_profile_image_url(self, obj):
+        # Querysets select_related('user__profile') so this does not query per row.
         request = self.context.get('request')
-        return get_user_profile_image_url(obj.user, request)
+        return get_profile_image_url(getattr(obj.user, 'profile', None), request)
 
     def get_is_liked(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
+        user = get_context_user(self.context)
+        if user is not None:
             prefetched = getattr(obj, '_prefetched_objects_cache', {})
             prefetched_liked_by = prefetched.get('liked_by')
             if prefetched_liked_by is not None:
-                return any(user.id == request.user.id for user in prefetched_liked_by)
-            return obj.liked_by.filter(id=request.user.id).exists()
+                return any(liker.id == user.id for liker in prefetched_liked_by)
+            return obj.liked_by.filter(id=user.id).exists()
         return False
     
     def create(self, validated_data):
@@ -124,7 +269,7 @@ class DiscussionSerializer(serializers.ModelSerializer):
 
 
 # ========== RESOURCE SERIALIZERS ==========
-class ResourceSerializer(serializers.ModelSerializer):
+class ResourceSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Course resources (Github, Code, etc.)"""
     class Meta:
         model = Resource
@@ -133,9 +278,10 @@ class ResourceSerializer(serializers.ModelSerializer):
 
 
 # ========== COURSE SERIALIZERS ==========
-class CourseListSerializer(serializers.ModelSerializer):
+class CourseListSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Lightweight serializer for course listing (LearningPage)"""
-    total_lessons = serializers.IntegerField(read_only=True)
+    total_lessons = serializers.SerializerMethodField()
+    total_duration_seconds = serializers.SerializerMethodField()
     progress_percentage = serializers.SerializerMethodField()
     instructor_avatar_url = serializers.SerializerMethodField()
     
@@ -144,23 +290,36 @@ class CourseListSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'title', 'description', 'thumbnail_url',
             'instructor_name', 'instructor_title', 'instructor_avatar_url',
-            'rating', 'total_duration', 'total_lessons',
+            'rating', 'total_duration', 'total_duration_seconds', 'total_lessons',
             'progress_percentage', 'is_published', 'created_at'
         ]
+
+    def get_total_lessons(self, obj):
+        """Prefer the count annotated by CourseViewSet.list over a per-course query"""
+        annotated = getattr(obj, 'lesson_total', None)
+        if annotated is not None:
+            return annotated
+        return obj.total_lessons
+
+    def get_total_duration_seconds(self, obj):
+        """Prefer the sum annotated by CourseViewSet.list over a per-course query"""
+        annotated = getattr(obj, 'lesson_seconds_total', None)
+        if annotated is not None:
+            return annotated
+        return obj.total_duration_seconds
     
     def get_progress_percentage(self, obj):
         """Calculate user's progress percentage for this course"""
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            total = obj.lessons.count()
+            total = self.get_total_lessons(obj)
             if total == 0:
                 return 0
-            completed = UserProgress.objects.filter(
-                user=request.user,
-                course=obj,
-                completed=True
-            ).count()
-            return int((completed / total) * 100)
+            completed = getattr(obj, 'user_completed_total', None)
+            if completed is None:
+                row = get_course_progress_map(self.context).get(obj.id)
+                completed = row.completed_lessons if row else 0
+            return int((min(completed, total) / total) * 100)
         return 0
 
     def get_instructor_avatar_url(self, obj):
@@ -170,16 +329,20 @@ class CourseListSerializer(serializers.ModelSerializer):
         return get_default_profile_image_url(request)
 
 
-class CourseDetailSerializer(serializers.ModelSerializer):
+class CourseDetailSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Full course details (CourseVideoPage) - includes lessons, discussions, resources"""
     lessons = LessonMinimalSerializer(many=True, read_only=True)
-    discussions = DiscussionSerializer(many=True, read_only=True)
+    discussions = serializers.SerializerMethodField()
+    discussions_next_cursor = serializers.SerializerMethodField()
+    total_discussions = serializers.SerializerMethodField()
     resources = ResourceSerializer(many=True, read_only=True)
     total_lessons = serializers.IntegerField(read_only=True)
+    total_duration_seconds = serializers.SerializerMethodField()
     progress_info = serializers.SerializerMethodField()
     average_rating = serializers.SerializerMethodField()
     user_rating = serializers.SerializerMethodField()
     total_ratings = serializers.SerializerMethodField()
+    rating_breakdown = serializers.DictField(child=serializers.IntegerField(), read_only=True)
     instructor_avatar_url = serializers.SerializerMethodField()
     certificate_unlocked = serializers.SerializerMethodField()
     
@@ -190,22 +353,55 @@ class CourseDetailSerializer(serializers.ModelSerializer):
             'instructor_name', 'instructor_title', 'instructor_bio',
             'instructor_avatar_url', 'instructor_social_links',
             'what_you_learn', 'prerequisites', 'rating', 'average_rating', 
-            'user_rating', 'total_ratings', 'total_duration',
-            'total_lessons', 'progress_info', 'certificate_unlocked',
-            'lessons', 'discussions', 'resources',
+            'user_rating', 'total_ratings', 'rating_breakdown', 'total_duration',
+            'total_duration_seconds', 'total_lessons', 'progress_info', 'certificate_unlocked',
+            'lessons', 'discussions', 'discussions_next_cursor', 'total_discussions', 'resources',
             'is_published', 'created_at', 'updated_at'
         ]
     
+    def _get_recent_discussions(self, obj):
+        """Newest discussions plus one extra row to know whether a next page exists"""
+        if not hasattr(obj, 'recent_discussions'):
+            obj.recent_discussions = list(
+                obj.discussions.select_related('user__profile').order_by(
+                    '-created_at', '-id'
+                )[:COURSE_DETAIL_DISCUSSION_LIMIT + 1]
+            )
+        return obj.recent_discussions
+    
+    def get_discussions(self, obj):
+        discussions = self._get_recent_discussions(obj)[:COURSE_DETAIL_DISCUSSION_LIMIT]
+        return DiscussionSerializer(
+            discussions,
+            many=True,
+            context=self.context,
+            fields=self.get_nested_field_tree('discussions'),
+        ).data
+    
+    def get_discussions_next_cursor(self, obj):
+        discussions = self._get_recent_discussions(obj)
+        if len(discussions) <= COURSE_DETAIL_DISCUSSION_LIMIT:
+            return None
+        return encode_discussion_cursor(discussions[COURSE_DETAIL_DISCUSSION_LIMIT - 1])
+    
+    def get_total_discussions(self, obj):
+        return obj.discussions.count()
+
+    def get_total_duration_seconds(self, obj):
+        """Sum the prefetched lessons when the detail payload already loaded them"""
+        if 'lessons' in getattr(obj, '_prefetched_objects_cache', {}):
+            return sum(lesson.duration_seconds for lesson in obj.lessons.all())
+        return obj.total_duration_seconds
+    
+    def _count_completed(self, obj):
+        progress_map = get_user_progress_map(self.context, obj.id)
+        return sum(1 for progress in progress_map.values() if progress.completed)
+
     def get_progress_info(self, obj):
         """Get progress like '4/12 completed'"""
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
+        if get_context_user(self.context) is not None:
             total = obj.lessons.count()
-            completed = UserProgress.objects.filter(
-                user=request.user,
-                course=obj,
-                completed=True
-            ).count()
+            completed = self._count_completed(obj)
             return {
                 'completed': completed,
                 'total': total,
@@ -214,22 +410,17 @@ class CourseDetailSerializer(serializers.ModelSerializer):
         return {'completed': 0, 'total': obj.lessons.count(), 'text': '0/0 completed'}
     
     def get_average_rating(self, obj):
-        """Calculate average rating from all user ratings"""
-        from django.db.models import Avg
-        avg = obj.ratings.aggregate(Avg('rating'))['rating__avg']
-        return round(avg, 1) if avg else 0.0
+        """Average rating from the aggregates stored on Course"""
+        return obj.average_rating
     
     def get_user_rating(self, obj):
         """Get current user's rating for this course"""
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            user_rating = obj.ratings.filter(user=request.user).first()
-            return user_rating.rating if user_rating else None
-        return None
+        user_rating = get_user_course_rating(self.context, obj.id)
+        return user_rating.rating if user_rating else None
     
     def get_total_ratings(self, obj):
         """Get total number of ratings"""
-        return obj.ratings.count()
+        return obj.rating_count
 
     def get_instructor_avatar_url(self, obj):
         if obj.instructor_avatar_url:
@@ -238,24 +429,17 @@ class CourseDetailSerializer(serializers.ModelSerializer):
         return get_default_profile_image_url(request)
 
     def get_certificate_unlocked(self, obj):
-        request = self.context.get('request')
-        if not request or not request.user.is_authenticated:
+        if get_context_user(self.context) is None:
             return False
 
         total_lessons = obj.lessons.count()
         if total_lessons == 0:
             return False
 
-        completed_lessons = UserProgress.objects.filter(
-            user=request.user,
-            course=obj,
-            completed=True
-        ).count()
-
-        return completed_lessons >= total_lessons
+        return self._count_completed(obj) >= total_lessons
 
 # ========== PROGRESS SERIALIZERS ==========
-class UserProgressSerializer(serializers.ModelSerializer):
+class UserProgressSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Track user lesson progress including watch percentage"""
     lesson_title = serializers.CharField(source='lesson.title', read_only=True)
     lesson_duration = serializers.CharField(source='lesson.duration', read_only=True)
@@ -273,6 +457,26 @@ class UserProgressSerializer(serializers.ModelSerializer):
         read_only_fields = ['user', 'created_at', 'updated_at', 'is_video_fully_watched']
 
 
+# Heartbeats the player may queue between flushes (30s or page hide, several tabs)
+PROGRESS_BATCH_MAX_EVENTS = 500
+
+
+class ProgressUpdateSerializer(serializers.Serializer):
+    """Body of the per-lesson update_progress / update_watch_percentage heartbeats"""
+    watch_percentage = serializers.IntegerField(min_value=0, max_value=100, required=False, default=0)
+    last_position = serializers.IntegerField(min_value=0, required=False, allow_null=True, default=0)
+    video_duration = serializers.IntegerField(min_value=0, required=False, default=0)
+
+
+class ProgressEventSerializer(serializers.Serializer):
+    """One queued player heartbeat for POST /api/video/progress/batch/"""
+    lesson = serializers.IntegerField(min_value=1)
+    watch_percentage = serializers.IntegerField(min_value=0, max_value=100, required=False, default=0)
+    last_position = serializers.IntegerField(min_value=0, required=False, allow_null=True, default=None)
+    video_duration = serializers.IntegerField(min_value=0, required=False, default=0)
+    client_ts = serializers.FloatField(required=False, allow_null=True, default=None, help_text="Client clock, ms since epoch")
+
+
 
 # ========== RATING SERIALIZERS ==========
 class RatingSerializer(serializers.ModelSerializer):
@@ -325,7 +529,7 @@ class UserXPSerializer(serializers.ModelSerializer):
 
 
 # ========== ENROLLMENT SERIALIZERS ==========
-class EnrollmentSerializer(serializers.ModelSerializer):
+class EnrollmentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """User course enrollments with progress tracking"""
     course_title = serializers.CharField(source='course.title', read_only=True)
     course_thumbnail = serializers.URLField(source='course.thumbnail_url', read_only=True)
@@ -334,7 +538,7 @@ class EnrollmentSerializer(serializers.ModelSerializer):
     instructor_title = serializers.CharField(source='course.instructor_title', read_only=True)
     total_duration = serializers.CharField(source='course.total_duration', read_only=True)
     rating = serializers.DecimalField(source='course.rating', max_digits=3, decimal_places=1, read_only=True)
-    total_lessons = serializers.IntegerField(source='course.total_lessons', read_only=True)
+    total_lessons = serializers.SerializerMethodField()
     progress_percentage = serializers.SerializerMethodField()
     completed_lessons = serializers.SerializerMethodField()
     
@@ -349,32 +553,23 @@ class EnrollmentSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['user', 'enrolled_at', 'last_accessed']
     
+    def _get_course_progress(self, obj):
+        return get_course_progress_map(self.context).get(obj.course_id)
+
+    def get_total_lessons(self, obj):
+        """Lesson count from the materialized progress row"""
+        row = self._get_course_progress(obj)
+        return row.total_lessons if row else obj.course.total_lessons
+
     def get_progress_percentage(self, obj):
-        """Calculate user's progress percentage for this course"""
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            total = obj.course.lessons.count()
-            if total == 0:
-                return 0
-            completed = UserProgress.objects.filter(
-                user=request.user,
-                course=obj.course,
-                completed=True
-            ).count()
-            return int((completed / total) * 100)
-        return 0
+        """User's progress percentage for this course"""
+        row = self._get_course_progress(obj)
+        return row.progress_percentage if row else 0
     
     def get_completed_lessons(self, obj):
         """Get count of completed lessons"""
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            completed = UserProgress.objects.filter(
-                user=request.user,
-                course=obj.course,
-                completed=True
-            ).count()
-            return completed
-        return 0
+        row = self._get_course_progress(obj)
+        return row.completed_lessons if row else 0
 
 
 # ========== DAILY XP SERIALIZER ==========
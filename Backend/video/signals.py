@@ -0,0 +1,124 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .blob import invalidate_blob_metadata
+from .course_cache import bump_course_version
+from .models import Course, Discussion, Lesson, Rating, Resource
+from .progress import refresh_course_totals
+
+
+def _bump_after_commit(course_id):
+    # Bump after commit so a concurrent reader cannot cache pre-commit data under the new version.
+    transaction.on_commit(lambda: bump_course_version(course_id))
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def invalidate_course_cache(sender, instance, **kwargs):
+    _bump_after_commit(instance.pk)
+
+
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Lesson)
+@receiver(post_save, sender=Resource)
+@receiver(post_delete, sender=Resource)
+@receiver(post_save, sender=Discussion)
+@receiver(post_delete, sender=Discussion)
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def invalidate_parent_course_cache(sender, instance, **kwargs):
+    _bump_after_commit(instance.course_id)
+
+
+@receiver(post_delete, sender=Lesson)
+@receiver(post_delete, sender=Resource)
+@receiver(post_delete, sender=Discussion)
+def touch_course_on_child_delete(sender, instance, **kwargs):
+    # A deleted child leaves no updated_at behind, so move the course's instead
+    # to keep conditional GET validators and workers without Redis honest.
+    Course.objects.filter(pk=instance.course_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Lesson)
+def refresh_course_progress_totals(sender, instance, created=True, **kwargs):
+    # Only adds and removes change totals; post_delete runs after the cascade
+    # has removed the lesson's UserProgress rows, so completions are recounted too.
+    if created:
+        refresh_course_totals(instance.course_id)
+
+
+@receiver(pre_save, sender=Lesson)
+def handle_lesson_video_change(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    previous = Lesson.objects.filter(pk=instance.pk).values('video_url', 'hls_manifest_url').first()
+    if previous is None or previous['video_url'] == instance.video_url:
+        return
+    # Drop cached size/ETag for both URLs so HEAD and If-None-Match never answer
+    # from the previous video.
+    for video_url in {previous['video_url'].strip(), (instance.video_url or '').strip()} - {''}:
+        transaction.on_commit(lambda video_url=video_url: invalidate_blob_metadata(video_url))
+    # The HLS rendition was packaged from the old video; keep it only if it was replaced too.
+    if instance.hls_manifest_url == previous['hls_manifest_url']:
+        instance.hls_manifest_url = ''
+
+
+@receiver(pre_save, sender=Rating)
+def remember_previous_rating(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        instance._previous_rating = None
+        return
+    previous = Rating.objects.filter(pk=instance.pk)
+    if transaction.get_connection().in_atomic_block:
+        # Lock so concurrent updates cannot both remove the same previous value.
+        previous = previous.select_for_update()
+    instance._previous_rating = previous.values_list('course_id', 'rating').first()
+
+
+@receiver(post_save, sender=Rating)
+def apply_rating_to_course(sender, instance, raw=False, **kwargs):
+    # Every write path (API, admin, shell) keeps the Course rating aggregates in step.
+    if raw:
+        return
+    previous = getattr(instance, '_previous_rating', None)
+    if previous is None:
+        Course.apply_rating_change(instance.course_id, added=instance.rating)
+    elif previous[0] == instance.course_id:
+        Course.apply_rating_change(instance.course_id, added=instance.rating, removed=previous[1])
+    else:
+        Course.apply_rating_change(previous[0], removed=previous[1])
+        Course.apply_rating_change(instance.course_id, added=instance.rating)
+    instance._previous_rating = (instance.course_id, instance.rating)
+
+
+@receiver(post_delete, sender=Rating)
+def remove_rating_from_course(sender, instance, **kwargs):
+    # Also runs for admin bulk deletes and user/course cascades.
+    Course.apply_rating_change(instance.course_id, removed=instance.rating)
+
+
+@receiver(m2m_changed, sender=Discussion.liked_by.through)
+def invalidate_course_cache_on_like(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # The cleared discussions are gone by post_clear; remember them for it.
+        instance._cleared_liked_ids = set(Discussion.objects.filter(liked_by=instance).values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        discussion_ids = {instance.pk}
+    elif action == 'post_clear':
+        discussion_ids = getattr(instance, '_cleared_liked_ids', set())
+    else:
+        discussion_ids = pk_set or set()
+    if not discussion_ids:
+        return
+    # Moving updated_at changes the course content stamp, which workers whose
+    # LocMem cache missed the version bump still see.
+    discussions = Discussion.objects.filter(pk__in=discussion_ids)
+    discussions.update(updated_at=timezone.now())
+    for course_id in discussions.values_list('course_id', flat=True).distinct():
+        _bump_after_commit(course_id)
@@ -0,0 +1,161 @@
+"""
+Admission control for the lesson stream proxy.
+
+Every proxied stream holds a worker thread (sync) or an upstream connection (async)
+for its whole playback. A stream must take a slot before any bytes flow, and it gives
+the slot back when the response is closed. Three caps apply:
+
+    VIDEO_STREAM_MAX_PER_PROCESS  streams open in this worker process (0 = unlimited);
+                                  defaults to GUNICORN_THREADS - 2
+    VIDEO_STREAM_MAX_PER_USER     streams per user, or per client IP when anonymous
+    VIDEO_STREAM_MAX_GLOBAL       streams across all workers; needs REDIS_URL (0 = off)
+
+Per-user and global counters live in Django's cache, so they span workers when Redis
+is configured (per process otherwise). They expire after VIDEO_STREAM_SLOT_TTL
+seconds, so slots leaked by a killed worker come back by themselves. Cache errors
+fail open: streams are never refused because Redis is unreachable.
+
+Over a cap the view answers 503 with Retry-After (VIDEO_STREAM_RETRY_AFTER).
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+STREAM_USER_KEY = 'video:streams:user:{key}'
+STREAM_GLOBAL_KEY = 'video:streams:global'
+
+_lock = threading.Lock()
+_process_active = 0
+_process_by_client = {}
+
+
+def _setting(name, default):
+    return int(getattr(settings, name, default))
+
+
+def _process_limit():
+    # Leave two of the worker's threads for API calls.
+    return _setting('VIDEO_STREAM_MAX_PER_PROCESS', max(_setting('GUNICORN_THREADS', 4) - 2, 1))
+
+
+def _client_key(request, user=None):
+    if user is None:
+        user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'u{user.pk}'
+    # nginx sets X-Real-IP; REMOTE_ADDR is the proxy itself in production.
+    return f"ip{request.META.get('HTTP_X_REAL_IP') or request.META.get('REMOTE_ADDR', '')}"
+
+
+def _cache_acquire(key, limit, ttl):
+    """Atomically take one of `limit` slots under `key`. Fails open on cache errors."""
+    try:
+        cache.add(key, 0, ttl)
+        if cache.incr(key) <= limit:
+            return True
+        cache.decr(key)
+        return False
+    except Exception:
+        # The counter expired between add() and incr(), or the cache is unreachable.
+        return True
+
+
+def _cache_release(key):
+    try:
+        if cache.decr(key) < 0:
+            cache.set(key, 0, _setting('VIDEO_STREAM_SLOT_TTL', 3600))
+    except Exception:
+        # Expired or unreachable: nothing left to give back.
+        pass
+
+
+class StreamSlot:
+    """One admitted stream. release() is idempotent and safe from any thread."""
+
+    def __init__(self, client_key, cache_keys):
+        self.client_key = client_key
+        self.cache_keys = cache_keys
+        self._released = False
+
+    def release(self):
+        global _process_active
+        with _lock:
+            if self._released:
+                return
+            self._released = True
+            _process_active -= 1
+            remaining = _process_by_client.get(self.client_key, 1) - 1
+            if remaining > 0:
+                _process_by_client[self.client_key] = remaining
+            else:
+                _process_by_client.pop(self.client_key, None)
+        for key in self.cache_keys:
+            _cache_release(key)
+
+    def attach(self, response):
+        """Hold the slot until `response` is closed; non-streaming responses free it now."""
+        if response.streaming:
+            # Closed by the server after the last byte or on client disconnect, even if
+            # iteration never started. streaming_content is left alone so a FileResponse
+            # keeps file_to_stream and can still go out through wsgi.file_wrapper.
+            response._resource_closers.append(self.release)
+        else:
+            self.release()
+        return response
+
+
+def acquire_stream_slot(request, user=None):
+    """
+    Admit a stream for `request`, or return None when a cap is reached. Async views
+    pass the already resolved `user` (request.user would hit the database).
+    """
+    global _process_active
+    client_key = _client_key(request, user)
+    process_limit = _process_limit()
+    with _lock:
+        if process_limit and _process_active >= process_limit:
+            return None
+        _process_active += 1
+        _process_by_client[client_key] = _process_by_client.get(client_key, 0) + 1
+    slot = StreamSlot(client_key, [])
+
+    ttl = _setting('VIDEO_STREAM_SLOT_TTL', 3600)
+    user_limit = _setting('VIDEO_STREAM_MAX_PER_USER', 3)
+    user_key = STREAM_USER_KEY.format(key=client_key)
+    if user_limit:
+        if not _cache_acquire(user_key, user_limit, ttl):
+            slot.release()
+            return None
+        slot.cache_keys.append(user_key)
+
+    global_limit = _setting('VIDEO_STREAM_MAX_GLOBAL', 0)
+    if global_limit and getattr(settings, 'REDIS_URL', ''):
+        if not _cache_acquire(STREAM_GLOBAL_KEY, global_limit, ttl):
+            slot.release()
+            return None
+        slot.cache_keys.append(STREAM_GLOBAL_KEY)
+    return slot
+
+
+def retry_after_seconds():
+    return _setting('VIDEO_STREAM_RETRY_AFTER', 5)
+
+
+def get_stream_gauges():
+    """Active stream counts: this process, and the shared global counter when enabled."""
+    with _lock:
+        gauges = {
+            'process_active': _process_active,
+            'process_limit': _process_limit(),
+            'process_clients': len(_process_by_client),
+            'per_user_limit': _setting('VIDEO_STREAM_MAX_PER_USER', 3),
+        }
+    if _setting('VIDEO_STREAM_MAX_GLOBAL', 0) and getattr(settings, 'REDIS_URL', ''):
+        try:
+            gauges['global_active'] = cache.get(STREAM_GLOBAL_KEY, 0)
+        except Exception:
+            gauges['global_active'] = None
+        gauges['global_limit'] = _setting('VIDEO_STREAM_MAX_GLOBAL', 0)
+    return gauges
@@ -0,0 +1,122 @@
+"""
+Telemetry for proxied lesson streams.
+
+Each stream served by the proxy (sync or async) is measured: upstream connect time,
+time to the first upstream body byte, bytes sent, total duration and whether the
+client went away early. Measurements are buffered in memory per process and written
+to StreamMetric with one bulk insert per VIDEO_STREAM_METRICS_BATCH rows, or when
+the oldest buffered row is VIDEO_STREAM_METRICS_FLUSH_SECONDS old. Telemetry is best
+effort: a failed insert drops the batch rather than breaking a stream.
+
+Chunk-cache hits and redirects never reach Azure through us and are not recorded.
+``python manage.py stream_report`` prints p50/p95 per lesson.
+"""
+import atexit
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+from .models import StreamMetric
+
+
+RANGE_START_RE = re.compile(r'^bytes=(\d+)-')
+
+_lock = threading.Lock()
+_buffer = []
+_buffer_started = None
+
+
+def _milliseconds(seconds):
+    return max(int(seconds * 1000), 0)
+
+
+def parse_range_start(range_value):
+    """First requested byte: 0 without a Range header, None for suffix ranges."""
+    if not range_value:
+        return 0
+    match = RANGE_START_RE.match(range_value)
+    return int(match.group(1)) if match else None
+
+
+class StreamMeasurement:
+    """Timings of one proxied stream; finish() buffers it once (if telemetry is enabled)."""
+
+    def __init__(self, lesson_id, range_value):
+        self.lesson_id = lesson_id
+        self.range_start = parse_range_start(range_value)
+        self.created_at = timezone.now()
+        self.started = time.monotonic()
+        self.status_code = None
+        self.connect_ms = None
+        self.ttfb_ms = None
+        self.bytes_sent = 0
+        self._finished = False
+
+    def upstream_response(self, status_code, connect_seconds):
+        self.status_code = status_code
+        if connect_seconds is not None:
+            self.connect_ms = _milliseconds(connect_seconds)
+
+    def sent(self, size):
+        if self.ttfb_ms is None:
+            self.ttfb_ms = _milliseconds(time.monotonic() - self.started)
+        self.bytes_sent += size
+
+    def finish(self, aborted):
+        if self._finished or not getattr(settings, 'VIDEO_STREAM_METRICS', True):
+            return
+        self._finished = True
+        record_stream_metric(StreamMetric(
+            lesson_id=self.lesson_id,
+            range_start=self.range_start,
+            status_code=self.status_code,
+            connect_ms=self.connect_ms,
+            ttfb_ms=self.ttfb_ms,
+            duration_ms=_milliseconds(time.monotonic() - self.started),
+            bytes_sent=self.bytes_sent,
+            aborted=aborted,
+            created_at=self.created_at,
+        ))
+
+
+def record_stream_metric(metric):
+    global _buffer_started
+    with _lock:
+        _buffer.append(metric)
+        if _buffer_started is None:
+            _buffer_started = time.monotonic()
+        due = (
+            len(_buffer) >= int(getattr(settings, 'VIDEO_STREAM_METRICS_BATCH', 100))
+            or time.monotonic() - _buffer_started >= float(getattr(settings, 'VIDEO_STREAM_METRICS_FLUSH_SECONDS', 30))
+        )
+    if due:
+        flush_stream_metrics()
+
+
+def flush_stream_metrics():
+    """Write buffered measurements in one bulk insert; returns how many were written."""
+    global _buffer, _buffer_started
+    with _lock:
+        batch, _buffer, _buffer_started = _buffer, [], None
+    if not batch:
+        return 0
+    try:
+        StreamMetric.objects.bulk_create(batch, batch_size=500)
+    except DatabaseError:
+        # e.g. a lesson deleted since; telemetry must never break a stream.
+        return 0
+    return len(batch)
+
+
+def _flush_at_exit():
+    try:
+        flush_stream_metrics()
+    except Exception:
+        pass
+
+
+atexit.register(_flush_at_exit)
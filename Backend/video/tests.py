@@ -1,3 +1,1268 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import date
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import requests
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.http import FileResponse
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import (
+    Course, DailyXP, Discussion, Enrollment, Lesson, Rating, StreamMetric, UserCourseProgress, UserNotes,
+    UserProgress, UserXP, XPEvent,
+)
+from .async_stream import STREAM_CHUNK_SIZE, stream_lesson
+from .blob import get_blob_metadata
+from .certificates import build_certificate_data, render_certificate_pdf, store_certificate
+from .chunk_cache import get_chunk_cache
+from .course_cache import COURSE_VERSION_KEY, bump_course_version
+from .lesson_metadata import parse_duration_seconds, parse_xp_value
+from .management.commands.package_lesson_hls import DEFAULT_LADDER, Command as PackageLessonHlsCommand
+from .position_buffer import buffer_progress, flush_buffered_progress
+from .progress import rebuild_course_progress, upsert_progress
+from .stream_limits import acquire_stream_slot, get_stream_gauges
+from .upstream import get_upstream_pool_stats, get_upstream_session
+from .views import RatingViewSet
+from .xp import award_lesson_xp, rebuild_xp_totals, seed_legacy_adjustments
+from .serializers import COURSE_DETAIL_DISCUSSION_LIMIT, RatingSerializer
+from .stream_metrics import flush_stream_metrics
+
+
+class VideoAPITestCase(APITestCase):
+    """Start every test from an empty cache so course payloads never leak between tests."""
+
+    def setUp(self):
+        cache.clear()
+        # Buffered heartbeats must not outlive the test's transaction.
+        self.addCleanup(flush_buffered_progress)
+        self.user = User.objects.create_user(username='learner', password='pass12345')
+        self.client.force_authenticate(self.user)
+
+
+class CourseListQueryCountTests(VideoAPITestCase):
+    """The course list must not issue per-course queries for lesson/progress counts."""
+
+    def _create_courses(self, count, start=0):
+        courses = Course.objects.bulk_create([
+            Course(title=f'Course {index}', is_published=True)
+            for index in range(start, start + count)
+        ])
+        lessons = Lesson.objects.bulk_create([
+            Lesson(course=course, title=f'Lesson {order}', order=order, video_url='https://example.com/v.mp4')
+            for course in courses
+            for order in (1, 2)
+        ])
+        UserProgress.objects.bulk_create([
+            UserProgress(user=self.user, course_id=lesson.course_id, lesson=lesson, completed=True)
+            for lesson in lessons
+            if lesson.order == 1
+        ])
+        rebuild_course_progress()  # bulk_create bypasses the materialized progress updates
+
+    def _list_courses(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('course-list'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.data
+
+    def test_list_reports_annotated_progress(self):
+        self._create_courses(1)
+        _, data = self._list_courses()
+
+        self.assertEqual(data[0]['total_lessons'], 2)
+        self.assertEqual(data[0]['progress_percentage'], 50)
+
+    def test_list_query_count_is_constant(self):
+        self._create_courses(5)
+        small_count, data = self._list_courses()
+        self.assertEqual(len(data), 5)
+
+        self._create_courses(495, start=5)
+        large_count, data = self._list_courses()
+        self.assertEqual(len(data), 500)
+
+        self.assertEqual(small_count, large_count)
+
+
+class CourseDetailProgressMapTests(VideoAPITestCase):
+    """Lesson progress on course detail is loaded from one per-request map."""
+
+    def setUp(self):
+        super().setUp()
+        self.course = Course.objects.create(title='Course', is_published=True)
+
+    def _add_lessons(self, count, start=0):
+        lessons = Lesson.objects.bulk_create([
+            Lesson(course=self.course, title=f'Lesson {order}', order=order, video_url='https://example.com/v.mp4')
+            for order in range(start, start + count)
+        ])
+        UserProgress.objects.bulk_create([
+            UserProgress(user=self.user, course=self.course, lesson=lesson, completed=True, last_position=30)
+            for lesson in lessons
+        ])
+
+    def _retrieve(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('course-detail', args=[self.course.id]))
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.data
+
+    def test_detail_query_count_does_not_grow_with_lessons(self):
+        self._add_lessons(3)
+        small_count, data = self._retrieve()
+        self.assertEqual(data['progress_info']['completed'], 3)
+        self.assertTrue(data['certificate_unlocked'])
+
+        self._add_lessons(60, start=3)
+        cache.clear()  # bulk_create skips the signals that bump the course cache version
+        large_count, data = self._retrieve()
+        self.assertEqual(data['progress_info']['text'], '63/63 completed')
+        self.assertTrue(all(lesson['completed'] and lesson['last_position'] == 30 for lesson in data['lessons']))
+
+        self.assertEqual(small_count, large_count)
+
+
+class RatingAggregateTests(VideoAPITestCase):
+    """Rating writes keep the denormalized aggregates on Course in sync."""
+
+    def setUp(self):
+        super().setUp()
+        self.course = Course.objects.create(title='Course', is_published=True)
+
+    def test_create_update_and_delete_adjust_aggregates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('rating-list'), {'course': self.course.id, 'rating': 4})
+            self.client.post(reverse('rating-list'), {'course': self.course.id, 'rating': 2})
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.rating_sum, self.course.rating_count), (2, 1))
+        self.assertEqual(self.course.rating_breakdown, {'1': 0, '2': 1, '3': 0, '4': 0, '5': 0})
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('course-detail', args=[self.course.id]))
+        self.assertEqual((response.data['average_rating'], response.data['total_ratings']), (2.0, 1))
+        rating_table = Rating._meta.db_table
+        self.assertFalse(any(
+            rating_table in query['sql'] and 'AVG' in query['sql'].upper() for query in queries.captured_queries
+        ))
+
+        rating = Rating.objects.get(user=self.user, course=self.course)
+        self.client.delete(reverse('rating-detail', args=[rating.id]))
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.rating_sum, self.course.rating_count, self.course.rating_2_count), (0, 0, 0))
+
+    def test_update_removes_the_stored_value_not_a_stale_one(self):
+        self.client.post(reverse('rating-list'), {'course': self.course.id, 'rating': 4})
+        stale = Rating.objects.get(user=self.user, course=self.course)
+        self.client.post(reverse('rating-list'), {'course': self.course.id, 'rating': 2})
+
+        serializer = RatingSerializer(stale, data={'rating': 5}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        RatingViewSet().perform_update(serializer)
+        RatingViewSet().perform_destroy(stale)
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.rating_sum, self.course.rating_count), (0, 0))
+        self.assertEqual(self.course.rating_breakdown, {'1': 0, '2': 0, '3': 0, '4': 0, '5': 0})
+        RatingViewSet().perform_destroy(stale)
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.rating_count, 0)
+
+    def test_admin_and_cascade_deletes_adjust_aggregates(self):
+        self.client.post(reverse('rating-list'), {'course': self.course.id, 'rating': 4})
+        other = User.objects.create_user(username='other', password='pass12345')
+        Rating.objects.create(user=other, course=self.course, rating=2)
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.rating_sum, self.course.rating_count), (6, 2))
+
+        self.client.force_login(User.objects.create_superuser(username='admin', password='pass12345'))
+        rating = Rating.objects.get(user=self.user)
+        response = self.client.post(reverse('admin:video_rating_delete', args=[rating.id]), {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.rating_sum, self.course.rating_count, self.course.rating_4_count), (2, 1, 0))
+
+        other.delete()
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.rating_sum, self.course.rating_count, self.course.rating_2_count), (0, 0, 0))
+
+
+class CourseDetailCacheTests(VideoAPITestCase):
+    """Course detail is shared across users and invalidated by child writes."""
+
+    def setUp(self):
+        super().setUp()
+        self.course = Course.objects.create(title='Course', is_published=True)
+        self.lesson = Lesson.objects.create(
+            course=self.course, title='Intro', order=1, video_url='https://example.com/v.mp4'
+        )
+
+    def _retrieve(self):
+        return self.client.get(reverse('course-detail', args=[self.course.id])).data
+
+    def test_user_fields_are_overlaid_on_shared_payload(self):
+        UserProgress.objects.create(user=self.user, course=self.course, lesson=self.lesson, completed=True)
+        self.assertTrue(self._retrieve()['lessons'][0]['completed'])
+
+        other = User.objects.create_user(username='other', password='pass12345')
+        self.client.force_authenticate(other)
+        data = self._retrieve()
+        self.assertFalse(data['lessons'][0]['completed'])
+        self.assertFalse(data['certificate_unlocked'])
+
+    def test_lesson_write_bumps_course_version(self):
+        self._retrieve()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lesson.title = 'Renamed'
+            self.lesson.save()
+        self.assertEqual(self._retrieve()['lessons'][0]['title'], 'Renamed')
+
+    def test_process_local_cache_renders_per_request(self):
+        self._retrieve()
+        # Another worker's write: its version bump never reaches this process's LocMem,
+        # but the updated_at it moved changes the content stamp in the key.
+        Lesson.objects.filter(pk=self.lesson.pk).update(title='Renamed', updated_at=timezone.now())
+        self.assertEqual(self._retrieve()['lessons'][0]['title'], 'Renamed')
+
+    def test_reverse_like_clear_touches_discussion(self):
+        discussion = Discussion.objects.create(course=self.course, user=self.user, comment='Hi')
+        discussion.liked_by.add(self.user)
+        before = Discussion.objects.get(pk=discussion.pk).updated_at
+        self.user.liked_course_discussions.clear()
+        self.assertGreater(Discussion.objects.get(pk=discussion.pk).updated_at, before)
+
+    def test_shared_cache_serves_payload_until_version_moves(self):
+        self._retrieve()
+        Lesson.objects.filter(pk=self.lesson.pk).update(title='Renamed')
+        self.assertEqual(self._retrieve()['lessons'][0]['title'], 'Intro')
+        bump_course_version(self.course.id)
+        self.assertEqual(self._retrieve()['lessons'][0]['title'], 'Renamed')
+
+
+class ConditionalGetTests(VideoAPITestCase):
+    """Course and lesson reads answer 304 from the validator without serializing."""
+
+    def setUp(self):
+        super().setUp()
+        self.course = Course.objects.create(title='Course', is_published=True)
+        self.lesson = Lesson.objects.create(
+            course=self.course, title='Intro', order=1, video_url='https://example.com/v.mp4'
+        )
+
+    def test_course_detail_returns_304_until_progress_changes(self):
+        url = reverse('course-detail', args=[self.course.id])
+        etag = self.client.get(url)['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries), 1)
+
+        UserProgress.objects.create(user=self.user, course=self.course, lesson=self.lesson, last_position=12)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['lessons'][0]['last_position'], 12)
+
+    def test_counter_updates_change_validator_without_version_bump(self):
+        url = reverse('course-detail', args=[self.course.id])
+        discussion = Discussion.objects.create(course=self.course, user=self.user, comment='Hi')
+        version_key = COURSE_VERSION_KEY.format(course_id=self.course.id)
+
+        for write in (
+            lambda: Course.apply_rating_change(self.course.id, added=5),
+            lambda: self.client.post(reverse('discussion-set-like', args=[discussion.id]), {'liked': True}, format='json'),
+        ):
+            response = self.client.get(url)
+            etag, version = response['ETag'], cache.get(version_key)
+            write()
+            # A worker that did not handle the write still holds the old version.
+            cache.set(version_key, version, None)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(response.data['total_ratings'], 1)
+        self.assertEqual(response.data['discussions'][0]['likes_count'], 1)
+
+    def test_if_modified_since_alone_never_answers_304(self):
+        url = reverse('course-detail', args=[self.course.id])
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        Course.apply_rating_change(self.course.id, added=5)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_ratings'], 1)
+
+    def test_lesson_list_for_course_returns_304(self):
+        url = reverse('lesson-list') + f'?course={self.course.id}'
+        response = self.client.get(url)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class DiscussionPaginationTests(VideoAPITestCase):
+    """Course detail embeds the newest discussions; the rest are keyset paginated."""
+
+    def setUp(self):
+        super().setUp()
+        self.course = Course.objects.create(title='Course', is_published=True)
+        Discussion.objects.bulk_create([
+            Discussion(course=self.course, user=self.user, author_name='learner', comment=f'Comment {index}')
+            for index in range(25)
+        ])
+
+    def test_detail_embeds_first_page_and_cursor_walks_the_rest(self):
+        detail = self.client.get(reverse('course-detail', args=[self.course.id])).data
+        self.assertEqual(len(detail['discussions']), COURSE_DETAIL_DISCUSSION_LIMIT)
+        self.assertEqual(detail['total_discussions'], 25)
+
+        seen = [discussion['id'] for discussion in detail['discussions']]
+        cursor = detail['discussions_next_cursor']
+        while cursor:
+            page = self.client.get(
+                reverse('discussion-list'), {'course': self.course.id, 'cursor': cursor, 'page_size': 7}
+            ).data
+            seen.extend(discussion['id'] for discussion in page['results'])
+            cursor = page['next_cursor']
+
+        expected = list(
+            Discussion.objects.filter(course=self.course).order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(seen, expected)
+
+
+class SparseFieldsetTests(VideoAPITestCase):
+    """?fields= and ?expand= trim the payload and skip the work behind dropped fields."""
+
+    def setUp(self):
+        super().setUp()
+        self.course = Course.objects.create(title='Course', is_published=True)
+        self.lesson = Lesson.objects.create(
+            course=self.course, title='Intro', order=1, video_url='https://example.com/v.mp4'
+        )
+        UserProgress.objects.create(user=self.user, course=self.course, lesson=self.lesson, completed=True)
+
+    def test_detail_returns_only_requested_nested_fields(self):
+        url = reverse('course-detail', args=[self.course.id])
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(url, {'fields': 'id,title,lessons.id,lessons.completed'}).data
+        self.assertEqual(set(data), {'id', 'title', 'lessons'})
+        self.assertEqual(data['lessons'], [{'id': self.lesson.id, 'completed': True}])
+        # user_rating was not requested, so its lookup never runs.
+        self.assertFalse(any(Rating._meta.db_table in query['sql'] for query in queries.captured_queries))
+
+        data = self.client.get(url, {'fields': 'id', 'expand': 'resources'}).data
+        self.assertEqual(set(data), {'id', 'resources'})
+
+    def test_list_skips_count_annotations_when_not_requested(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(reverse('course-list'), {'fields': 'id,title'}).data
+        self.assertEqual(data, [{'id': self.course.id, 'title': 'Course'}])
+        self.assertFalse(any(Lesson._meta.db_table in query['sql'] for query in queries.captured_queries))
+
+
+class SearchTests(VideoAPITestCase):
+    """Search ranks and highlights published matches (SQLite runs the fallback backend)."""
+
+    def setUp(self):
+        super().setUp()
+        self.course = Course.objects.create(title='React Basics', description='Learn <b>hooks</b>', is_published=True)
+        Course.objects.create(title='React Internals', is_published=False)
+        Lesson.objects.create(course=self.course, title='React hooks', order=1, video_url='https://example.com/v.mp4')
+
+    def test_search_returns_ranked_highlighted_sections(self):
+        data = self.client.get(reverse('search'), {'q': 'react'}).data['results']
+
+        self.assertEqual(data['courses']['count'], 1)
+        course = data['courses']['results'][0]
+        self.assertEqual(course['highlights']['title'], '<mark>React</mark> Basics')
+        self.assertEqual(course['highlights']['description'], 'Learn &lt;b&gt;hooks&lt;/b&gt;')
+        self.assertEqual(data['lessons']['results'][0]['course_title'], 'React Basics')
+        self.assertEqual(data['resources']['count'], 0)
+
+    def test_search_paginates_one_section(self):
+        for order in range(2, 6):
+            Lesson.objects.create(course=self.course, title=f'React part {order}', order=order, video_url='https://example.com/v.mp4')
+        data = self.client.get(reverse('search'), {'q': 'react', 'type': 'lessons', 'page_size': 3}).data['results']
+        self.assertEqual(list(data), ['lessons'])
+        self.assertEqual((data['lessons']['count'], len(data['lessons']['results'])), (5, 3))
+        self.assertEqual(data['lessons']['next_page'], 2)
+
+        self.assertEqual(self.client.get(reverse('search')).status_code, 400)
+
+
+class CourseBundleTests(VideoAPITestCase):
+    """The course page bundle returns every section from a fixed number of queries."""
+
+    def setUp(self):
+        super().setUp()
+        self.course = Course.objects.create(title='Course', is_published=True)
+        self.lessons = [
+            Lesson.objects.create(course=self.course, title=f'Lesson {order}', order=order, video_url='https://example.com/v.mp4')
+            for order in (1, 2)
+        ]
+        UserProgress.objects.create(user=self.user, course=self.course, lesson=self.lessons[0], completed=True)
+        UserNotes.objects.create(user=self.user, course=self.course, notes_text='notes')
+        Rating.objects.create(user=self.user, course=self.course, rating=4)
+        Enrollment.objects.create(user=self.user, course=self.course)
+
+    def _bundle(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('course-bundle', args=[self.course.id]))
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.data
+
+    def test_bundle_sections_and_query_count(self):
+        self._bundle()  # warm the shared course payload
+        query_count, data = self._bundle()
+
+        self.assertEqual(data['course']['user_rating'], 4)
+        self.assertEqual(data['rating']['rating'], 4)
+        self.assertEqual(data['notes'][0]['notes_text'], 'notes')
+        self.assertEqual(data['progress']['progress_percentage'], 50)
+        self.assertEqual(data['enrollment']['completed_lessons'], 1)
+        self.assertTrue(data['is_enrolled'])
+        # course, content stamp, progress rows, rating, notes, enrollment
+        self.assertEqual(query_count, 6)
+
+
+class UserCourseProgressTests(VideoAPITestCase):
+    """The materialized course progress row follows completions and lesson changes."""
+
+    def setUp(self):
+        super().setUp()
+        self.course = Course.objects.create(title='Course', is_published=True)
+        self.lessons = [
+            Lesson.objects.create(course=self.course, title=f'Lesson {order}', order=order, video_url='https://example.com/v.mp4')
+            for order in (1, 2)
+        ]
+
+    def _row(self):
+        return UserCourseProgress.objects.get(user=self.user, course=self.course)
+
+    def _complete(self, lesson):
+        UserProgress.objects.update_or_create(
+            user=self.user, course=self.course, lesson=lesson, defaults={'watch_percentage': 100}
+        )
+        return self.client.post(reverse('lesson-mark-complete', args=[lesson.id]))
+
+    def test_completion_and_lesson_changes_update_row(self):
+        self._complete(self.lessons[0])
+        self._complete(self.lessons[0])  # repeat completions are counted once
+        row = self._row()
+        self.assertEqual((row.completed_lessons, row.total_lessons, row.last_lesson_id), (1, 2, self.lessons[0].id))
+
+        Lesson.objects.create(course=self.course, title='Lesson 3', order=3, video_url='https://example.com/v.mp4')
+        self.assertEqual(self._row().total_lessons, 3)
+
+        self.lessons[0].delete()
+        self.assertEqual((self._row().completed_lessons, self._row().total_lessons), (0, 2))
+
+    def test_read_paths_use_materialized_row(self):
+        self._complete(self.lessons[0])
+        Enrollment.objects.create(user=self.user, course=self.course)
+
+        enrollment = self.client.get(reverse('enrollment-list')).data[0]
+        self.assertEqual((enrollment['completed_lessons'], enrollment['progress_percentage']), (1, 50))
+        progress = self.client.get(reverse('course-progress', args=[self.course.id])).data
+        self.assertEqual(progress['completed_lessons'], 1)
+        self.assertEqual(self.client.get(reverse('user-stats')).data['progress'], 50)
+
+        rebuild_course_progress()
+        self.assertEqual(self._row().completed_lessons, 1)
+
+
+class ProgressBatchTests(VideoAPITestCase):
+    """Queued heartbeats are collapsed per lesson and written in one upsert."""
+
+    def setUp(self):
+        super().setUp()
+        self.course = Course.objects.create(title='Course', is_published=True)
+        self.lessons = [
+            Lesson.objects.create(course=self.course, title=f'Lesson {order}', order=order, video_url='https://example.com/v.mp4')
+            for order in (1, 2)
+        ]
+        UserProgress.objects.create(
+            user=self.user, course=self.course, lesson=self.lessons[0], watch_percentage=80, last_position=30
+        )
+
+    def test_events_are_collapsed_and_upserted(self):
+        first, second = self.lessons
+        events = [
+            {'lesson': first.id, 'watch_percentage': 60, 'last_position': 120, 'client_ts': 3000},
+            {'lesson': first.id, 'watch_percentage': 85, 'last_position': 90, 'client_ts': 1000},
+            {'lesson': second.id, 'watch_percentage': 10, 'last_position': 15, 'video_duration': 300, 'client_ts': 2000},
+            {'lesson': 999999, 'watch_percentage': 50},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('user-progress-batch'), events, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['unknown_lessons'], [999999])
+        self.assertEqual(
+            [(row['lesson'], row['watch_percentage'], row['last_position']) for row in response.data['progress']],
+            [(first.id, 85, 120), (second.id, 10, 15)],
+        )
+        writes = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('INSERT')]
+        self.assertEqual(len(writes), 1)
+
+        rows = {row.lesson_id: row for row in UserProgress.objects.filter(user=self.user)}
+        self.assertEqual((rows[first.id].watch_percentage, rows[first.id].last_position), (85, 120))
+        self.assertEqual((rows[second.id].watch_percentage, rows[second.id].video_duration_seconds), (10, 300))
+
+    def test_invalid_batches_are_rejected(self):
+        url = reverse('user-progress-batch')
+        self.assertEqual(self.client.post(url, {'lesson': 1}, format='json').status_code, 400)
+        self.assertEqual(self.client.post(url, [{'lesson': self.lessons[0].id, 'watch_percentage': 120}], format='json').status_code, 400)
+        self.assertEqual(UserProgress.objects.get(lesson=self.lessons[0]).watch_percentage, 80)
+
+
+class ProgressUpsertTests(VideoAPITestCase):
+    """Progress writes are one INSERT ... ON CONFLICT statement that never lowers watch_percentage."""
+
+    def setUp(self):
+        super().setUp()
+        self.course = Course.objects.create(title='Course', is_published=True)
+        self.lesson = Lesson.objects.create(
+            course=self.course, title='Intro', order=1, video_url='https://example.com/v.mp4'
+        )
+
+    def _check_upserts(self):
+        created = upsert_progress(self.user.id, self.course.id, self.lesson.id, watch_percentage=60, video_duration_seconds=300)
+        self.assertEqual((created.watch_percentage, created.video_duration_seconds, created.last_position), (60, 300, 0))
+        self.assertIsNotNone(created.created_at.tzinfo)
+
+        updated = upsert_progress(
+            self.user.id, self.course.id, self.lesson.id, watch_percentage=20, last_position=45, video_duration_seconds=0
+        )
+        self.assertEqual(updated.pk, created.pk)
+        self.assertEqual((updated.watch_percentage, updated.video_duration_seconds, updated.last_position), (60, 300, 45))
+        self.assertEqual(upsert_progress(self.user.id, self.course.id, self.lesson.id).last_position, 45)
+        self.assertEqual(UserProgress.objects.count(), 1)
+
+    def test_native_upsert(self):
+        with CaptureQueriesContext(connection) as queries:
+            upsert_progress(self.user.id, self.course.id, self.lesson.id, last_position=10)
+        self.assertEqual(len(queries), 1)
+        UserProgress.objects.all().delete()
+        self._check_upserts()
+
+    def test_fallback_without_on_conflict(self):
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False):
+            self._check_upserts()
+
+    def test_first_position_heartbeat_is_one_write(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('lesson-update-progress', args=[self.lesson.id]), {'last_position': 30}, format='json'
+            )
+        self.assertEqual(response.data['last_position'], 30)
+        writes = [query['sql'] for query in queries.captured_queries if query['sql'].startswith(('INSERT', 'UPDATE'))]
+        self.assertEqual(len(writes), 1)
+
+    def test_malformed_heartbeats_are_rejected(self):
+        for name, data in [
+            ('lesson-update-progress', {'last_position': 'abc'}),
+            ('lesson-update-progress', {'last_position': -5}),
+            ('lesson-update-watch-percentage', {'watch_percentage': 50, 'last_position': 'abc'}),
+            ('lesson-update-watch-percentage', {'watch_percentage': 50, 'video_duration': 'long'}),
+            ('lesson-update-watch-percentage', {'watch_percentage': 150}),
+        ]:
+            response = self.client.post(reverse(name, args=[self.lesson.id]), data, format='json')
+            self.assertEqual(response.status_code, 400, (name, data))
+        response = self.client.post(reverse('user-progress-batch'), [{'lesson': self.lesson.id, 'last_position': 'x'}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(UserProgress.objects.exists())
+
+
+class PositionBufferTests(VideoAPITestCase):
+    """Heartbeats are buffered and flushed later; reads and ETags see them at once."""
+
+    def setUp(self):
+        super().setUp()
+        self.course = Course.objects.create(title='Course', is_published=True)
+        self.lesson = Lesson.objects.create(
+            course=self.course, title='Intro', order=1, video_url='https://example.com/v.mp4'
+        )
+        self.url = reverse('lesson-update-watch-percentage', args=[self.lesson.id])
+
+    def _heartbeat(self, percentage, position):
+        return self.client.post(self.url, {'watch_percentage': percentage, 'last_position': position}, format='json')
+
+    def _stored(self):
+        return UserProgress.objects.values_list('watch_percentage', 'last_position').get(lesson=self.lesson)
+
+    def test_positions_are_buffered_until_flushed(self):
+        self._heartbeat(5, 10)  # first heartbeat creates the row
+        self.assertEqual(self._stored(), (5, 10))
+        course_url = reverse('course-detail', args=[self.course.id])
+        etag = self.client.get(course_url)['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self._heartbeat(40, 300).data['last_position'], 300)
+        self.assertFalse(any(query['sql'].startswith('UPDATE') for query in queries.captured_queries))
+        self.assertEqual(self._stored(), (5, 10))
+
+        detail = self.client.get(course_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(detail.status_code, 200)
+        self.assertEqual(detail.data['lessons'][0]['last_position'], 300)
+        listed = self.client.get(reverse('user-progress-list')).data[0]
+        self.assertEqual((listed['watch_percentage'], listed['last_position']), (40, 300))
+
+        self.assertEqual(flush_buffered_progress(), 1)
+        self.assertEqual(self._stored(), (40, 300))
+
+    def test_reaching_completion_threshold_is_written_through(self):
+        self._heartbeat(5, 10)
+        self._heartbeat(50, 200)
+        self._heartbeat(92, 400)
+        self.assertEqual(self._stored(), (92, 400))
+        self.assertEqual(flush_buffered_progress(), 0)
+        response = self.client.post(reverse('lesson-mark-complete', args=[self.lesson.id]))
+        self.assertTrue(response.data['completed'])
+
+    def test_stale_entries_do_not_drop_valid_ones(self):
+        self._heartbeat(5, 10)
+        self._heartbeat(40, 300)
+        gone_lesson = Lesson.objects.create(course=self.course, title='Gone', order=2)
+        gone_user = User.objects.create_user(username='gone', password='pass12345')
+        buffer_progress(self.user.id, self.course.id, gone_lesson.id, 50)
+        buffer_progress(gone_user.id, self.course.id, self.lesson.id, 60)
+        gone_lesson.delete()
+        gone_user.delete()
+
+        with mock.patch('video.position_buffer.upsert_progress_entries', side_effect=IntegrityError):
+            self.assertEqual(flush_buffered_progress(), 0)
+        self.assertEqual(self._stored(), (5, 10))
+        self.assertEqual(flush_buffered_progress(), 1)
+        self.assertEqual(self._stored(), (40, 300))
+
+
+class XPLedgerTests(VideoAPITestCase):
+    """Lesson XP is a ledger entry paid once; totals are F() increments rebuilt from the ledger."""
+
+    def setUp(self):
+        super().setUp()
+        self.course = Course.objects.create(title='Course', is_published=True)
+        self.lessons = [
+            Lesson.objects.create(
+                course=self.course, title=f'Lesson {order}', order=order, time_xp='120.5', video_url='https://example.com/v.mp4'
+            )
+            for order in (1, 2)
+        ]
+
+    def _complete(self, lesson):
+        UserProgress.objects.update_or_create(
+            user=self.user, course=self.course, lesson=lesson, defaults={'watch_percentage': 100}
+        )
+        return self.client.post(reverse('lesson-mark-complete', args=[lesson.id]))
+
+    def _totals(self):
+        return (
+            UserXP.objects.get(user=self.user).total_xp,
+            DailyXP.objects.get(user=self.user).xp_earned,
+        )
+
+    def test_completion_awards_once(self):
+        self.assertEqual(self._complete(self.lessons[0]).data['xp_awarded'], 120)
+        self.assertEqual(self._complete(self.lessons[0]).data['xp_awarded'], 0)
+        self.assertIsNone(award_lesson_xp(self.user.id, self.lessons[0].id, 120))
+        self.assertEqual(XPEvent.objects.get(user=self.user).amount, 120)
+        self.assertEqual(self._totals(), (120, 120))
+
+        self.assertIsNotNone(award_lesson_xp(self.user.id, self.lessons[1].id, 30))
+        self.assertEqual(self._totals(), (150, 150))
+
+    def test_rebuild_restores_totals_from_ledger(self):
+        self._complete(self.lessons[0])
+        self._complete(self.lessons[1])
+        UserXP.objects.filter(user=self.user).update(total_xp=5)
+        DailyXP.objects.filter(user=self.user).delete()
+
+        out = StringIO()
+        call_command('rebuild_xp_totals', '--dry-run', stdout=out)
+        self.assertIn('1 user total(s) and 1 daily row(s) differ from the ledger, 0 would be lowered', out.getvalue())
+        self.assertEqual(UserXP.objects.get(user=self.user).total_xp, 5)
+
+        call_command('rebuild_xp_totals', stdout=StringIO())
+        self.assertEqual(self._totals(), (240, 240))
+
+    def test_legacy_xp_survives_rebuild(self):
+        self._complete(self.lessons[0])
+        # XP from before the ledger: a deleted lesson's award and an older day
+        UserXP.objects.filter(user=self.user).update(total_xp=500)
+        DailyXP.objects.create(user=self.user, date=date(2025, 1, 2), xp_earned=300)
+
+        out = StringIO()
+        call_command('rebuild_xp_totals', stdout=out)
+        self.assertIn('would be lowered; nothing written', out.getvalue())
+        self.assertEqual(UserXP.objects.get(user=self.user).total_xp, 500)
+
+        self.assertEqual(seed_legacy_adjustments(), 2)
+        self.assertEqual(rebuild_xp_totals()[2], 0)
+        self.assertEqual(UserXP.objects.get(user=self.user).total_xp, 500)
+        self.assertEqual(DailyXP.objects.get(user=self.user, date=date(2025, 1, 2)).xp_earned, 300)
+
+
+class LessonMetadataTests(VideoAPITestCase):
+    """xp_value and duration_seconds follow the display strings and back XP and duration rollups."""
+
+    def test_parsers(self):
+        self.assertEqual(parse_xp_value('451.02'), 451)
+        self.assertEqual(parse_xp_value('XP: 30'), 30)
+        self.assertEqual(parse_xp_value('-5'), 0)
+        self.assertEqual(parse_xp_value(''), 0)
+        for text, seconds in [
+            ('1:45 min', 105), ('1:02:03', 3723), ('1:30 h', 5400), ('1h 5m', 3900),
+            ('12 min', 720), ('90 sec', 90), ('7', 420), ('n/a', 0), ('', 0),
+        ]:
+            self.assertEqual(parse_duration_seconds(text), seconds, text)
+
+    def test_save_keeps_numbers_in_sync_and_feeds_rollups(self):
+        course = Course.objects.create(title='Course', is_published=True)
+        lesson = Lesson.objects.create(course=course, title='Intro', order=1, duration='1:45 min', time_xp='80.9')
+        Lesson.objects.create(course=course, title='Next', order=2, duration='2 min')
+        self.assertEqual((lesson.duration_seconds, lesson.xp_value), (105, 80))
+
+        lesson.time_xp = '25'
+        lesson.save(update_fields=['time_xp'])
+        lesson.refresh_from_db()
+        self.assertEqual(lesson.xp_value, 25)
+
+        listed = self.client.get(reverse('course-list')).data
+        self.assertEqual(listed[0]['total_duration_seconds'], 225)
+        detail = self.client.get(reverse('course-detail', args=[course.id])).data
+        self.assertEqual(detail['total_duration_seconds'], 225)
+        self.assertEqual(detail['lessons'][0]['xp_value'], 25)
+
+        UserProgress.objects.create(user=self.user, course=course, lesson=lesson, watch_percentage=100)
+        response = self.client.post(reverse('lesson-mark-complete', args=[lesson.id]))
+        self.assertEqual(response.data['xp_awarded'], 25)
+
+    def test_backfill_command_fixes_rows_written_around_save(self):
+        course = Course.objects.create(title='Course', is_published=True)
+        lesson = Lesson.objects.create(course=course, title='Intro', order=1, duration='3 min', time_xp='10')
+        Lesson.objects.filter(pk=lesson.pk).update(duration='4 min', time_xp='soon')
+
+        out = StringIO()
+        call_command('backfill_lesson_metadata', '--dry-run', stdout=out)
+        self.assertIn("no XP in time_xp 'soon'", out.getvalue())
+        self.assertIn('1 lesson(s) out of date', out.getvalue())
+
+        call_command('backfill_lesson_metadata', stdout=StringIO())
+        lesson.refresh_from_db()
+        self.assertEqual((lesson.duration_seconds, lesson.xp_value), (240, 0))
+
+class CertificateTests(VideoAPITestCase):
+    """Certificates are rendered once, stored under a deterministic key and revalidated by ETag."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        storage_override = override_settings(MEDIA_ROOT=self.media_root)
+        storage_override.enable()
+        self.addCleanup(storage_override.disable)
+
+        self.course = Course.objects.create(title='Course', is_published=True)
+        lesson = Lesson.objects.create(course=self.course, title='Intro', order=1, video_url='https://example.com/v.mp4')
+        UserProgress.objects.create(user=self.user, course=self.course, lesson=lesson, watch_percentage=100)
+        self.client.post(reverse('lesson-mark-complete', args=[lesson.id]))
+        self.url = reverse('course-certificate-download', args=[self.course.id])
+
+    def test_download_renders_once_and_answers_304(self):
+        with mock.patch('video.certificates.render_certificate_pdf', wraps=render_certificate_pdf) as render:
+            first = self.client.get(self.url)
+            second = self.client.get(self.url)
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(b''.join(first.streaming_content), b''.join(second.streaming_content))
+        self.assertTrue(first['Content-Disposition'].startswith('attachment'))
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_racing_store_keeps_one_file(self):
+        progress = UserProgress.objects.get(user=self.user, course=self.course)
+        data = build_certificate_data(self.user, self.course, 1, 1, progress.completed_at)
+        pdf_bytes = render_certificate_pdf(data)
+        # Both requests saw the key missing before either saved.
+        self.assertEqual([store_certificate(data, pdf_bytes) for _ in range(2)], [data.storage_key] * 2)
+        self.assertEqual(len(default_storage.listdir(os.path.dirname(data.storage_key))[1]), 1)
+
+    def test_bulk_command_issues_the_same_file_and_resumes(self):
+        other = User.objects.create_user(username='other', password='pass12345')
+        UserProgress.objects.create(user=other, course=self.course, lesson=self.course.lessons.get(), completed=False)
+
+        call_command('issue_certificates', course_ids=[self.course.id], workers=1, stdout=StringIO())
+        progress = UserProgress.objects.get(user=self.user, course=self.course)
+        data = build_certificate_data(self.user, self.course, 1, 1, progress.completed_at)
+        with default_storage.open(data.storage_key, 'rb') as stored:
+            self.assertEqual(stored.read(), render_certificate_pdf(data))
+        self.assertFalse(default_storage.exists(f'certificates/{other.id}'))
+
+        out = StringIO()
+        call_command('issue_certificates', course_ids=[self.course.id], workers=1, stdout=out)
+        self.assertIn('1 already issued, 0 to issue', out.getvalue())
+
+
+@override_settings(
+    AZURE_ACCOUNT_NAME='scopiotest',
+    AZURE_ACCOUNT_KEY='c2NvcGlvLXRlc3Qta2V5LXNjb3Bpby10ZXN0LWtleQ==',
+    VIDEO_STREAM_MODE='redirect',
+)
+class StreamRedirectTests(VideoAPITestCase):
+    """Redirect mode answers with a signed blob URL; ?mode=proxy keeps the proxy path."""
+
+    def setUp(self):
+        super().setUp()
+        course = Course.objects.create(title='Course', is_published=True)
+        self.lesson = Lesson.objects.create(
+            course=course, title='Intro', order=1,
+            video_url='https://scopiotest.blob.core.windows.net/videos/intro lesson.mp4',
+        )
+        self.url = reverse('lesson-stream', args=[self.lesson.id])
+
+    def test_redirects_to_cached_signed_url(self):
+        first = self.client.get(self.url)
+        second = self.client.get(self.url)
+        self.assertEqual(first.status_code, 302)
+        self.assertTrue(first['Location'].startswith(
+            'https://scopiotest.blob.core.windows.net/videos/intro%20lesson.mp4?'
+        ))
+        self.assertIn('sig=', first['Location'])
+        self.assertIn('sp=r', first['Location'])
+        self.assertEqual(first['Location'], second['Location'])
+
+    def test_anonymous_users_get_no_signed_url(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+        request = AsyncRequestFactory().get('/stream/', {'mode': 'redirect'})
+        self.assertEqual(async_to_sync(stream_lesson)(request, pk=self.lesson.pk).status_code, 401)
+
+    def test_proxy_fallbacks(self):
+        with mock.patch('video.views.get_upstream_session') as session:
+            session.return_value.get.side_effect = requests.ConnectionError
+            self.assertEqual(self.client.get(self.url, {'mode': 'proxy'}).status_code, 502)
+
+            self.lesson.stream_mode = 'proxy'
+            self.lesson.save()
+            self.assertEqual(self.client.get(self.url).status_code, 502)
+
+            self.lesson.stream_mode = ''
+            self.lesson.video_url = 'https://otheraccount.blob.core.windows.net/videos/intro.mp4'
+            self.lesson.save()
+            self.assertEqual(self.client.get(self.url).status_code, 502)
+
+
+class _TrackedUpstreamBody(httpx.AsyncByteStream):
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def aclose(self):
+        self.closed = True
+
+
+class AsyncStreamTests(TestCase):
+    """The async stream view relays upstream bytes and releases the upstream on early close."""
+
+    def setUp(self):
+        self.lesson = Lesson.objects.create(
+            course=Course.objects.create(title='Course', is_published=True),
+            title='Intro', order=1, video_url='https://scopiotest.blob.core.windows.net/videos/intro.mp4',
+        )
+        self.upstream_requests = []
+        self.chunks = [b'a' * STREAM_CHUNK_SIZE, b'b' * STREAM_CHUNK_SIZE]
+        self.body = _TrackedUpstreamBody(self.chunks)
+
+        def handler(request):
+            self.upstream_requests.append(request)
+            return httpx.Response(
+                206, stream=self.body,
+                headers={'Content-Type': 'video/mp4', 'Content-Range': 'bytes 0-131071/262144'},
+            )
+
+        patcher = mock.patch(
+            'video.async_stream._build_client',
+            lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _request(self, **kwargs):
+        return AsyncRequestFactory().get('/stream/', **kwargs)
+
+    async def test_relays_range_response(self):
+        response = await stream_lesson(self._request(headers={'Range': 'bytes=0-131071'}), pk=self.lesson.pk)
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 0-131071/262144')
+        self.assertEqual(response['X-Accel-Buffering'], 'no')
+        self.assertEqual(self.upstream_requests[0].headers['x-ms-range'], 'bytes=0-131071')
+        self.assertEqual(b''.join([chunk async for chunk in response]), b''.join(self.chunks))
+        self.assertTrue(self.body.closed)
+
+    async def test_early_disconnect_closes_upstream(self):
+        response = await stream_lesson(self._request(), pk=self.lesson.pk)
+        content = aiter(response)
+        self.assertEqual(await anext(content), self.chunks[0])
+        await content.aclose()
+        self.assertTrue(self.body.closed)
+
+    @override_settings(VIDEO_STREAM_MAX_PER_USER=1)
+    async def test_jwt_users_are_capped_per_user_not_per_ip(self):
+        users = [
+            await User.objects.acreate_user(username=name, password='pass12345') for name in ('first', 'second')
+        ]
+        responses = [
+            await stream_lesson(
+                self._request(headers={'Authorization': f'Bearer {AccessToken.for_user(user)}'}), pk=self.lesson.pk
+            )
+            for user in users
+        ]
+        self.assertEqual([response.status_code for response in responses], [206, 206])
+        bad_token = self._request(headers={'Authorization': 'Bearer nope'})
+        self.assertEqual((await stream_lesson(bad_token, pk=self.lesson.pk)).status_code, 401)
+        for response in responses:
+            await sync_to_async(response.close)()
+
+    async def test_response_closed_before_iteration_frees_slot(self):
+        response = await stream_lesson(self._request(), pk=self.lesson.pk)
+        self.assertEqual(get_stream_gauges()['process_active'], 1)
+        await sync_to_async(response.close)()
+        self.assertTrue(self.body.closed)
+        self.assertEqual(get_stream_gauges()['process_active'], 0)
+
+
+class _FakeBlobSession:
+    """Serves byte ranges of an in-memory blob the way Azure does, counting GETs."""
+
+    def __init__(self, blob, delay=0):
+        self.blob = blob
+        self.delay = delay
+        self.ranges = []
+
+    def get(self, url, headers=None, timeout=None, **kwargs):
+        first, last = headers['Range'][len('bytes='):].split('-')
+        first, last = int(first), min(int(last), len(self.blob) - 1)
+        self.ranges.append((first, last))
+        time.sleep(self.delay)
+        return mock.Mock(
+            status_code=206,
+            content=self.blob[first:last + 1],
+            headers={
+                'Content-Range': f'bytes {first}-{last}/{len(self.blob)}',
+                'ETag': '"0x1"',
+                'Content-Type': 'video/mp4',
+            },
+        )
+
+
+class ChunkCacheTests(VideoAPITestCase):
+    """Stream ranges are assembled from aligned on-disk chunks fetched once."""
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        cache_override = override_settings(
+            VIDEO_CHUNK_CACHE_DIR=self.cache_dir, VIDEO_CHUNK_SIZE=100, VIDEO_CHUNK_CACHE_MAX_BYTES=1000,
+        )
+        cache_override.enable()
+        self.addCleanup(cache_override.disable)
+
+        self.blob = bytes(range(256)) * 2
+        self.session = _FakeBlobSession(self.blob)
+        patcher = mock.patch('video.chunk_cache.get_upstream_session', return_value=self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        lesson = Lesson.objects.create(
+            course=Course.objects.create(title='Course', is_published=True), title='Intro', order=1,
+            video_url='https://scopiotest.blob.core.windows.net/videos/intro.mp4',
+        )
+        self.url = reverse('lesson-stream', args=[lesson.id])
+
+    def test_ranges_are_assembled_from_cached_chunks(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=150-349')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 150-349/512')
+        self.assertEqual(b''.join(response.streaming_content), self.blob[150:350])
+        self.assertEqual(self.session.ranges, [(100, 199), (200, 299), (300, 399)])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=210-260')
+        self.assertEqual(b''.join(response.streaming_content), self.blob[210:261])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-12')
+        self.assertEqual(b''.join(response.streaming_content), self.blob[500:])
+        self.assertEqual(self.session.ranges[3:], [(500, 511)])
+
+    def test_concurrent_misses_share_one_fetch_and_cache_is_bounded(self):
+        video_url = 'https://scopiotest.blob.core.windows.net/videos/intro.mp4'
+        chunk_cache = get_chunk_cache()
+        etag = chunk_cache.load_meta(video_url)['etag']
+
+        def read_chunk():
+            with chunk_cache.open_chunk(video_url, etag, 3) as chunk_file:
+                self.assertEqual(chunk_file.read(), self.blob[300:400])
+
+        self.session.delay = 0.2
+        threads = [threading.Thread(target=read_chunk) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.session.ranges, [(0, 99), (300, 399)])
+
+        self.session.delay = 0
+        for index in range(20):
+            chunk_cache.load_meta(f'https://scopiotest.blob.core.windows.net/videos/{index}.mp4')
+        cached_bytes = sum(
+            os.path.getsize(os.path.join(directory, name))
+            for directory, _, names in os.walk(self.cache_dir) for name in names if name.endswith('.chunk')
+        )
+        self.assertLessEqual(cached_bytes, 1000)
+
+
+class BlobMetadataCacheTests(VideoAPITestCase):
+    """HEAD and If-None-Match are answered from cached blob metadata."""
+
+    def setUp(self):
+        super().setUp()
+        self.lesson = Lesson.objects.create(
+            course=Course.objects.create(title='Course', is_published=True), title='Intro', order=1,
+            video_url='https://scopiotest.blob.core.windows.net/videos/intro.mp4',
+        )
+        self.url = reverse('lesson-stream', args=[self.lesson.id])
+        self.session = mock.Mock()
+        self.session.head.return_value = mock.Mock(
+            status_code=200, headers={'Content-Length': '512', 'ETag': '"0x1"', 'Content-Type': 'video/mp4'},
+        )
+        self.session.get.return_value = mock.Mock(
+            status_code=206,
+            headers={'Content-Range': 'bytes 0-9/600', 'ETag': '"0x2"', 'Content-Type': 'video/mp4'},
+            iter_content=mock.Mock(return_value=iter([b'0123456789'])),
+        )
+        patcher = mock.patch('video.views.get_upstream_session', return_value=self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_head_and_revalidation_skip_upstream(self):
+        self.assertEqual(self.client.head(self.url)['Content-Length'], '512')
+        response = self.client.head(self.url)
+        self.assertEqual((response['ETag'], response['Content-Length']), ('"0x1"', '512'))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"0x1"').status_code, 304)
+        self.assertEqual(self.session.head.call_count, 1)
+        self.session.get.assert_not_called()
+
+    def test_new_etag_on_get_and_video_url_change_refresh_metadata(self):
+        self.client.head(self.url)
+        b''.join(self.client.get(self.url, HTTP_RANGE='bytes=0-9').streaming_content)
+        response = self.client.head(self.url)
+        self.assertEqual((response['ETag'], response['Content-Length']), ('"0x2"', '600'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lesson.video_url = 'https://scopiotest.blob.core.windows.net/videos/intro-v2.mp4'
+            self.lesson.save()
+        self.client.head(self.url)
+        self.assertEqual(self.session.head.call_count, 2)
+        self.assertIsNone(get_blob_metadata('https://scopiotest.blob.core.windows.net/videos/intro.mp4'))
+
+
+class HlsManifestTests(VideoAPITestCase):
+    """Packaged lessons play from their HLS manifest; others keep the stream proxy."""
+
+    def test_playback_url_prefers_manifest_until_video_changes(self):
+        course = Course.objects.create(title='Course', is_published=True)
+        lesson = Lesson.objects.create(
+            course=course, title='Intro', order=1,
+            video_url='https://scopiotest.blob.core.windows.net/videos/intro.mp4',
+            hls_manifest_url='https://scopiotest.blob.core.windows.net/videos/intro_hls/master.m3u8',
+        )
+        url = reverse('lesson-detail', args=[lesson.id])
+        self.assertEqual(self.client.get(url).data['playback_url'], lesson.hls_manifest_url)
+
+        lesson.video_url = 'https://scopiotest.blob.core.windows.net/videos/intro-v2.mp4'
+        lesson.save()
+        lesson.refresh_from_db()
+        self.assertEqual(lesson.hls_manifest_url, '')
+        self.assertTrue(self.client.get(url).data['playback_url'].endswith(f'/lessons/{lesson.id}/stream/'))
+
+    def test_ffmpeg_command_maps_each_rendition(self):
+        ladder = [rung for rung in DEFAULT_LADDER if rung[0] in ('720p', '360p')]
+        cmd = PackageLessonHlsCommand()._ffmpeg_command('ffmpeg', 'in.mp4', Path('/out'), ladder, 6, True)
+        self.assertIn('[0:v]split=2[v0][v1];[v0]scale=-2:720[v0out];[v1]scale=-2:360[v1out]', cmd)
+        self.assertEqual(cmd[cmd.index('-var_stream_map') + 1], 'v:0,a:0,name:720p v:1,a:1,name:360p')
+        self.assertEqual(cmd[-1], '/out/%v/index.m3u8')
+
+
+@override_settings(VIDEO_STREAM_MAX_PER_PROCESS=2, VIDEO_STREAM_MAX_PER_USER=1, VIDEO_STREAM_RETRY_AFTER=7)
+class StreamAdmissionTests(VideoAPITestCase):
+    """Streams beyond the per-user or per-process cap get 503 until a slot is freed."""
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('lesson-stream', args=[Lesson.objects.create(
+            course=Course.objects.create(title='Course', is_published=True), title='Intro', order=1,
+            video_url='https://scopiotest.blob.core.windows.net/videos/intro.mp4',
+        ).id])
+        session = mock.Mock()
+        session.get.side_effect = lambda *args, **kwargs: mock.Mock(
+            status_code=200, headers={'Content-Type': 'video/mp4'},
+            iter_content=mock.Mock(return_value=iter([b'video'])),
+        )
+        patcher = mock.patch('video.views.get_upstream_session', return_value=session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_caps_answer_503_until_stream_closes(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        busy = self.client.get(self.url)
+        self.assertEqual(busy.status_code, 503)
+        self.assertEqual(busy['Retry-After'], '7')
+
+        other = User.objects.create_user(username='other', password='pass12345')
+        self.client.force_authenticate(other)
+        second = self.client.get(self.url)
+        self.assertEqual(second.status_code, 200)
+        self.client.force_authenticate(User.objects.create_user(username='third', password='pass12345'))
+        self.assertEqual(self.client.get(self.url).status_code, 503)
+
+        self.assertEqual(b''.join(first.streaming_content), b'video')
+        third = self.client.get(self.url)
+        self.assertEqual(third.status_code, 200)
+        second.close()
+
+        self.client.force_authenticate(User.objects.create_user(username='staff', password='pass12345', is_staff=True))
+        gauges = self.client.get(reverse('stream-stats')).data['active_streams']
+        self.assertEqual((gauges['process_active'], gauges['process_limit']), (1, 2))
+        third.close()
+
+    @override_settings(GUNICORN_THREADS=6)
+    def test_process_cap_defaults_to_threads_minus_two(self):
+        del settings.VIDEO_STREAM_MAX_PER_PROCESS
+        self.assertEqual(get_stream_gauges()['process_limit'], 4)
+
+    def test_attach_keeps_file_responses_zero_copy(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        slot = acquire_stream_slot(request)
+        handle = tempfile.TemporaryFile()
+        handle.write(b'chunk')
+        handle.seek(0)
+        response = slot.attach(FileResponse(handle))
+        self.assertIs(response.file_to_stream, handle)
+        self.assertEqual(get_stream_gauges()['process_active'], 1)
+        response.close()
+        self.assertEqual(get_stream_gauges()['process_active'], 0)
+
+
+class StreamMetricTests(VideoAPITestCase):
+    """Proxied streams are measured, flushed in batches and summarized per lesson."""
+
+    def setUp(self):
+        super().setUp()
+        flush_stream_metrics()
+        self.lesson = Lesson.objects.create(
+            course=Course.objects.create(title='Course', is_published=True), title='Intro', order=1,
+            video_url='https://scopiotest.blob.core.windows.net/videos/intro.mp4',
+        )
+        self.url = reverse('lesson-stream', args=[self.lesson.id])
+        session = mock.Mock()
+        session.get.side_effect = lambda *args, **kwargs: mock.Mock(
+            status_code=206, headers={'Content-Type': 'video/mp4', 'Content-Range': 'bytes 100-109/1000'},
+            iter_content=mock.Mock(return_value=iter([b'video', b'bytes'])),
+        )
+        session.head.return_value = mock.Mock(status_code=200, headers={'Content-Length': '1000'})
+        patcher = mock.patch('video.views.get_upstream_session', return_value=session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(VIDEO_STREAM_METRICS_BATCH=100)
+    def test_stream_is_recorded_and_reported(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-109')
+        self.assertEqual(b''.join(response.streaming_content), b'videobytes')
+        response.close()
+        aborted = self.client.get(self.url)
+        next(iter(aborted.streaming_content))
+        aborted.close()
+
+        self.assertFalse(StreamMetric.objects.exists())
+        self.assertEqual(flush_stream_metrics(), 2)
+        complete, cut_off = StreamMetric.objects.order_by('id')
+        self.assertEqual(
+            (complete.lesson_id, complete.range_start, complete.status_code, complete.bytes_sent, complete.aborted),
+            (self.lesson.id, 100, 206, 10, False),
+        )
+        self.assertIsNotNone(complete.ttfb_ms)
+        self.assertEqual((cut_off.range_start, cut_off.bytes_sent, cut_off.aborted), (0, 5, True))
+
+        out = StringIO()
+        call_command('stream_report', lesson=self.lesson.id, stdout=out)
+        self.assertIn(f'Lesson {self.lesson.id} (Intro): 2 streams', out.getvalue())
+        self.assertIn('50% aborted', out.getvalue())
+
+    @override_settings(VIDEO_STREAM_METRICS=False)
+    def test_disabled_metrics_are_not_buffered(self):
+        response = self.client.get(self.url)
+        b''.join(response.streaming_content)
+        response.close()
+        self.assertEqual(flush_stream_metrics(), 0)
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '5')
+        self.end_headers()
+
+    def do_GET(self):
+        self.do_HEAD()
+        self.wfile.write(b'video')
+
+    def log_message(self, *args):
+        pass
+
+
+class UpstreamPoolTests(SimpleTestCase):
+    """The shared upstream session reuses keep-alive connections and counts it."""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _KeepAliveHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/video.mp4'
+
+    def test_second_request_reuses_pooled_connection(self):
+        before = get_upstream_pool_stats()['hosts'].get('127.0.0.1', {'hits': 0, 'misses': 0})
+        session = get_upstream_session()
+        self.assertEqual(session.get(self.url, stream=True).content, b'video')
+        session.head(self.url)
+        after = get_upstream_pool_stats()['hosts']['127.0.0.1']
+
+        self.assertIs(get_upstream_session(), session)
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
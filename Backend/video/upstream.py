@@ -0,0 +1,179 @@
+"""
+Process-wide pooled HTTP client for upstream video hosts (Azure Blob).
+
+Every stream request and seek used to open a fresh TCP+TLS connection. This module
+keeps one ``requests.Session`` per process with a keep-alive pool per host, so range
+requests reuse warm connections. HEAD requests are retried (they are idempotent);
+every method retries connection errors, which happen before anything is sent.
+
+The session is rebuilt in a forked child (gunicorn workers, issue_certificates),
+because pooled sockets must never be shared between processes.
+
+Connection setup time of the calling thread's last request is exposed through
+start_connect_timer()/connect_seconds() for stream telemetry.
+
+Settings (all optional, read with getattr):
+    VIDEO_UPSTREAM_POOL_HOSTS        hosts kept in the pool manager (default 10)
+    VIDEO_UPSTREAM_POOL_MAXSIZE      keep-alive connections per host (default 8)
+    VIDEO_UPSTREAM_CONNECT_TIMEOUT   seconds (default 5)
+    VIDEO_UPSTREAM_READ_TIMEOUT      seconds between bytes on GET (default 120)
+    VIDEO_UPSTREAM_HEAD_TIMEOUT      read timeout for HEAD (default 30)
+    VIDEO_UPSTREAM_HEAD_RETRIES      retries for HEAD (default 2)
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_pool_stats = defaultdict(lambda: {'hits': 0, 'misses': 0})
+
+_thread_state = threading.local()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _record_connection(host, reused):
+    with _stats_lock:
+        _pool_stats[host]['hits' if reused else 'misses'] += 1
+
+
+class _CountingPoolMixin:
+    """Count whether each request got a warm pooled connection or needs a new handshake."""
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout=timeout)
+        # Pooled connections keep their socket; fresh or dropped ones have none yet.
+        _record_connection(self.host, getattr(conn, 'sock', None) is not None)
+        return conn
+
+
+class _TimedConnectionMixin:
+    """Add TCP (and TLS) setup time to the calling thread's connect timer."""
+
+    def connect(self):
+        started = time.monotonic()
+        try:
+            super().connect()
+        finally:
+            _thread_state.connect_seconds = (
+                getattr(_thread_state, 'connect_seconds', 0.0) + time.monotonic() - started
+            )
+
+
+class TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class UpstreamAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools report hit/miss counters."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+
+def _build_session():
+    head_retries = int(_setting('VIDEO_UPSTREAM_HEAD_RETRIES', 2))
+    retry = Retry(
+        total=head_retries,
+        connect=head_retries,
+        read=head_retries,
+        status=head_retries,
+        backoff_factor=0.2,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset({'HEAD'}),
+        raise_on_status=False,
+    )
+    adapter = UpstreamAdapter(
+        pool_connections=int(_setting('VIDEO_UPSTREAM_POOL_HOSTS', 10)),
+        pool_maxsize=int(_setting('VIDEO_UPSTREAM_POOL_MAXSIZE', 8)),
+        # Never make a request thread wait for a pooled slot; overflow connections
+        # are opened and discarded instead.
+        pool_block=False,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_upstream_session():
+    """Return this process's pooled session, creating it on first use (or after fork)."""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+
+def upstream_timeout(method='GET'):
+    """(connect, read) timeout tuple for an upstream request."""
+    connect = float(_setting('VIDEO_UPSTREAM_CONNECT_TIMEOUT', 5))
+    if method == 'HEAD':
+        return connect, float(_setting('VIDEO_UPSTREAM_HEAD_TIMEOUT', 30))
+    return connect, float(_setting('VIDEO_UPSTREAM_READ_TIMEOUT', 120))
+
+
+def start_connect_timer():
+    """Reset this thread's connect timer before an upstream request."""
+    _thread_state.connect_seconds = 0.0
+
+
+def connect_seconds():
+    """Connection setup time since start_connect_timer(); 0 when a pooled connection was reused."""
+    return getattr(_thread_state, 'connect_seconds', 0.0)
+
+
+def get_upstream_pool_stats():
+    """Per-host pooled connection hits and misses for this process."""
+    with _stats_lock:
+        hosts = {host: dict(counts) for host, counts in _pool_stats.items()}
+    return {'pid': os.getpid(), 'hosts': hosts}
+
+
+def _reset_after_fork():
+    # Drop (don't close) the parent's session: its sockets belong to the parent.
+    global _session, _session_pid, _session_lock, _stats_lock
+    _session = None
+    _session_pid = None
+    _session_lock = threading.Lock()
+    _stats_lock = threading.Lock()
+    _pool_stats.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
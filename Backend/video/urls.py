@@ -1,5 +1,7 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from .async_stream import stream_lesson
 from .views import (
     VideoViewSet,
     CourseViewSet,
@@ -13,7 +15,9 @@ from .views import (
     user_stats,
     daily_activity,
     mark_welcome_seen,
-    leaderboard
+    leaderboard,
+    search,
+    stream_stats
 )
 
 router = DefaultRouter()
@@ -37,4 +41,11 @@ urlpatterns = [
     path('daily-activity/', daily_activity, name='daily-activity'),
     path('mark-welcome-seen/', mark_welcome_seen, name='mark-welcome-seen'),
     path('leaderboard/', leaderboard, name='leaderboard'),
+    path('search/', search, name='search'),
+    path('stream-stats/', stream_stats, name='stream-stats'),
 ]
+
+if settings.VIDEO_STREAM_ASYNC:
+    # ASGI workers serve the stream with the async view; it must precede the router's
+    # sync lessons/<pk>/stream/ route.
+    urlpatterns.insert(0, path('lessons/<int:pk>/stream/', stream_lesson, name='lesson-stream-async'))
@@ -1,23 +1,50 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
-from django.http import HttpResponse, StreamingHttpResponse
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers, quote_etag
 from django.core.cache import cache
 from django.utils import timezone
-from django.db.models import Avg, Sum, Prefetch
+from django.db.models import Avg, Sum, Count, Prefetch, OuterRef, Subquery, prefetch_related_objects
 from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.db.models.functions import Coalesce
-from io import BytesIO
 from datetime import date, timedelta
-import re
 from urllib.parse import urlparse
 import requests
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.pdfgen import canvas
-from .models import Video, Course, Lesson, Discussion, Resource, UserProgress, UserNotes, Rating, Enrollment, UserXP, DailyXP
+from .models import (
+    Video, Course, Lesson, Discussion, Resource, UserProgress, UserCourseProgress,
+    UserNotes, Rating, Enrollment, UserXP, DailyXP
+)
 from api.avatar_utils import get_profile_image_url
+from .blob import (
+    STREAM_MODE_REDIRECT,
+    blob_head_response,
+    blob_metadata_from_response,
+    get_blob_metadata,
+    get_signed_blob_url,
+    remember_blob_metadata,
+    resolve_stream_mode,
+)
+from .certificates import build_certificate_data, get_or_create_certificate
+from .chunk_cache import serve_cached_range
+from .course_cache import CourseValidator, get_course_detail_payload
+from .pagination import DiscussionCursorPagination
+from .position_buffer import buffer_progress, discard_buffered_progress, overlay_buffered_progress
+from .progress import (
+    apply_progress_events,
+    ensure_course_progress,
+    record_lesson_completion,
+    refresh_course_progress,
+    upsert_progress,
+)
+from .stream_metrics import StreamMeasurement
+from .xp import award_lesson_xp
+from .upstream import connect_seconds, get_upstream_pool_stats, get_upstream_session, start_connect_timer, upstream_timeout
+from .stream_limits import acquire_stream_slot, get_stream_gauges, retry_after_seconds
+from .search import SEARCH_MAX_PAGE_SIZE, SEARCH_PAGE_SIZE, SEARCH_SECTIONS, get_search_backend, search_section
 from .serializers import (
     VideoSerializer,
     CourseListSerializer,
@@ -26,12 +53,18 @@ from .serializers import (
     DiscussionSerializer,
     ResourceSerializer,
     UserProgressSerializer,
+    ProgressEventSerializer,
+    ProgressUpdateSerializer,
+    PROGRESS_BATCH_MAX_EVENTS,
     UserNotesSerializer,
     RatingSerializer,
     EnrollmentSerializer,
     UserXPSerializer,
     DailyXPSerializer,
-
+    DynamicFieldsMixin,
+    get_user_course_rating,
+    get_user_progress_map,
+    parse_field_tree,
 )
 
 
@@ -43,14 +76,77 @@ class VideoViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
 
+# ========== CONDITIONAL GET ==========
+class CourseConditionalGetMixin:
+    """
+    Answer list (filtered by ?course=) and retrieve with 304 from a cheap course
+    validator before anything is serialized. Used by the lesson and resource views.
+    """
+    def _get_validator_course_id(self):
+        if self.action == 'retrieve':
+            lookup = str(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+            if not lookup.isdigit():
+                return None
+            return self.get_queryset().filter(pk=lookup).values_list('course_id', flat=True).first()
+        course_id = self.request.query_params.get('course', '')
+        return int(course_id) if course_id.isdigit() else None
+
+    def _conditional(self, handler, request, *args, **kwargs):
+        course_id = self._get_validator_course_id()
+        validator = CourseValidator.for_course(request, course_id) if course_id else None
+        if validator is None:
+            return handler(request, *args, **kwargs)
+
+        not_modified = validator.not_modified_response(request)
+        if not_modified is not None:
+            return not_modified
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            validator.apply(response)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._conditional(super().retrieve, request, *args, **kwargs)
+
+
+# ========== SPARSE FIELDSETS ==========
+class SparseFieldsetMixin:
+    """
+    Honour ?fields=id,title,lessons.completed and ?expand=resources on list/retrieve.
+    Unrequested fields are dropped from the serializer, so they are never computed;
+    views use wants_field() to skip the prefetches and annotations behind them.
+    """
+    def get_field_tree(self):
+        if not hasattr(self, '_field_tree'):
+            self._field_tree = None
+            if self.action in ('list', 'retrieve'):
+                self._field_tree = parse_field_tree(self.request)
+        return self._field_tree
+
+    def wants_field(self, name):
+        field_tree = self.get_field_tree()
+        return field_tree is None or name in field_tree
+
+    def get_serializer(self, *args, **kwargs):
+        if issubclass(self.get_serializer_class(), DynamicFieldsMixin):
+            kwargs.setdefault('fields', self.get_field_tree())
+        return super().get_serializer(*args, **kwargs)
+
+
 # ========== COURSE VIEWS ==========
-class CourseViewSet(viewsets.ModelViewSet):
+class CourseViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     Course ViewSet
     
     list: GET /api/video/courses/ - Get all courses (for LearningPage)
     retrieve: GET /api/video/courses/{id}/ - Get single course with full details (for CourseVideoPage)
     create/update/destroy: Admin only
+
+    Both reads accept ?fields= (dotted for nested, e.g. lessons.id) and ?expand=.
     """
     queryset = Course.objects.all()
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
@@ -63,23 +159,51 @@ class CourseViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         """Filter published courses for regular users, show all for admins"""
-        discussion_queryset = Discussion.objects.select_related('user')
-        if self.request.user.is_authenticated:
-            discussion_queryset = discussion_queryset.prefetch_related(
-                Prefetch('liked_by', queryset=User.objects.filter(id=self.request.user.id))
-            )
-
-        queryset = Course.objects.prefetch_related(
-            'lessons',
-            Prefetch('discussions', queryset=discussion_queryset),
-            'resources'
-        )
+        if self.action == 'list':
+            # The list only needs counts, so annotate them instead of prefetching the course graph.
+            queryset = self._annotate_progress_counts(Course.objects.all())
+        else:
+            # Detail payloads are served from the shared course cache, which prefetches on a miss.
+            queryset = Course.objects.all()
         
         # Show only published courses to non-admin users
         if not (self.request.user.is_authenticated and self.request.user.is_staff):
             queryset = queryset.filter(is_published=True)
         
         return queryset
+
+    def _annotate_progress_counts(self, queryset):
+        """Annotate lesson totals, summed lesson durations and the current user's completed counts in the same query."""
+        if self.wants_field('total_duration_seconds'):
+            lesson_seconds = Lesson.objects.filter(
+                course=OuterRef('pk')
+            ).order_by().values('course').annotate(total=Sum('duration_seconds')).values('total')
+            queryset = queryset.annotate(
+                lesson_seconds_total=Coalesce(Subquery(lesson_seconds, output_field=models.IntegerField()), 0)
+            )
+
+        wants_progress = self.wants_field('progress_percentage')
+        if not (wants_progress or self.wants_field('total_lessons')):
+            return queryset
+
+        lesson_totals = Lesson.objects.filter(
+            course=OuterRef('pk')
+        ).order_by().values('course').annotate(total=Count('id')).values('total')
+        queryset = queryset.annotate(
+            lesson_total=Coalesce(Subquery(lesson_totals, output_field=models.IntegerField()), 0)
+        )
+
+        if wants_progress and self.request.user.is_authenticated:
+            # One materialized row per course instead of counting UserProgress rows.
+            completed_totals = UserCourseProgress.objects.filter(
+                course=OuterRef('pk'),
+                user=self.request.user
+            ).values('completed_lessons')[:1]
+            queryset = queryset.annotate(
+                user_completed_total=Coalesce(Subquery(completed_totals, output_field=models.IntegerField()), 0)
+            )
+
+        return queryset
     
     def get_serializer_context(self):
         """Pass request to serializer for user-specific data"""
@@ -87,17 +211,33 @@ class CourseViewSet(viewsets.ModelViewSet):
         context['request'] = self.request
         return context
     
-    def get_queryset(self):
-        """Filter published courses for regular users, show all for admins"""
-        queryset = Course.objects.prefetch_related(
-            'lessons', 'discussions', 'resources'
-        )
-        
-        # Show only published courses to non-admin users
-        if not (self.request.user.is_authenticated and self.request.user.is_staff):
-            queryset = queryset.filter(is_published=True)
-        
-        return queryset
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Serve the shared cached course graph with the user's own fields merged on top.
+        Conditional requests are answered with 304 from the validator query alone.
+        """
+        lookup = str(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        validator = None
+        if lookup.isdigit():
+            validator = CourseValidator.for_course(
+                request, lookup, include_user=True, queryset=self.get_queryset()
+            )
+        if validator is not None:
+            not_modified = validator.not_modified_response(request)
+            if not_modified is not None:
+                return not_modified
+
+        course = self.get_object()
+        if self.get_field_tree() is not None:
+            # Sparse reads skip the shared payload and load only the requested relations.
+            relations = [name for name in ('lessons', 'resources') if self.wants_field(name)]
+            if relations:
+                prefetch_related_objects([course], *relations)
+            response = Response(self.get_serializer(course).data)
+        else:
+            content_stamp = validator.content_stamp if validator else None
+            response = Response(get_course_detail_payload(course, request, content_stamp))
+        return validator.apply(response) if validator else response
     
     @action(detail=True, methods=['get'])
     def progress(self, request, pk=None):
@@ -110,25 +250,90 @@ class CourseViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_401_UNAUTHORIZED
             )
         
-        lessons = course.lessons.all()
         progress = UserProgress.objects.filter(
             user=request.user,
             course=course
         ).select_related('lesson')
+        summary = ensure_course_progress(request.user.id, course.id)
         
-        completed_count = progress.filter(completed=True).count()
-        total_count = lessons.count()
-        
-        progress_serializer = UserProgressSerializer(progress, many=True)
+        return Response(self._build_progress(
+            course, progress, summary.completed_lessons, summary.total_lessons
+        ))
+
+    def _build_progress(self, course, progress_rows, completed_count, total_count):
+        """Progress summary shared by the progress and bundle actions"""
+        progress_serializer = UserProgressSerializer(progress_rows, many=True)
         
-        return Response({
+        return {
             'course_id': course.id,
             'course_title': course.title,
             'total_lessons': total_count,
             'completed_lessons': completed_count,
             'progress_percentage': int((completed_count / total_count * 100)) if total_count > 0 else 0,
             'progress_details': progress_serializer.data
-        })
+        }
+
+    @action(detail=True, methods=['get'])
+    def bundle(self, request, pk=None):
+        """
+        Everything CourseVideoPage needs in one response:
+        course detail, progress, notes, the user's rating and enrollment.
+        Sections share one serializer context, so the progress rows and rating are
+        loaded once; user sections are null (notes empty) for anonymous requests.
+        """
+        course = self.get_object()
+        context = self.get_serializer_context()
+        course_payload = get_course_detail_payload(course, request, context=context)
+
+        data = {
+            'course': course_payload,
+            'progress': None,
+            'notes': [],
+            'rating': None,
+            'enrollment': None,
+            'is_enrolled': False,
+        }
+        if not request.user.is_authenticated:
+            return Response(data)
+
+        progress_rows = sorted(
+            get_user_progress_map(context, course.id).values(),
+            key=lambda progress: (progress.lesson.order, progress.lesson_id)
+        )
+        # The rows are already loaded for the lesson overlay, so count them here.
+        data['progress'] = self._build_progress(
+            course,
+            progress_rows,
+            sum(1 for progress in progress_rows if progress.completed),
+            len(course_payload['lessons'])
+        )
+
+        notes = UserNotes.objects.filter(user=request.user, course=course).first()
+        if notes is not None:
+            notes.course = course
+            data['notes'] = [UserNotesSerializer(notes).data]
+
+        rating = get_user_course_rating(context, course.id)
+        if rating is not None:
+            data['rating'] = RatingSerializer(rating, context=context).data
+
+        enrollment = Enrollment.objects.filter(user=request.user, course=course).first()
+        if enrollment is not None:
+            enrollment.course = course
+            # Progress fields come from the progress section instead of per-field counts.
+            enrollment_fields = {
+                name: None for name in EnrollmentSerializer.Meta.fields
+                if name not in ('total_lessons', 'progress_percentage', 'completed_lessons')
+            }
+            data['enrollment'] = {
+                **EnrollmentSerializer(enrollment, context=context, fields=enrollment_fields).data,
+                'total_lessons': data['progress']['total_lessons'],
+                'progress_percentage': data['progress']['progress_percentage'],
+                'completed_lessons': data['progress']['completed_lessons'],
+            }
+            data['is_enrolled'] = True
+
+        return Response(data)
     
     @action(detail=False, methods=['get'])
     def user_stats(self, request):
@@ -145,10 +350,9 @@ class CourseViewSet(viewsets.ModelViewSet):
         )
         
         # Count total lessons completed across all courses
-        total_completed = UserProgress.objects.filter(
-            user=request.user,
-            completed=True
-        ).count()
+        total_completed = UserCourseProgress.objects.filter(
+            user=request.user
+        ).aggregate(total=Coalesce(Sum('completed_lessons'), 0))['total']
         
         # Get enrolled courses count
         enrolled_courses = Enrollment.objects.filter(user=request.user).count()
@@ -166,12 +370,9 @@ class CourseViewSet(viewsets.ModelViewSet):
         """Download certificate only when user completed all lessons in the course."""
         course = self.get_object()
 
-        total_lessons = course.lessons.count()
-        completed_lessons = UserProgress.objects.filter(
-            user=request.user,
-            course=course,
-            completed=True
-        ).count()
+        summary = ensure_course_progress(request.user.id, course.id)
+        total_lessons = summary.total_lessons
+        completed_lessons = summary.completed_lessons
 
         if total_lessons == 0 or completed_lessons < total_lessons:
             return Response(
@@ -184,63 +385,39 @@ class CourseViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        display_name = request.user.get_full_name().strip() or request.user.username
-        issued_on = timezone.now().strftime('%Y-%m-%d')
-        certificate_id = f"CERT-{request.user.id}-{course.id}-{timezone.now().strftime('%Y%m%d')}"
-
-        buffer = BytesIO()
-        pdf = canvas.Canvas(buffer, pagesize=A4)
-        page_width, page_height = A4
-
-        pdf.setFillColor(colors.HexColor('#1F2937'))
-        pdf.setFont('Helvetica-Bold', 28)
-        pdf.drawCentredString(page_width / 2, page_height - 110, 'Certificate of Completion')
-
-        pdf.setStrokeColor(colors.HexColor('#3B82F6'))
-        pdf.setLineWidth(2)
-        pdf.line(90, page_height - 130, page_width - 90, page_height - 130)
-
-        pdf.setFillColor(colors.HexColor('#374151'))
-        pdf.setFont('Helvetica', 14)
-        pdf.drawCentredString(page_width / 2, page_height - 185, 'This certifies that')
-
-        pdf.setFillColor(colors.HexColor('#0EA5E9'))
-        pdf.setFont('Helvetica-Bold', 30)
-        pdf.drawCentredString(page_width / 2, page_height - 240, display_name)
-
-        pdf.setFillColor(colors.HexColor('#111827'))
-        pdf.setFont('Helvetica', 14)
-        pdf.drawCentredString(page_width / 2, page_height - 285, 'has successfully completed all modules of')
-
-        pdf.setFont('Helvetica-Bold', 18)
-        pdf.drawCentredString(page_width / 2, page_height - 320, f'"{course.title}"')
-
-        pdf.setFont('Helvetica', 12)
-        pdf.setFillColor(colors.HexColor('#4B5563'))
-        pdf.drawCentredString(page_width / 2, page_height - 370, f'Completed Modules: {completed_lessons}/{total_lessons}')
-        pdf.drawCentredString(page_width / 2, page_height - 392, f'Issued On: {issued_on}')
-        pdf.drawCentredString(page_width / 2, page_height - 414, f'Certificate ID: {certificate_id}')
-
-        pdf.setStrokeColor(colors.HexColor('#9CA3AF'))
-        pdf.setLineWidth(1)
-        pdf.line(90, 140, page_width - 90, 140)
-        pdf.setFont('Helvetica', 10)
-        pdf.setFillColor(colors.HexColor('#6B7280'))
-        pdf.drawCentredString(page_width / 2, 120, 'Scopio Learning Platform')
-
-        pdf.showPage()
-        pdf.save()
-        pdf_data = buffer.getvalue()
-        buffer.close()
-
-        filename = f"{course.title.strip().replace(' ', '_')}_certificate.pdf"
-        response = HttpResponse(pdf_data, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        completed_at = UserProgress.objects.filter(
+            user=request.user,
+            course=course,
+            completed=True
+        ).aggregate(latest=models.Max('completed_at'))['latest']
+        data = build_certificate_data(request.user, course, completed_lessons, total_lessons, completed_at)
+
+        # The key changes whenever anything printed changes, so it doubles as a strong ETag.
+        etag = quote_etag(data.digest)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is None:
+            key = get_or_create_certificate(data)
+            storage_url = default_storage.url(key)
+            if settings.CERTIFICATE_REDIRECT_TO_STORAGE and storage_url.startswith(('http://', 'https://')):
+                response = HttpResponseRedirect(storage_url)
+            else:
+                response = FileResponse(
+                    default_storage.open(key, 'rb'),
+                    as_attachment=True,
+                    filename=data.filename,
+                    content_type='application/pdf'
+                )
+        else:
+            response = not_modified
+
+        response['ETag'] = etag
+        response['Cache-Control'] = f'private, max-age={settings.CERTIFICATE_CACHE_MAX_AGE}'
+        patch_vary_headers(response, ('Authorization', 'Cookie'))
         return response
 
 
 # ========== LESSON VIEWS ==========
-class LessonViewSet(viewsets.ModelViewSet):
+class LessonViewSet(CourseConditionalGetMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     Lesson/Video ViewSet
     
@@ -262,7 +439,11 @@ class LessonViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['get', 'head'])
     def stream(self, request, pk=None):
-        """Proxy Azure Blob video with byte-range support so browsers can seek efficiently."""
+        """
+        Deliver Azure Blob video. In redirect mode (settings.VIDEO_STREAM_MODE or the
+        lesson's stream_mode) answer with a 302 to a short-lived SAS URL; otherwise, or
+        with ?mode=proxy, proxy the bytes with byte-range support so browsers can seek.
+        """
         lesson = self.get_object()
         video_url = (lesson.video_url or '').strip()
 
@@ -274,9 +455,30 @@ class LessonViewSet(viewsets.ModelViewSet):
         if not hostname.endswith('.blob.core.windows.net'):
             return Response({'error': 'Stream endpoint supports Azure Blob URLs only'}, status=status.HTTP_400_BAD_REQUEST)
 
+        if resolve_stream_mode(lesson, request) == STREAM_MODE_REDIRECT:
+            # A SAS URL works for anyone holding it, so only hand one to signed-in users.
+            if not request.user.is_authenticated:
+                self.permission_denied(request)
+            signed_url = get_signed_blob_url(video_url)
+            if signed_url:
+                # Azure serves the bytes (and ranges) directly; ?mode=proxy stays available
+                # for players or hosts that cannot follow the redirect.
+                response = HttpResponseRedirect(signed_url)
+                response['Cache-Control'] = 'private, max-age=60'
+                return response
+
         incoming_range = request.headers.get('Range') or request.META.get('HTTP_RANGE')
         range_value = incoming_range.strip() if incoming_range else None
 
+        # Cached blob metadata answers revalidations and HEADs without a round trip to Azure.
+        metadata = get_blob_metadata(video_url)
+        if metadata is not None:
+            not_modified = get_conditional_response(request, etag=metadata['etag'])
+            if not_modified is not None:
+                return not_modified
+            if request.method == 'HEAD':
+                return blob_head_response(metadata)
+
         # Handle HEAD requests – browsers send these to check if seeking is supported
         if request.method == 'HEAD':
             head_headers = {}
@@ -284,9 +486,12 @@ class LessonViewSet(viewsets.ModelViewSet):
                 head_headers['Range'] = range_value
                 head_headers['x-ms-range'] = range_value
             try:
-                upstream = requests.head(video_url, headers=head_headers, timeout=(5, 30), allow_redirects=True)
+                upstream = get_upstream_session().head(
+                    video_url, headers=head_headers, timeout=upstream_timeout('HEAD'), allow_redirects=True
+                )
             except requests.RequestException as exc:
                 return HttpResponse(status=502)
+            remember_blob_metadata(video_url, blob_metadata_from_response(upstream.status_code, upstream.headers))
             resp = HttpResponse(status=upstream.status_code,
                                 content_type=upstream.headers.get('Content-Type', 'video/mp4'))
             for h in ['Content-Length', 'Accept-Ranges', 'ETag', 'Last-Modified']:
@@ -296,26 +501,61 @@ class LessonViewSet(viewsets.ModelViewSet):
             resp['Accept-Ranges'] = upstream.headers.get('Accept-Ranges', 'bytes')
             return resp
 
+        # Each proxied stream holds a worker thread until it ends: admit it or answer 503.
+        slot = acquire_stream_slot(request)
+        if slot is None:
+            return Response(
+                {'error': 'Too many active video streams, please retry shortly'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(retry_after_seconds())},
+            )
+        try:
+            return slot.attach(self._stream_body(lesson, video_url, range_value))
+        except BaseException:
+            slot.release()
+            raise
+
+    def _stream_body(self, lesson, video_url, range_value):
+        """GET body of the stream action: the local chunk cache, else the upstream proxy."""
+        # Hot lessons are answered from the local chunk cache when it is enabled.
+        cached_response = serve_cached_range(video_url, range_value)
+        if cached_response is not None:
+            return cached_response
+
         request_headers = {}
         if range_value:
             request_headers['Range'] = range_value
             request_headers['x-ms-range'] = range_value
 
+        measurement = StreamMeasurement(lesson.id, range_value)
+        start_connect_timer()
         try:
-            upstream = requests.get(video_url, headers=request_headers, stream=True, timeout=(5, 120))
+            # Pooled keep-alive session: seeks reuse a warm TLS connection to the blob host.
+            upstream = get_upstream_session().get(
+                video_url, headers=request_headers, stream=True, timeout=upstream_timeout('GET')
+            )
         except requests.RequestException as exc:
+            measurement.upstream_response(status.HTTP_502_BAD_GATEWAY, connect_seconds())
+            measurement.finish(aborted=False)
             return Response({'error': f'Unable to reach video source: {str(exc)}'}, status=status.HTTP_502_BAD_GATEWAY)
+        measurement.upstream_response(upstream.status_code, connect_seconds())
+        # Refreshes the cached metadata when the blob was replaced under the same URL.
+        remember_blob_metadata(video_url, blob_metadata_from_response(upstream.status_code, upstream.headers))
 
         # Smaller chunks improve time-to-first-frame after long seek jumps.
         stream_chunk_size = 64 * 1024
 
         def _stream_chunks():
+            completed = False
             try:
                 for chunk in upstream.iter_content(chunk_size=stream_chunk_size):
                     if chunk:
+                        measurement.sent(len(chunk))
                         yield chunk
+                completed = True
             finally:
                 upstream.close()
+                measurement.finish(aborted=not completed)
 
         downstream_status = upstream.status_code
         content_range = upstream.headers.get('Content-Range')
@@ -368,20 +608,12 @@ class LessonViewSet(viewsets.ModelViewSet):
             )
         
         try:
-            # Get or create progress (must include course to avoid NULL constraints)
-            progress, created = UserProgress.objects.get_or_create(
-                user=request.user,
-                course=lesson.course,
-                lesson=lesson,
-                defaults={
-                    'completed': False,
-                    'watch_percentage': 0,
-                    'video_duration_seconds': 0,
-                    'last_position': 0,
-                    'xp_chunks_awarded': 0
-                }
-            )
-            print(f"{'✅ CREATED' if created else '✅ RETRIEVED'} progress: watch={progress.watch_percentage}%")
+            # Existing row, or one created race-free by a single upsert
+            progress = UserProgress.objects.filter(user=request.user, course=lesson.course, lesson=lesson).first()
+            if progress is None:
+                progress = upsert_progress(request.user.id, lesson.course_id, lesson.id)
+                progress.lesson = lesson
+            print(f"✅ RETRIEVED progress: watch={progress.watch_percentage}%")
                 
         except Exception as e:
             print(f"❌ GET_OR_CREATE failed: {type(e).__name__}: {str(e)}")
@@ -412,9 +644,20 @@ class LessonViewSet(viewsets.ModelViewSet):
             # Mark completion (first-time only)
             if not progress.completed:
                 print(f"✅ First completion - marking complete")
-                progress.completed = True
-                progress.completed_at = timezone.now()
-                progress.save()
+                completed_at = timezone.now()
+                with transaction.atomic():
+                    # Conditional update so concurrent requests count the completion once.
+                    newly_completed = UserProgress.objects.filter(
+                        pk=progress.pk,
+                        completed=False
+                    ).update(completed=True, completed_at=completed_at, updated_at=completed_at)
+                    if newly_completed:
+                        record_lesson_completion(progress)
+                if newly_completed:
+                    progress.completed = True
+                    progress.completed_at = completed_at
+                else:
+                    progress.refresh_from_db(fields=['completed', 'completed_at', 'updated_at'])
                 print(f"✅ Progress marked complete")
             else:
                 print(f"ℹ️ Lesson already completed")
@@ -425,52 +668,22 @@ class LessonViewSet(viewsets.ModelViewSet):
             should_award_xp = (progress.xp_chunks_awarded or 0) == 0
             if should_award_xp:
                 print(f"✅ XP not yet awarded for this lesson progress")
-                print(f"Lesson time_xp value: '{lesson.time_xp}'")
+                # Lesson.xp_value is parsed from time_xp on save (video/lesson_metadata.py)
+                xp_awarded = lesson.xp_value
 
-                if lesson.time_xp:
+                if xp_awarded > 0:
                     try:
-                        xp_text = str(lesson.time_xp).strip()
-                        xp_match = re.search(r'-?\d+(?:\.\d+)?', xp_text)
-                        if xp_match:
-                            xp_value = float(xp_match.group(0))
-                            xp_awarded = int(xp_value)
-                            print(f"✅ XP parsed: {lesson.time_xp} → {xp_awarded}")
+                        with transaction.atomic():
+                            # Ledger insert plus F() increments of UserXP and DailyXP (video/xp.py)
+                            event = award_lesson_xp(request.user.id, lesson.id, xp_awarded)
+                            progress.xp_chunks_awarded = 1
+                            progress.save(update_fields=['xp_chunks_awarded', 'updated_at'])
+                        if event:
+                            invalidate_leaderboard_cache()
                         else:
+                            # Already in the ledger, e.g. paid by a concurrent request
                             xp_awarded = 0
-                            print(f"⚠️ No numeric XP found in time_xp: {lesson.time_xp}")
-
-                        if xp_awarded < 0:
-                            xp_awarded = 0
-                            print(f"⚠️ Negative XP reset to 0")
-                    except (ValueError, TypeError) as ve:
-                        xp_awarded = 0
-                        print(f"⚠️ Invalid XP value: {lesson.time_xp} - Error: {str(ve)}")
-                else:
-                    print(f"⚠️ Lesson has no time_xp value, XP = 0")
-
-                if xp_awarded > 0:
-                    try:
-                        user_xp, _ = UserXP.objects.get_or_create(
-                            user=request.user,
-                            defaults={'has_seen_welcome': False}
-                        )
-                        user_xp.add_xp(xp_awarded)
-                        print(f"✅ XP added to UserXP: {xp_awarded}")
-
-                        today = date.today()
-                        daily_xp, _ = DailyXP.objects.get_or_create(
-                            user=request.user,
-                            date=today
-                        )
-                        daily_xp.xp_earned += xp_awarded
-                        daily_xp.save()
-                        print(f"✅ Daily XP updated: {daily_xp.xp_earned}")
-
-                        progress.xp_chunks_awarded = 1
-                        progress.save(update_fields=['xp_chunks_awarded', 'updated_at'])
                         print(f"✅ Marked XP as awarded for progress {progress.id}")
-
-                        invalidate_leaderboard_cache()
                     except Exception as xpe:
                         print(f"❌ XP Error: {type(xpe).__name__}: {str(xpe)}")
                         import traceback
@@ -520,22 +733,26 @@ class LessonViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_401_UNAUTHORIZED
             )
         
-        last_position = request.data.get('last_position', 0)
-        
-        progress, created = UserProgress.objects.get_or_create(
-            user=request.user,
-            course=lesson.course,
-            lesson=lesson,
-            defaults={
-                'completed': False,
-                'watch_percentage': 0,
-                'video_duration_seconds': 0,
-                'last_position': last_position
-            }
-        )
+        serializer = ProgressUpdateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {'error': 'Invalid progress data', 'details': serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        last_position = serializer.validated_data['last_position'] or 0
         
-        progress.last_position = last_position
-        progress.save()
+        # Position-only heartbeat: buffered when the row exists (video/position_buffer.py),
+        # otherwise written with a single upsert.
+        progress = UserProgress.objects.filter(user=request.user, course=lesson.course, lesson=lesson).first()
+        if progress is not None:
+            overlay_buffered_progress(request.user.id, [progress])
+            progress.last_position = last_position
+        if progress is None or not buffer_progress(
+            request.user.id, lesson.course_id, lesson.id, last_position, progress.watch_percentage
+        ):
+            progress = upsert_progress(request.user.id, lesson.course_id, lesson.id, last_position=last_position)
+            progress.lesson = lesson
+            discard_buffered_progress(request.user.id, [lesson.id])
         
         serializer = UserProgressSerializer(progress)
         return Response(serializer.data)
@@ -566,44 +783,45 @@ class LessonViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_401_UNAUTHORIZED
             )
         
-        watch_percentage = request.data.get('watch_percentage', 0)
-        video_duration = request.data.get('video_duration', 0)
-        last_position = int(request.data.get('last_position', 0) or 0)
-        print(f"Request data: watch_percentage={watch_percentage}, video_duration={video_duration}, last_position={last_position}s")
-        
-        # Validate input
-        if not isinstance(watch_percentage, (int, float)) or watch_percentage < 0 or watch_percentage > 100:
-            print(f"❌ Invalid watch_percentage: {watch_percentage}")
+        serializer = ProgressUpdateSerializer(data=request.data)
+        if not serializer.is_valid():
             return Response(
-                {'error': 'watch_percentage must be between 0-100'},
+                {'error': 'Invalid progress data', 'details': serializer.errors},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        watch_percentage = serializer.validated_data['watch_percentage']
+        video_duration = serializer.validated_data['video_duration']
+        last_position = serializer.validated_data['last_position'] or 0
+        print(f"Request data: watch_percentage={watch_percentage}, video_duration={video_duration}, last_position={last_position}s")
         
         try:
-            print(f"Get_or_create: user={request.user.id}, course={lesson.course_id}, lesson={lesson.id}")
-            progress, created = UserProgress.objects.get_or_create(
-                user=request.user,
-                course=lesson.course,
-                lesson=lesson,
-                defaults={
-                    'completed': False,
-                    'watch_percentage': 0,
-                    'video_duration_seconds': 0,
-                    'last_position': 0,
-                    'xp_chunks_awarded': 0
-                }
-            )
-            print(f"{'✅ CREATED' if created else '✅ RETRIEVED'} progress record: {progress.id}")
+            progress = UserProgress.objects.filter(user=request.user, course=lesson.course, lesson=lesson).first()
+            print(f"{'✅ RETRIEVED' if progress else '✅ NEW'} progress record: {progress.id if progress else '-'}")
             
-            # Update progress
-            old_val = progress.watch_percentage
-            progress.watch_percentage = max(progress.watch_percentage, int(watch_percentage))
-            if video_duration > 0:
-                progress.video_duration_seconds = video_duration
-            if last_position >= 0:
-                progress.last_position = last_position
-            progress.save()
-            print(f"✅ Progress saved: {old_val}% → {progress.watch_percentage}%")
+            # Merge with any heartbeat still in the write-behind buffer
+            if progress is not None:
+                overlay_buffered_progress(request.user.id, [progress])
+            old_val = progress.watch_percentage if progress else 0
+            new_val = max(old_val, watch_percentage)
+            position = last_position
+            duration_changed = video_duration > 0 and (progress is None or progress.video_duration_seconds != video_duration)
+            # Reaching 90% is persisted at once so mark_complete sees it; plain position
+            # and percentage moves are buffered.
+            crossed_completion = new_val >= 90 and old_val < 90
+            if progress is None or crossed_completion or duration_changed or not buffer_progress(
+                request.user.id, lesson.course_id, lesson.id, position, new_val
+            ):
+                progress = upsert_progress(
+                    request.user.id, lesson.course_id, lesson.id,
+                    watch_percentage=new_val,
+                    last_position=position,
+                    video_duration_seconds=video_duration if video_duration > 0 else 0,
+                )
+                progress.lesson = lesson
+                discard_buffered_progress(request.user.id, [lesson.id])
+                print(f"✅ Progress saved: {old_val}% → {progress.watch_percentage}%")
+            else:
+                progress.watch_percentage, progress.last_position = new_val, position
             
             # Serialize response
             serializer = UserProgressSerializer(progress)
@@ -628,20 +846,25 @@ class LessonViewSet(viewsets.ModelViewSet):
 
 
 # ========== DISCUSSION VIEWS ==========
-class DiscussionViewSet(viewsets.ModelViewSet):
+class DiscussionViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     Discussion/Comments ViewSet
     
     Filter by course: GET /api/video/discussions/?course={course_id}
+    Newest first, keyset paginated: follow `next` or pass ?cursor={next_cursor}
+    (course detail embeds the first page and its discussions_next_cursor)
     """
     queryset = Discussion.objects.all()
     serializer_class = DiscussionSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = DiscussionCursorPagination
     
     def get_queryset(self):
         """Filter by course if provided"""
-        queryset = Discussion.objects.select_related('course', 'user')
-        if self.request.user.is_authenticated:
+        queryset = Discussion.objects.select_related('course')
+        if self.wants_field('author_profile_image_url'):
+            queryset = queryset.select_related('user__profile')
+        if self.request.user.is_authenticated and self.wants_field('is_liked'):
             queryset = queryset.prefetch_related(
                 Prefetch('liked_by', queryset=User.objects.filter(id=self.request.user.id))
             )
@@ -663,10 +886,15 @@ class DiscussionViewSet(viewsets.ModelViewSet):
 
             if liked and not currently_liked:
                 discussion.liked_by.add(user)
-                Discussion.objects.filter(pk=discussion.pk).update(likes_count=models.F('likes_count') + 1)
+                # updated_at moves too so course validators in every worker see the new count.
+                Discussion.objects.filter(pk=discussion.pk).update(
+                    likes_count=models.F('likes_count') + 1, updated_at=timezone.now()
+                )
             elif not liked and currently_liked:
                 discussion.liked_by.remove(user)
-                Discussion.objects.filter(pk=discussion.pk, likes_count__gt=0).update(likes_count=models.F('likes_count') - 1)
+                Discussion.objects.filter(pk=discussion.pk, likes_count__gt=0).update(
+                    likes_count=models.F('likes_count') - 1, updated_at=timezone.now()
+                )
 
             discussion.refresh_from_db(fields=['likes_count'])
 
@@ -702,7 +930,7 @@ class DiscussionViewSet(viewsets.ModelViewSet):
 
 
 # ========== RESOURCE VIEWS ==========
-class ResourceViewSet(viewsets.ModelViewSet):
+class ResourceViewSet(CourseConditionalGetMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     Course Resources ViewSet
     
@@ -724,7 +952,7 @@ class ResourceViewSet(viewsets.ModelViewSet):
 
 
 # ========== USER PROGRESS VIEWS ==========
-class UserProgressViewSet(viewsets.ModelViewSet):
+class UserProgressViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     User Progress ViewSet (authenticated users only)
     
@@ -739,9 +967,69 @@ class UserProgressViewSet(viewsets.ModelViewSet):
             user=self.request.user
         ).select_related('course', 'lesson')
     
+    def get_serializer(self, *args, **kwargs):
+        """Show (and on update, keep) positions still in the write-behind buffer"""
+        if args and self.action in ('list', 'retrieve', 'update', 'partial_update'):
+            many = kwargs.get('many', False)
+            rows = overlay_buffered_progress(self.request.user.id, args[0] if many else [args[0]])
+            args = (rows if many else rows[0], *args[1:])
+        return super().get_serializer(*args, **kwargs)
+    
     def perform_create(self, serializer):
         """Auto-set user when creating progress"""
-        serializer.save(user=self.request.user)
+        with transaction.atomic():
+            progress = serializer.save(user=self.request.user)
+            refresh_course_progress(progress.user_id, progress.course_id)
+    
+    def perform_update(self, serializer):
+        """Keep the materialized course progress in sync with direct edits"""
+        previous_course_id = serializer.instance.course_id
+        with transaction.atomic():
+            progress = serializer.save()
+            refresh_course_progress(progress.user_id, progress.course_id)
+            if previous_course_id != progress.course_id:
+                refresh_course_progress(progress.user_id, previous_course_id)
+        discard_buffered_progress(progress.user_id, [progress.lesson_id])
+    
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            refresh_course_progress(instance.user_id, instance.course_id)
+        discard_buffered_progress(instance.user_id, [instance.lesson_id])
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Apply queued player heartbeats in one transaction:
+        POST /api/video/progress/batch/ [{lesson, watch_percentage, last_position, video_duration, client_ts}, ...]
+        Events are collapsed per lesson (highest percentage, newest position).
+        """
+        events = request.data.get('events') if isinstance(request.data, dict) else request.data
+        if not isinstance(events, list):
+            return Response({'error': 'Expected a list of progress events'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(events) > PROGRESS_BATCH_MAX_EVENTS:
+            return Response(
+                {'error': f'At most {PROGRESS_BATCH_MAX_EVENTS} events per batch'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer = ProgressEventSerializer(data=events, many=True)
+        serializer.is_valid(raise_exception=True)
+        rows, unknown = apply_progress_events(request.user.id, serializer.validated_data)
+        discard_buffered_progress(request.user.id, rows)
+        return Response({
+            'events': len(events),
+            'progress': [
+                {
+                    'lesson': lesson_id,
+                    'watch_percentage': progress.watch_percentage,
+                    'last_position': progress.last_position,
+                    'is_video_fully_watched': progress.is_video_fully_watched,
+                }
+                for lesson_id, progress in sorted(rows.items())
+            ],
+            'unknown_lessons': unknown,
+        })
 
 
 # ========== USER NOTES VIEWS ==========
@@ -795,7 +1083,23 @@ class RatingViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         """Auto-set user when creating rating"""
-        serializer.save(user=self.request.user)
+        # Course rating aggregates are kept in step by the Rating signals (video/signals.py).
+        with transaction.atomic():
+            serializer.save(user=self.request.user)
+    
+    def perform_update(self, serializer):
+        """Save the locked row, so the signals read the stored value rather than a stale copy"""
+        with transaction.atomic():
+            serializer.instance = Rating.objects.select_for_update().get(pk=serializer.instance.pk)
+            serializer.save()
+    
+    def perform_destroy(self, instance):
+        """Delete the locked row so the aggregates drop the value actually stored"""
+        with transaction.atomic():
+            locked = Rating.objects.select_for_update().filter(pk=instance.pk).first()
+            if locked is not None:
+                # Otherwise deleted by a concurrent request, which already adjusted the aggregates.
+                locked.delete()
     
     def create(self, request, *args, **kwargs):
         """Create or update rating (one rating per user per course)"""
@@ -816,9 +1120,9 @@ class RatingViewSet(viewsets.ModelViewSet):
         
         if existing_rating:
             # Update existing rating
-            existing_rating.rating = rating_value
-            existing_rating.save()
-            serializer = self.get_serializer(existing_rating)
+            serializer = self.get_serializer(existing_rating, data={'rating': rating_value}, partial=True)
+            serializer.is_valid(raise_exception=True)
+            self.perform_update(serializer)
             return Response(serializer.data)
         
         # Create new rating
@@ -826,7 +1130,7 @@ class RatingViewSet(viewsets.ModelViewSet):
 
 
 # ========== ENROLLMENT VIEWS ==========
-class EnrollmentViewSet(viewsets.ModelViewSet):
+class EnrollmentViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     Course Enrollment ViewSet (authenticated users only)
     
@@ -874,7 +1178,9 @@ class EnrollmentViewSet(viewsets.ModelViewSet):
             defaults={'total_watch_time': watch_time}
         )
         
-        if not created:
+        if created:
+            ensure_course_progress(request.user.id, course.id)
+        else:
             # Update watch time for existing enrollment
             enrollment.total_watch_time += watch_time
             enrollment.save()
@@ -989,21 +1295,16 @@ def user_stats(request):
     # Instead of counting ALL lessons, count enrolled course lessons
     enrolled_course_ids = Enrollment.objects.filter(user=user).values_list('course_id', flat=True)
     
-    # Count completed lessons in enrolled courses (optimized query)
-    completed_count = UserProgress.objects.filter(
+    # Completed and total lessons in enrolled courses from the materialized rows (one query)
+    course_totals = UserCourseProgress.objects.filter(
         user=user,
-        completed=True,
         course_id__in=enrolled_course_ids
     ).aggregate(
-        count=models.Count('id')
-    )['count']
-    
-    # Count total lessons in enrolled courses only
-    total_lesson_count = Lesson.objects.filter(
-        course_id__in=enrolled_course_ids
-    ).aggregate(
-        count=models.Count('id')
-    )['count']
+        completed=Coalesce(Sum('completed_lessons'), 0),
+        total=Coalesce(Sum('total_lessons'), 0)
+    )
+    completed_count = course_totals['completed']
+    total_lesson_count = course_totals['total']
     
     # Calculate progress percentage
     progress = int((completed_count / total_lesson_count * 100)) if total_lesson_count > 0 else 0
@@ -1159,6 +1460,64 @@ def leaderboard(request):
     return response
 
 
+# ========== STREAM DIAGNOSTICS ==========
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def stream_stats(request):
+    """
+    Upstream connection pool counters and active stream gauges for the worker
+    process that answers.
+    GET /api/video/stream-stats/ (staff only)
+    """
+    return Response({'upstream_pool': get_upstream_pool_stats(), 'active_streams': get_stream_gauges()})
+
+
+# ========== SEARCH ==========
+def _positive_int_param(request, name, default, maximum=None):
+    value = request.query_params.get(name, '')
+    value = int(value) if value.isdigit() and int(value) > 0 else default
+    return min(value, maximum) if maximum else value
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticatedOrReadOnly])
+def search(request):
+    """
+    Full-text search across courses, lessons and resources.
+
+    GET /api/video/search/?q=react hooks
+    Optional: ?type=courses|lessons|resources (one section), ?page=, ?page_size=
+    Each section returns {count, next_page, results}; results are ranked and carry
+    <mark>-highlighted, HTML-escaped snippets under `highlights`.
+    """
+    text = request.query_params.get('q', '').strip()
+    if not text:
+        return Response(
+            {'error': 'Query parameter q is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    section = request.query_params.get('type')
+    if section and section not in SEARCH_SECTIONS:
+        return Response(
+            {'error': f"type must be one of: {', '.join(SEARCH_SECTIONS)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    page = _positive_int_param(request, 'page', 1)
+    page_size = _positive_int_param(request, 'page_size', SEARCH_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE)
+    backend = get_search_backend()
+    include_unpublished = request.user.is_authenticated and request.user.is_staff
+
+    return Response({
+        'query': text,
+        'results': {
+            name: search_section(name, text, page, page_size, include_unpublished, backend)
+            for name in ([section] if section else SEARCH_SECTIONS)
+        },
+    })
+
+
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def mark_welcome_seen(request):
@@ -0,0 +1,133 @@
+"""
+XP ledger (XPEvent) and the totals materialized from it.
+
+Every award is one XPEvent row, unique per (user, lesson), so a lesson pays out once
+however many completion requests race. award_lesson_xp() inserts the event and
+bumps UserXP.total_xp and DailyXP.xp_earned with F() expressions in the same
+transaction: a constant handful of statements, no read-modify-write.
+``manage.py rebuild_xp_totals`` recomputes both tables from the ledger in bulk; it
+only lowers totals or drops daily rows with --force.
+
+XP awarded before the ledger existed is carried by "legacy adjustment" events
+(lesson=None, see seed_legacy_adjustments()) so the ledger reproduces the totals.
+"""
+from collections import defaultdict
+from datetime import datetime, time
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailyXP, UserXP, XPEvent
+
+
+def _increment(model, lookup, field, amount, now):
+    """UPDATE field = field + amount for the row at `lookup`, creating it if missing."""
+    changes = {field: F(field) + amount, 'updated_at': now}
+    if model.objects.filter(**lookup).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **{field: amount})
+    except IntegrityError:
+        # Created by a concurrent award in the meantime.
+        model.objects.filter(**lookup).update(**changes)
+
+
+def award_lesson_xp(user_id, lesson_id, amount, awarded_at=None):
+    """
+    Award `amount` XP for a lesson once. Returns the new XPEvent, or None when the
+    lesson already paid out to this user (or there is nothing to award).
+    """
+    if amount <= 0:
+        return None
+    awarded_at = awarded_at or timezone.now()
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                event = XPEvent.objects.create(user_id=user_id, lesson_id=lesson_id, amount=amount, awarded_at=awarded_at)
+        except IntegrityError:
+            return None
+        _increment(UserXP, {'user_id': user_id}, 'total_xp', amount, awarded_at)
+        _increment(DailyXP, {'user_id': user_id, 'date': timezone.localdate(awarded_at)}, 'xp_earned', amount, awarded_at)
+    return event
+
+
+def seed_legacy_adjustments(event_model=XPEvent, profile_model=UserXP, daily_model=DailyXP, batch_size=1000):
+    """
+    Add legacy adjustment events (lesson=None) for XP the totals hold but the ledger
+    does not: awards for lessons or progress rows deleted since, or valued from an
+    older time_xp. One event per DailyXP shortfall, dated that day, then one for any
+    remaining UserXP gap, dated when the profile was created. Migrations pass their
+    historical models. Returns the number of events created.
+    """
+    ledger_daily = defaultdict(int)
+    ledger_total = defaultdict(int)
+    for user_id, amount, awarded_at in event_model.objects.values_list('user_id', 'amount', 'awarded_at').iterator():
+        ledger_daily[(user_id, timezone.localdate(awarded_at))] += amount
+        ledger_total[user_id] += amount
+
+    events = []
+    for user_id, day, earned in daily_model.objects.values_list('user_id', 'date', 'xp_earned').iterator():
+        missing = earned - ledger_daily[(user_id, day)]
+        if missing > 0:
+            awarded_at = timezone.make_aware(datetime.combine(day, time(12)))
+            events.append(event_model(user_id=user_id, lesson=None, amount=missing, awarded_at=awarded_at))
+            ledger_total[user_id] += missing
+    for user_id, total, created_at in profile_model.objects.values_list('user_id', 'total_xp', 'created_at').iterator():
+        missing = total - ledger_total[user_id]
+        if missing > 0:
+            events.append(event_model(user_id=user_id, lesson=None, amount=missing, awarded_at=created_at))
+
+    event_model.objects.bulk_create(events, batch_size=batch_size)
+    return len(events)
+
+
+def rebuild_xp_totals(batch_size=1000, dry_run=False, force=False):
+    """
+    Recompute UserXP.total_xp and every DailyXP row from the ledger. UserXP rows are
+    updated in place (they also hold has_seen_welcome); DailyXP is replaced.
+    Nothing is written when a total or daily row would go down, unless `force`.
+    Returns (UserXP rows changed, DailyXP rows differing, rows that would be lowered).
+    """
+    totals = dict(
+        XPEvent.objects.order_by().values('user_id').annotate(total=Sum('amount')).values_list('user_id', 'total')
+    )
+    daily = {
+        (user_id, day): total
+        for user_id, day, total in XPEvent.objects.annotate(day=TruncDate('awarded_at')).order_by().values(
+            'user_id', 'day'
+        ).annotate(total=Sum('amount')).values_list('user_id', 'day', 'total')
+    }
+
+    with transaction.atomic():
+        now = timezone.now()
+        changed = []
+        lowered = 0
+        for profile in UserXP.objects.select_for_update():
+            total = totals.pop(profile.user_id, 0)
+            if profile.total_xp != total:
+                lowered += total < profile.total_xp
+                profile.total_xp, profile.updated_at = total, now
+                changed.append(profile)
+        created = [UserXP(user_id=user_id, total_xp=total) for user_id, total in totals.items()]
+
+        stored_daily = {
+            (user_id, day): earned
+            for user_id, day, earned in DailyXP.objects.values_list('user_id', 'date', 'xp_earned')
+        }
+        daily_changes = len(set(stored_daily.items()) ^ set(daily.items()))
+        lowered += sum(1 for key, earned in stored_daily.items() if daily.get(key, 0) < earned)
+        if dry_run or (lowered and not force):
+            return len(changed) + len(created), daily_changes, lowered
+
+        UserXP.objects.bulk_update(changed, ['total_xp', 'updated_at'], batch_size=batch_size)
+        UserXP.objects.bulk_create(created, batch_size=batch_size)
+        if daily_changes:
+            DailyXP.objects.all().delete()
+            DailyXP.objects.bulk_create(
+                [DailyXP(user_id=user_id, date=day, xp_earned=total) for (user_id, day), total in daily.items()],
+                batch_size=batch_size,
+            )
+    return len(changed) + len(created), daily_changes, lowered
@@ -60,6 +60,7 @@ const CourseVideoPage = () => {
   const [isVideoPlaying, setIsVideoPlaying] = useState(false);
   const [newDiscussion, setNewDiscussion] = useState('');
   const [submittingDiscussion, setSubmittingDiscussion] = useState(false);
+  const [loadingMoreDiscussions, setLoadingMoreDiscussions] = useState(false);
   const [userRating, setUserRating] = useState(null);
   const [hoverRating, setHoverRating] = useState(0);
   const [userNotes, setUserNotes] = useState('');
@@ -273,39 +274,49 @@ const CourseVideoPage = () => {
     }
   };
 
-  // Fetch course data from API
+  // Load course, notes and enrollment in one round trip
   useEffect(() => {
     if (!courseId) {
       setError('No course ID provided');
       setLoading(false);
       return;
     }
+    // Learning page only lists enrolled courses, so keep playback unblocked while verification completes.
+    if (isFromLearning) {
+      setIsEnrolled(true);
+    }
+    setEnrollmentChecked(false);
 
-    refreshCourseData(true);
-  }, [courseId, refreshCourseData]);
-
-  // Fetch user notes from API
-  useEffect(() => {
-    if (!courseId) return;
-
-    const fetchUserNotes = async () => {
+    const fetchCourseBundle = async () => {
       try {
+        setLoading(true);
         setNotesLoading(true);
-        const response = await api.get(`/video/notes/?course=${courseId}`);
-        if (response.data && response.data.length > 0) {
-          setUserNotes(response.data[0].notes_text || '');
-          setNotesId(response.data[0].id);
+        const response = await api.get(`/video/courses/${courseId}/bundle/`);
+        const { course, notes, is_enrolled: isUserEnrolled } = response.data;
+        setCourseData(course);
+        setUserRating(course.user_rating);
+        if (notes && notes.length > 0) {
+          setUserNotes(notes[0].notes_text || '');
+          setNotesId(notes[0].id);
         }
+        setIsEnrolled(isUserEnrolled);
+        setError(null);
       } catch (err) {
-        console.error('Error fetching notes:', err);
-        // Don't show error, just leave notes empty
+        console.error('Error loading course page:', err);
+        setError('Failed to load course details');
+        // If 401, user is not authenticated, so not enrolled
+        if (err.response?.status === 401) {
+          setIsEnrolled(false);
+        }
       } finally {
+        setLoading(false);
         setNotesLoading(false);
+        setEnrollmentChecked(true);
       }
     };
 
-    fetchUserNotes();
-  }, [courseId]);
+    fetchCourseBundle();
+  }, [courseId, isFromLearning]);
 
   useEffect(() => {
     // ensure main content container is scrolled to top when opening this page
@@ -326,33 +337,6 @@ const CourseVideoPage = () => {
     document.body.scrollTop = 0;
   }, []);
 
-  // Check if user is already enrolled
-  useEffect(() => {
-    if (!courseId) return;
-    // Learning page only lists enrolled courses, so keep playback unblocked while verification completes.
-    if (isFromLearning) {
-      setIsEnrolled(true);
-    }
-    setEnrollmentChecked(false);
-    
-    const checkEnrollment = async () => {
-      try {
-        const response = await api.get('/video/enrollments/');
-        const isUserEnrolled = response.data.some(enrollment => enrollment.course === parseInt(courseId));
-        setIsEnrolled(isUserEnrolled);
-      } catch (err) {
-        // If 401, user is not authenticated, so not enrolled
-        if (err.response?.status === 401) {
-          setIsEnrolled(false);
-        }
-      } finally {
-        setEnrollmentChecked(true);
-      }
-    };
-    
-    checkEnrollment();
-  }, [courseId, isFromLearning]);
-
   // Load YouTube IFrame API
   useEffect(() => {
     // Load YouTube IFrame API script if not already loaded
@@ -923,10 +907,11 @@ const CourseVideoPage = () => {
         comment: newDiscussion
       });
 
-      // Update local state with new discussion
+      // Update local state with new discussion (the list is newest first)
       setCourseData(prev => ({
         ...prev,
-        discussions: [...(prev.discussions || []), response.data]
+        discussions: [response.data, ...(prev.discussions || [])],
+        total_discussions: (prev.total_discussions ?? (prev.discussions || []).length) + 1
       }));
 
       setNewDiscussion('');
@@ -938,6 +923,35 @@ const CourseVideoPage = () => {
     }
   };
 
+  // Course detail embeds only the newest discussions; page through older ones by cursor
+  const handleLoadMoreDiscussions = async () => {
+    const cursor = courseData?.discussions_next_cursor;
+    if (!cursor || loadingMoreDiscussions) return;
+
+    try {
+      setLoadingMoreDiscussions(true);
+      const response = await api.get('/video/discussions/', {
+        params: { course: courseData.id, cursor }
+      });
+
+      setCourseData(prev => {
+        const loadedIds = new Set((prev.discussions || []).map(d => d.id));
+        return {
+          ...prev,
+          discussions: [
+            ...(prev.discussions || []),
+            ...response.data.results.filter(d => !loadedIds.has(d.id))
+          ],
+          discussions_next_cursor: response.data.next_cursor
+        };
+      });
+    } catch (err) {
+      console.error('Error loading more discussions:', err);
+    } finally {
+      setLoadingMoreDiscussions(false);
+    }
+  };
+
   // Handle rating submission
   const handleRatingSubmit = async (rating) => {
     try {
@@ -1411,7 +1425,7 @@ const CourseVideoPage = () => {
               <div className="discussions-section">
                 <div className="discussions-header">
                   <h3>Discussions</h3>
-                  <p className="discussion-count">{discussions.length}</p>
+                  <p className="discussion-count">{courseData?.total_discussions ?? discussions.length}</p>
                 </div>
                 
                 {/* Discussion Input Form */}
@@ -1486,6 +1500,16 @@ const CourseVideoPage = () => {
                       </div>
                     </div>
                   ))}
+                  {courseData?.discussions_next_cursor && (
+                    <button
+                      type="button"
+                      className="discussions-load-more"
+                      onClick={handleLoadMoreDiscussions}
+                      disabled={loadingMoreDiscussions}
+                    >
+                      {loadingMoreDiscussions ? 'Loading...' : 'Load more'}
+                    </button>
+                  )}
                 </div>
               </div>
             </div>